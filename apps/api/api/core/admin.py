@@ -0,0 +1,27 @@
+"""Access control of the admin and debug endpoints"""
+
+import secrets
+from typing import Annotated
+
+from fastapi import Depends, Header, HTTPException
+
+from api.core.config import settings
+
+
+async def require_admin(
+    x_admin_token: Annotated[str | None, Header()] = None,
+) -> None:
+    """
+    Dependency rejecting requests without the configured admin token.
+    Responds as if the endpoint didn't exist while no token is configured.
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token, settings.ADMIN_TOKEN
+    ):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+AdminDep = Depends(require_admin)
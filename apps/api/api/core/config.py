@@ -1,6 +1,29 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class FeedConfig(BaseModel):
+    """An upstream GraphQL endpoint refreshed into its own snapshot"""
+
+    name: str
+    # GRAPHQL_ENDPOINT when unset
+    endpoint: str | None = None
+    modes: list[str] = Field(
+        default_factory=lambda: ["RAIL", "TRAMTRAIN", "SUBURBAN_RAILWAY"]
+    )
+    # Replaces the positions query built for `modes`
+    query: str | None = None
+    # Suffix of the Redis keys of the feed, the name when unset. An empty
+    # namespace uses the unsuffixed keys.
+    namespace: str | None = None
+
+    @property
+    def key_namespace(self) -> str:
+        return self.name if self.namespace is None else self.namespace
+
+
 class Settings(BaseSettings):
     DEBUG: bool = False
     REDIS_HOST: str = "localhost"
@@ -12,9 +35,84 @@ class Settings(BaseSettings):
     GRAPHQL_ENDPOINT: str
     POSTHOG_KEY: str | None = None
 
+    # Feeds refreshed concurrently, as a JSON list. The first one is the
+    # primary feed, whose stations, search and stats documents are served.
+    FEEDS: list[FeedConfig] = [FeedConfig(name="default", namespace="")]
+
     # Caching Constants
     CACHE_DURATION: int = 15 * 60  # 15 minutes
 
+    # Upstream resilience
+    UPSTREAM_TIMEOUT: float = 30.0
+    UPSTREAM_BREAKER_FAILURES: int = 3
+    UPSTREAM_BREAKER_RESET: float = 120.0
+    UPSTREAM_HEDGE_ENABLE: bool = False
+    UPSTREAM_HEDGE_PERCENTILE: float = 0.9
+
+    # Refresh cadence (seconds), adapted between these bounds
+    REFRESH_MIN_INTERVAL: float = 20.0
+    REFRESH_MAX_INTERVAL: float = 60.0
+
+    # Vehicles are processed in this many batches partitioned by vehicle id,
+    # run as taskiq subtasks by the workers of any node. Batches without a
+    # result after REFRESH_PARTITION_TIMEOUT seconds are processed by the
+    # refresh itself. 1 processes every vehicle in the refresh.
+    REFRESH_PARTITIONS: int = 1
+    REFRESH_PARTITION_TIMEOUT: float = 15.0
+
+    # Port of the worker's Prometheus exporter, None disables it
+    METRICS_PORT: int | None = 9100
+
+    # OpenTelemetry tracing. The OTLP exporter reads the standard
+    # OTEL_EXPORTER_OTLP_* variables, the file exporter appends JSON lines.
+    TRACING_ENABLE: bool = False
+    TRACING_EXPORTER: Literal["otlp", "file"] = "otlp"
+    TRACING_FILE_PATH: str = "traces.jsonl"
+    TRACING_SAMPLE_RATIO: float = 0.05
+    TRACING_REFRESH_SAMPLE_RATIO: float = 1.0
+
+    # Per-vehicle processing cost tracking, published for /v1/debug/costs
+    COST_TRACKING_ENABLE: bool = False
+    COST_TRACKING_TOP_N: int = 100
+
+    # zstd compression of the vehicle snapshot stored in Redis. Readers
+    # accept compressed and plain values alike, so it can be toggled freely.
+    REDIS_COMPRESSION_ENABLE: bool = False
+    REDIS_COMPRESSION_LEVEL: int = 3
+
+    # Directory (ideally on tmpfs, e.g. /dev/shm/megisholavonat) where the API
+    # processes of a host share the snapshot through memory-mapped files.
+    # None makes every process read the snapshot from Redis.
+    SHARED_SNAPSHOT_DIR: str | None = None
+    SHARED_SNAPSHOT_POLL_SECONDS: float = 1.0
+
+    # Archive of the published snapshots for /v1/trains?at= and load test
+    # replays, in segments of ARCHIVE_SEGMENT_SECONDS kept for
+    # ARCHIVE_RETENTION_SECONDS after they end
+    ARCHIVE_ENABLE: bool = False
+    ARCHIVE_SEGMENT_SECONDS: int = 15 * 60
+    ARCHIVE_RETENTION_SECONDS: int = 24 * 60 * 60
+
+    # Stops, alerts, info services and trips are interned into a catalog,
+    # and vehicle documents refer to them by id. Past this many records a
+    # new catalog generation starts, dropping the ones no longer in use.
+    CATALOG_MAX_ENTRIES: int = 50_000
+
+    # Token expected in the X-Admin-Token header, admin endpoints are
+    # disabled while it is unset
+    ADMIN_TOKEN: str | None = None
+
+    @field_validator("FEEDS")
+    @classmethod
+    def validate_feeds(cls, feeds: list[FeedConfig]) -> list[FeedConfig]:
+        if not feeds:
+            raise ValueError("At least one feed must be configured")
+        if len({feed.name for feed in feeds}) != len(feeds):
+            raise ValueError("Feed names must be unique")
+        if len({feed.key_namespace for feed in feeds}) != len(feeds):
+            raise ValueError("Feed namespaces must be unique")
+        return feeds
+
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", extra="ignore"
     )
@@ -0,0 +1,207 @@
+"""Prometheus metrics of the refresh pipeline and the API"""
+
+import os
+import time
+from collections.abc import Iterator
+from typing import Any
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    start_http_server,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from prometheus_client.registry import Collector
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.core.config import settings
+from api.core.logging_config import get_logger
+from api.util.county import get_county_for_point
+from api.util.route_cache import route_cache
+
+logger = get_logger(__name__)
+
+# Refreshes take from tens of milliseconds (dedupe) to tens of seconds (fetch)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REFRESH_STAGE_SECONDS = Histogram(
+    "mhav_refresh_stage_seconds",
+    "Duration of the refresh stages",
+    ["feed", "stage"],
+    buckets=STAGE_BUCKETS,
+)
+REFRESH_VEHICLES = Gauge(
+    "mhav_refresh_vehicles",
+    "Vehicles in the last refresh, after each stage",
+    ["feed", "stage"],
+    multiprocess_mode="mostrecent",
+)
+SNAPSHOT_TIMESTAMP = Gauge(
+    "mhav_snapshot_timestamp_seconds",
+    "Unix time of the last published snapshot",
+    ["feed"],
+    multiprocess_mode="max",
+)
+SNAPSHOT_AGE = Gauge(
+    "mhav_snapshot_age_seconds",
+    "Age of the snapshot served by the API, measured at scrape time",
+    ["feed"],
+    multiprocess_mode="mostrecent",
+)
+SNAPSHOT_PAYLOAD_BYTES = Gauge(
+    "mhav_snapshot_payload_bytes",
+    "Stored size of the published snapshot parts, after compression",
+    ["feed", "payload"],
+    multiprocess_mode="mostrecent",
+)
+REFRESH_PARTITION_SECONDS = Histogram(
+    "mhav_refresh_partition_seconds",
+    "Processing time of the partitions of partitioned refreshes",
+    ["feed"],
+    buckets=STAGE_BUCKETS,
+)
+REFRESH_PARTITION_EFFICIENCY = Gauge(
+    "mhav_refresh_partition_efficiency",
+    "Processing time of the partitions of the last refresh divided by the "
+    "partition count times the time they took together",
+    ["feed"],
+    multiprocess_mode="mostrecent",
+)
+REFRESH_PARTITION_FALLBACKS = Counter(
+    "mhav_refresh_partition_fallbacks",
+    "Partitions processed by the refresh itself for lack of a subtask result",
+    ["feed"],
+)
+REDIS_SECONDS = Histogram(
+    "mhav_redis_seconds",
+    "Redis round-trip time",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "mhav_http_request_seconds",
+    "API request duration per endpoint",
+    ["method", "endpoint", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+# In-process caches whose hit counts are exported
+LRU_CACHES: dict[str, Any] = {
+    "compiled_route": route_cache,
+    "county": get_county_for_point,
+}
+
+
+def observe_stage(feed: str, stage: str, start: float) -> float:
+    """
+    Records the duration of a refresh stage of `feed` started at `start`
+    (as returned by time.time()) and returns it for logging.
+    """
+    elapsed = time.time() - start
+    REFRESH_STAGE_SECONDS.labels(feed, stage).observe(elapsed)
+    return elapsed
+
+
+class CacheCollector(Collector):
+    """
+    Reports the hit counts of the in-process LRU caches at scrape time, so the
+    cached functions themselves carry no instrumentation.
+    """
+
+    def collect(self) -> Iterator[CounterMetricFamily | GaugeMetricFamily]:
+        hits = CounterMetricFamily(
+            "mhav_cache_hits", "LRU cache hits", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "mhav_cache_misses", "LRU cache misses", labels=["cache"]
+        )
+        ratio = GaugeMetricFamily(
+            "mhav_cache_hit_ratio",
+            "LRU cache hit ratio since the process started",
+            labels=["cache"],
+        )
+        size = GaugeMetricFamily(
+            "mhav_cache_entries", "LRU cache entries", labels=["cache"]
+        )
+
+        for name, cached in LRU_CACHES.items():
+            info = cached.cache_info()
+            lookups = info.hits + info.misses
+            hits.add_metric([name], info.hits)
+            misses.add_metric([name], info.misses)
+            ratio.add_metric([name], info.hits / lookups if lookups else 0.0)
+            size.add_metric([name], info.currsize)
+
+        yield from (hits, misses, ratio, size)
+
+
+REGISTRY.register(CacheCollector())
+
+
+def get_registry() -> CollectorRegistry:
+    """
+    Returns the registry to export. With PROMETHEUS_MULTIPROC_DIR set, values
+    of every worker process are aggregated from the shared directory.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    registry.register(CacheCollector())
+    return registry
+
+
+def start_worker_exporter() -> None:
+    """
+    Serves the worker metrics on METRICS_PORT. Only one worker process can
+    bind the port, the others rely on multiprocess mode to be exported.
+    """
+    if settings.METRICS_PORT is None:
+        return
+
+    try:
+        start_http_server(settings.METRICS_PORT, registry=get_registry())
+        logger.info(f"Serving worker metrics on port {settings.METRICS_PORT}")
+    except OSError as e:
+        logger.info(f"Worker metrics not served by this process: {e}")
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request, labelled with the name of the matched endpoint
+    so the label cardinality stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"],
+                getattr(route, "name", "unmatched"),
+                str(status),
+            ).observe(time.perf_counter() - start)
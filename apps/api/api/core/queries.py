@@ -1,11 +1,13 @@
-POSITIONS_QUERY = """
+from string import Template
+
+_POSITIONS_QUERY = Template("""
   query Positions {
     vehiclePositions(
       neLat: 51.33061163769853
       neLon: 25.0927734375
       swLat: 44.96479793033104
       swLon: 8.833007812500002
-      modes: [RAIL, TRAMTRAIN, SUBURBAN_RAILWAY]
+      modes: [$modes]
     ) {
       vehicleId
       lat
@@ -56,4 +58,11 @@ POSITIONS_QUERY = """
       }
     }
   }
-"""
+""")
+
+
+def positions_query(modes: list[str]) -> str:
+    """
+    Returns the vehicle positions query for the given transit modes.
+    """
+    return _POSITIONS_QUERY.substitute(modes=", ".join(modes))
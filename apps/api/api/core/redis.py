@@ -1,9 +1,11 @@
 """Database connections and configuration"""
 
 from collections.abc import AsyncGenerator
+from pathlib import Path
 from typing import Annotated
 
 import redis.asyncio as redis
+import zstandard
 from fastapi import Depends
 from taskiq import TaskiqDepends
 
@@ -14,6 +16,11 @@ redis_pool = redis.ConnectionPool(
     host=settings.REDIS_HOST, port=6379, db=0, decode_responses=True, socket_timeout=5
 )
 
+# Separate pool for values stored as raw bytes (e.g. packed binary records)
+redis_bytes_pool = redis.ConnectionPool(
+    host=settings.REDIS_HOST, port=6379, db=0, decode_responses=False, socket_timeout=5
+)
+
 
 async def get_redis() -> AsyncGenerator[redis.Redis]:
     """
@@ -27,10 +34,79 @@ async def get_redis() -> AsyncGenerator[redis.Redis]:
         await client.close()
 
 
-def add_key(key: str) -> str:
-    """Add prefix to Redis key"""
-    return f"{key}:"
+async def get_redis_bytes() -> AsyncGenerator[redis.Redis]:
+    """
+    Dependency that provides a Redis client returning undecoded bytes.
+    """
+    client = redis.Redis(connection_pool=redis_bytes_pool)
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+def add_key(key: str, namespace: str = "") -> str:
+    """Add the feed namespace to Redis key"""
+    return f"{key}:{namespace}"
+
+
+# Compressed values start with the zstd frame magic number, JSON never does
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Trained on processed vehicle documents by scripts/train-zstd-dictionary.py
+ZSTD_DICTIONARY_PATH = Path(__file__).parent.parent / "data" / "redis-zstd.dict"
+
+
+class RedisCodec:
+    """
+    Optional zstd compression of JSON values stored in Redis.
+
+    Small documents sharing most of their keys and strings, like the
+    per-vehicle values, only compress well with the trained dictionary.
+    Large documents compress well on their own, and without the dictionary
+    they can also be passed through to HTTP clients accepting zstd.
+
+    Decoding detects compressed values by their magic number, so values
+    written before compression was enabled are still read.
+    """
+
+    def __init__(self, dictionary_path: Path, level: int) -> None:
+        self.dictionary = zstandard.ZstdCompressionDict(dictionary_path.read_bytes())
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._dict_compressor = zstandard.ZstdCompressor(
+            level=level, dict_data=self.dictionary
+        )
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._dict_decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+
+    def compress(self, data: bytes, use_dictionary: bool = False) -> bytes:
+        compressor = self._dict_compressor if use_dictionary else self._compressor
+        return compressor.compress(data)
+
+    def encode(self, value: str, use_dictionary: bool = False) -> str | bytes:
+        """
+        Returns the value to store, compressed if compression is enabled.
+        """
+        if not settings.REDIS_COMPRESSION_ENABLE:
+            return value
+        return self.compress(value.encode(), use_dictionary)
+
+    def decode(self, raw: bytes) -> bytes:
+        """
+        Returns the JSON bytes of a value written by `encode`.
+        """
+        if not raw.startswith(ZSTD_MAGIC):
+            return raw
+
+        if zstandard.get_frame_parameters(raw).dict_id:
+            return self._dict_decompressor.decompress(raw)
+        return self._decompressor.decompress(raw)
+
+
+codec = RedisCodec(ZSTD_DICTIONARY_PATH, settings.REDIS_COMPRESSION_LEVEL)
 
 
 RedisDep = Annotated[redis.Redis, Depends(get_redis)]
+RedisBytesDep = Annotated[redis.Redis, Depends(get_redis_bytes)]
 RedisTaskiqDep = Annotated[redis.Redis, TaskiqDepends(get_redis)]
+RedisBytesTaskiqDep = Annotated[redis.Redis, TaskiqDepends(get_redis_bytes)]
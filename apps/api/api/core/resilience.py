@@ -0,0 +1,107 @@
+"""Resilience helpers for calls to the upstream endpoint"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are rejected until `reset_timeout` has passed. Then a single trial call is
+    let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        if self.opened_at is None:
+            return False
+        return time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self) -> None:
+        if self.is_open:
+            raise CircuitOpenError(
+                f"Circuit open after {self.failures} failures, "
+                f"retrying in {self.retry_in():.0f}s"
+            )
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Keeps the most recent call latencies to derive percentiles from"""
+
+    def __init__(self, size: int = 50, min_samples: int = 5) -> None:
+        self.samples: deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, fraction: float) -> float | None:
+        """
+        Nearest-rank percentile, or None until enough samples are collected.
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        values = sorted(self.samples)
+        return values[max(1, math.ceil(fraction * len(values))) - 1]
+
+
+async def hedged[T](call: Callable[[], Awaitable[T]], hedge_after: float | None) -> T:
+    """
+    Runs `call`, and if it hasn't finished after `hedge_after` seconds, runs a
+    second attempt concurrently. Returns the first successful result and
+    cancels the other attempt; raises only if every attempt failed.
+    """
+    first = asyncio.ensure_future(call())
+    if hedge_after is None:
+        return await first
+
+    done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    if done:
+        return first.result()
+
+    pending = {first, asyncio.ensure_future(call())}
+    error: BaseException | None = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    assert error is not None
+    raise error
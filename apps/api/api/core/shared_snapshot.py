@@ -0,0 +1,575 @@
+"""Snapshot shared by the API processes of a host through memory-mapped files"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from collections.abc import Iterator
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from redis.asyncio import Redis
+
+from api.core.config import FeedConfig, settings
+from api.core.logging_config import get_logger
+from api.core.metrics import REDIS_SECONDS
+from api.core.redis import add_key, codec, redis_bytes_pool
+from api.schemas.trains import TrainFeature, TrainFeatureCollection
+from api.util.geometry import ROUTE_DETAILS, RouteDetail, with_route_detail
+
+logger = get_logger(__name__)
+
+# Bump whenever the layout of the header or the slots changes
+SHARED_SNAPSHOT_FORMAT = 4
+
+# magic, format version, active slot, sequence number, snapshot version and
+# the number of times each of the two slots was written
+_HEADER = struct.Struct("<4sHHQQQQ")
+_HEADER_MAGIC = b"MHSH"
+_SEQUENCE = struct.Struct("<Q")
+_SEQUENCE_OFFSET = 8
+_SLOT_WRITES_OFFSET = 24
+
+# magic, format version, snapshot version, the byte lengths of the meta and
+# of the features, responses and vehicles sections, and the vehicle count.
+# The meta locates the features and response of each route detail level.
+_SLOT_HEADER = struct.Struct("<4sHQIIII")
+_SLOT_MAGIC = b"MHSS"
+
+# The stored compressed response reports a data age of zero minutes
+RESPONSE_MAX_AGE_MS = 60_000
+
+# Features are copied out of the mapping this much at a time while streamed
+_STREAM_CHUNK = 64 * 1024
+
+_features_adapter = TypeAdapter(list[TrainFeature])
+
+
+def shared_snapshot_dir(feed: FeedConfig) -> Path | None:
+    """
+    Directory of the shared snapshot of a feed, the feeds other than the one
+    with the unsuffixed keys have a subdirectory named after their namespace.
+    """
+    if settings.SHARED_SNAPSHOT_DIR is None:
+        return None
+    return Path(settings.SHARED_SNAPSHOT_DIR) / feed.key_namespace
+
+
+class SlotOverwrittenError(Exception):
+    """
+    The slot a response was being served from was written again.
+    """
+
+
+def _slot_writes(header: mmap.mmap, slot: int) -> int:
+    return int(_SEQUENCE.unpack_from(header, _SLOT_WRITES_OFFSET + 8 * slot)[0])
+
+
+def vehicle_hash(vehicle_id: str) -> int:
+    """
+    Key of a vehicle in the offset index. With a thousand vehicles, a 64-bit
+    digest makes a collision practically impossible.
+    """
+    digest = hashlib.blake2b(vehicle_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def pack_slot(
+    version: int,
+    feature_collection: dict[str, Any],
+    vehicles: dict[str, bytes],
+    responses: dict[str, bytes],
+    traceparent: str | None,
+) -> bytes:
+    """
+    Serializes a snapshot: the header, the meta, the features and compressed
+    response of every route detail level, the features as stored and the
+    vehicle sections, then the offset index, made of the sorted vehicle
+    hashes followed by an (offset, length) pair for each.
+    """
+    sections = [
+        (
+            f"features:{detail}",
+            _features_adapter.dump_json(
+                _features_adapter.validate_python(
+                    [
+                        with_route_detail(feature, detail)
+                        for feature in feature_collection["features"]
+                    ]
+                )
+            ),
+        )
+        for detail in ROUTE_DETAILS
+    ]
+    sections.extend(
+        (f"response:{detail}", response) for detail, response in responses.items()
+    )
+    # As stored, with the properties extrapolation needs and the model drops
+    sections.append(
+        ("features:stored", json.dumps(feature_collection["features"]).encode())
+    )
+
+    # Section offsets are relative to the end of the meta
+    locations = {}
+    offset = 0
+    for name, section in sections:
+        locations[name] = (offset, len(section))
+        offset += len(section)
+
+    meta = json.dumps(
+        {
+            "noDataReceived": feature_collection.get("noDataReceived", False),
+            "traceparent": traceparent,
+            "sections": locations,
+        }
+    ).encode()
+
+    index = []
+    offset += _SLOT_HEADER.size + len(meta)
+    vehicles_start = offset
+    for vehicle_id, value in vehicles.items():
+        index.append((vehicle_hash(vehicle_id), offset, len(value)))
+        offset += len(value)
+    index.sort()
+
+    # The index is read through 8-byte aligned views
+    padding = b"\0" * (-offset % 8)
+
+    header = _SLOT_HEADER.pack(
+        _SLOT_MAGIC,
+        SHARED_SNAPSHOT_FORMAT,
+        version,
+        len(meta),
+        vehicles_start - _SLOT_HEADER.size - len(meta),
+        offset + len(padding) - vehicles_start,
+        len(index),
+    )
+    return b"".join(
+        [
+            header,
+            meta,
+            *(section for _, section in sections),
+            *vehicles.values(),
+            padding,
+            *(struct.pack("<Q", key) for key, _, _ in index),
+            *(struct.pack("<II", start, size) for _, start, size in index),
+        ]
+    )
+
+
+def build_slot(
+    feature_collection_raw: bytes,
+    vehicles_raw: dict[bytes, bytes],
+    responses_raw: dict[bytes, bytes],
+    traceparent: str | None,
+) -> tuple[int, bytes]:
+    """
+    Builds a slot from the snapshot as stored in Redis. Features are
+    serialized through their response model once here, so the API processes
+    can serve them without parsing. Vehicle documents are kept as stored,
+    their details are only computed for the vehicles requested.
+    """
+    feature_collection = json.loads(codec.decode(feature_collection_raw))
+    vehicles = {
+        vehicle_id.decode(): codec.decode(value)
+        for vehicle_id, value in vehicles_raw.items()
+    }
+    responses = {
+        detail.decode(): response for detail, response in responses_raw.items()
+    }
+    version = feature_collection["timestamp"]
+    return version, pack_slot(
+        version, feature_collection, vehicles, responses, traceparent
+    )
+
+
+class SharedSnapshot:
+    """
+    Read-only view of a snapshot slot. Sections are returned as slices of
+    the mapping, without being copied into the process, except the
+    responses, which outlive the request handler and are copied out while
+    the slot is checked not to have been written again.
+    """
+
+    def __init__(
+        self, view: memoryview, header: mmap.mmap, slot: int, writes: int
+    ) -> None:
+        (
+            magic,
+            slot_format,
+            self.version,
+            meta_length,
+            sections_length,
+            vehicles_length,
+            count,
+        ) = _SLOT_HEADER.unpack_from(view)
+        if magic != _SLOT_MAGIC or slot_format != SHARED_SNAPSHOT_FORMAT:
+            raise ValueError("Not a shared snapshot slot")
+
+        offset = _SLOT_HEADER.size
+        meta = json.loads(bytes(view[offset : offset + meta_length]))
+        self.no_data_received: bool = meta["noDataReceived"]
+        self.traceparent: str | None = meta["traceparent"]
+
+        offset += meta_length
+        self._sections = {
+            name: view[offset + start : offset + start + length]
+            for name, (start, length) in meta["sections"].items()
+        }
+        offset += sections_length + vehicles_length
+        self._hashes = view[offset : offset + count * 8].cast("Q")
+        offset += count * 8
+        self._locations = view[offset : offset + count * 8].cast("I")
+        self._view = view
+        self._header = header
+        self._slot = slot
+        self._writes = writes
+
+    def intact(self) -> bool:
+        """
+        Returns whether the slot still holds this snapshot. The writer
+        counts a write of the slot before it starts, so data copied before
+        this returns True is complete.
+        """
+        return _slot_writes(self._header, self._slot) == self._writes
+
+    def vehicle(self, vehicle_id: str) -> memoryview | None:
+        """
+        Returns the document of a vehicle as the refresh stores it, or None
+        if it is not in the snapshot.
+        """
+        key = vehicle_hash(vehicle_id)
+        i = bisect.bisect_left(self._hashes, key)
+        if i == len(self._hashes) or self._hashes[i] != key:
+            return None
+
+        start, size = self._locations[2 * i], self._locations[2 * i + 1]
+        return self._view[start : start + size]
+
+    def feature_collection(self) -> dict[str, Any]:
+        """
+        Returns the snapshot in the format the refresh stores in Redis.
+        """
+        return {
+            "timestamp": self.version,
+            "noDataReceived": self.no_data_received,
+            "features": json.loads(bytes(self._sections["features:stored"])),
+            "traceparent": self.traceparent,
+        }
+
+    def trains_response(
+        self, now: int, accepts_zstd: bool, detail: RouteDetail = "full"
+    ) -> Response:
+        """
+        Returns the /v1/trains response at `now` (ms) with the routes at the
+        given detail level. The compressed response is passed through while
+        its data age is current.
+        """
+        response = self._sections.get(f"response:{detail}")
+        if accepts_zstd and response and now - self.version < RESPONSE_MAX_AGE_MS:
+            # Compressed, small enough to copy whole
+            body = bytes(response)
+            if not self.intact():
+                raise SlotOverwrittenError(f"Slot of snapshot {self.version}")
+            return Response(
+                body,
+                media_type="application/json",
+                headers={"Content-Encoding": "zstd", "Vary": "Accept-Encoding"},
+            )
+
+        # The features are streamed from the mapping inside the envelope
+        envelope = TrainFeatureCollection(
+            timestamp=datetime.fromtimestamp(self.version / 1000, tz=UTC).isoformat(),
+            noDataReceived=self.no_data_received,
+            dataAgeMinutes=(now - self.version) // 60000,
+            features=[],
+        ).model_dump_json()
+        prefix = envelope.removesuffix("[]}").encode()
+        features = self._sections[f"features:{detail}"]
+
+        def chunks() -> Iterator[bytes]:
+            # A slow client may still be reading when the slot is written
+            # again, the response is then cut short rather than corrupted
+            yield prefix
+            for start in range(0, len(features), _STREAM_CHUNK):
+                chunk = bytes(features[start : start + _STREAM_CHUNK])
+                if not self.intact():
+                    logger.warning(
+                        f"Slot of snapshot {self.version} written again while "
+                        f"streaming it, aborting the response"
+                    )
+                    raise SlotOverwrittenError(f"Slot of snapshot {self.version}")
+                yield chunk
+            yield b"}"
+
+        return StreamingResponse(
+            chunks(),
+            media_type="application/json",
+            headers={
+                "Content-Length": str(len(prefix) + len(features) + 1),
+                "Vary": "Accept-Encoding",
+            },
+        )
+
+
+def _read_header(header: mmap.mmap) -> tuple[int, int, int] | None:
+    """
+    Returns the active slot, snapshot version and write count of the slot,
+    retrying while the writer is updating them.
+    """
+    for _ in range(1000):
+        (sequence,) = _SEQUENCE.unpack_from(header, _SEQUENCE_OFFSET)
+        if sequence % 2:
+            continue
+
+        magic, header_format, slot, _, version, *writes = _HEADER.unpack_from(header)
+        if _SEQUENCE.unpack_from(header, _SEQUENCE_OFFSET)[0] != sequence:
+            continue
+
+        if magic != _HEADER_MAGIC or header_format != SHARED_SNAPSHOT_FORMAT:
+            return None
+        # The active slot is not written again before the header switches
+        # away from it, so its count is current as of the sequence check
+        return (slot, version, writes[slot]) if version else None
+
+    return None
+
+
+class SharedSnapshotReader:
+    """
+    Maps the shared snapshot of a feed on the host. Checking for a new
+    snapshot only reads the header, slots are mapped again when the active
+    one changes.
+    """
+
+    def __init__(self, feed: FeedConfig) -> None:
+        self.feed = feed
+        self._header: mmap.mmap | None = None
+        self._snapshot: SharedSnapshot | None = None
+        self._next_attempt = 0.0
+
+    def _open_header(self, directory: Path) -> mmap.mmap | None:
+        # Until the writer has created it, look for the header once a second
+        if time.monotonic() < self._next_attempt:
+            return None
+        self._next_attempt = time.monotonic() + 1
+
+        try:
+            with open(directory / "header", "rb") as f:
+                return mmap.mmap(f.fileno(), _HEADER.size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    def get(self) -> SharedSnapshot | None:
+        """
+        Returns the current shared snapshot, or None if shared snapshots are
+        disabled or none has been written yet.
+        """
+        directory = shared_snapshot_dir(self.feed)
+        if directory is None:
+            return None
+
+        if self._header is None:
+            self._header = self._open_header(directory)
+            if self._header is None:
+                return None
+
+        active = _read_header(self._header)
+        if active is None:
+            return None
+
+        slot, version, writes = active
+        if self._snapshot is None or self._snapshot.version != version:
+            path = directory / f"slot-{slot}"
+            with open(path, "rb") as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # The previous mapping is unmapped once no response uses it
+            self._snapshot = SharedSnapshot(
+                memoryview(mapping), self._header, slot, writes
+            )
+
+        return self._snapshot
+
+
+class SharedSnapshotWriter:
+    """
+    Writes snapshots into the inactive slot and then switches the header to
+    it, so readers always map a complete slot.
+
+    Slot files are never shrunk, a reader may still map the previous
+    contents. A slot is written again by the snapshot after next, as soon as
+    one poll after a switch away from it, while a slow client may still be
+    reading a response from it. The write count of the slot in the header
+    is bumped before writing it, readers copy responses out of the mapping
+    and stop when it changes.
+    """
+
+    def __init__(self, directory: Path, namespace: str = "") -> None:
+        self.directory = directory
+        # Of the Redis keys of the feed
+        self.namespace = namespace
+        self.slot = 0
+        self.version = 0
+        self._lock_file: Any = None
+        self._header: mmap.mmap | None = None
+
+    def acquire(self) -> bool:
+        """
+        Tries to become the writer of the host, returns whether this process is.
+        The lock is released by the OS when the process exits.
+        """
+        if self._lock_file is not None:
+            return True
+
+        # POSIX only, like the shared snapshot mode itself
+        import fcntl
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.directory / "writer.lock", "a")  # noqa: SIM115
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        self._header = self._open_header()
+        magic, header_format, slot, _, version, *_ = _HEADER.unpack_from(self._header)
+        if magic == _HEADER_MAGIC and header_format == SHARED_SNAPSHOT_FORMAT:
+            self.slot, self.version = slot, version
+        return True
+
+    def _open_header(self) -> mmap.mmap:
+        fd = os.open(self.directory / "header", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _HEADER.size:
+                os.ftruncate(fd, _HEADER.size)
+            return mmap.mmap(fd, _HEADER.size)
+        finally:
+            os.close(fd)
+
+    def write(self, version: int, data: bytes) -> None:
+        assert self._header is not None, "write called before acquire"
+        slot = 1 - self.slot
+
+        # Counted before the slot is touched, for readers still serving it
+        writes_offset = _SLOT_WRITES_OFFSET + 8 * slot
+        _SEQUENCE.pack_into(
+            self._header, writes_offset, _slot_writes(self._header, slot) + 1
+        )
+
+        fd = os.open(self.directory / f"slot-{slot}", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < len(data):
+                os.ftruncate(fd, len(data))
+            os.pwrite(fd, data, 0)
+        finally:
+            os.close(fd)
+
+        # Seqlock: readers retry while the sequence number is odd or changes
+        (sequence,) = _SEQUENCE.unpack_from(self._header, _SEQUENCE_OFFSET)
+        # Even again if a previous writer died halfway through an update
+        sequence += sequence % 2
+        _SEQUENCE.pack_into(self._header, _SEQUENCE_OFFSET, sequence + 1)
+        _HEADER.pack_into(
+            self._header,
+            0,
+            _HEADER_MAGIC,
+            SHARED_SNAPSHOT_FORMAT,
+            slot,
+            sequence + 1,
+            version,
+            _slot_writes(self._header, 0),
+            _slot_writes(self._header, 1),
+        )
+        _SEQUENCE.pack_into(self._header, _SEQUENCE_OFFSET, sequence + 2)
+        self.slot, self.version = slot, version
+
+    async def sync(self, redis: Redis) -> bool:
+        """
+        Writes the snapshot published in Redis if it is newer than the one
+        written last. `redis` must return raw bytes. Returns whether a
+        snapshot was written.
+        """
+        version = await redis.get(add_key("train-snapshot-version", self.namespace))
+        if version is None and self.version:
+            # The snapshot written last is served as stale, as from Redis
+            return False
+        if version is not None and int(version) == self.version:
+            return False
+
+        with REDIS_SECONDS.labels("shared_snapshot").time():
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.get(add_key("train-positions-geojson", self.namespace))
+                pipe.hgetall(add_key("train-positions-hash", self.namespace))
+                pipe.hgetall(add_key("train-positions-response", self.namespace))
+                pipe.get(add_key("train-snapshot-traceparent", self.namespace))
+                geojson, vehicles, responses, traceparent = await pipe.execute()
+
+            if geojson is None:
+                # Serve the last known good snapshot, its age flags it as stale
+                async with redis.pipeline(transaction=True) as pipe:
+                    pipe.get(add_key("train-positions-geojson-lkg", self.namespace))
+                    pipe.hgetall(add_key("train-positions-hash-lkg", self.namespace))
+                    geojson, vehicles = await pipe.execute()
+                responses, traceparent = {}, None
+
+        if geojson is None:
+            return False
+
+        snapshot_version, data = await asyncio.to_thread(
+            build_slot,
+            geojson,
+            vehicles,
+            responses,
+            traceparent.decode() if traceparent else None,
+        )
+        if snapshot_version == self.version:
+            return False
+
+        self.write(snapshot_version, data)
+        return True
+
+
+async def run_shared_snapshot_writer() -> None:
+    """
+    Keeps the shared snapshots of the host in sync with Redis. Every API
+    process runs this, the one holding the writer lock of a feed does the
+    work, and another takes over when that process exits.
+    """
+    writers = {
+        feed.name: SharedSnapshotWriter(
+            shared_snapshot_dir(feed) or Path("."), feed.key_namespace
+        )
+        for feed in settings.FEEDS
+    }
+    client = Redis(connection_pool=redis_bytes_pool)
+    try:
+        while True:
+            for name, writer in writers.items():
+                try:
+                    if writer.acquire():
+                        start = time.time()
+                        if await writer.sync(client):
+                            logger.info(
+                                f"Shared snapshot {writer.version} of {name} "
+                                f"written (Time: {(time.time() - start):.4f}s)"
+                            )
+                except Exception as e:
+                    logger.error(f"Error updating shared snapshot of {name}: {e}")
+
+            await asyncio.sleep(settings.SHARED_SNAPSHOT_POLL_SECONDS)
+    finally:
+        await client.close()
+
+
+# Per feed, shared by all requests of the API process
+shared_snapshots = {feed.name: SharedSnapshotReader(feed) for feed in settings.FEEDS}
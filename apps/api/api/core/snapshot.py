@@ -0,0 +1,54 @@
+"""Per-snapshot caching of documents derived during refresh"""
+
+from collections.abc import Callable
+
+from redis.asyncio import Redis
+
+from api.core.redis import add_key
+from api.core.tracing import link_snapshot
+
+
+class SnapshotCache[T]:
+    """
+    Keeps a parsed copy of a Redis document in process memory and reuses it
+    until the snapshot version written by the refresh changes.
+    `namespace` is the key namespace of the feed the document belongs to.
+    """
+
+    def __init__(
+        self, key: str, parse: Callable[[str], T], namespace: str = ""
+    ) -> None:
+        self._key = key
+        self._parse = parse
+        self._namespace = namespace
+        self._version: str | None = None
+        self._traceparent: str | None = None
+        self._value: T | None = None
+
+    async def get(self, redis: Redis) -> T | None:
+        """
+        Returns the parsed document for the current snapshot, or None if no
+        snapshot has been published.
+        """
+        version_key = add_key("train-snapshot-version", self._namespace)
+        version = await redis.get(version_key)
+        if version is None:
+            return None
+
+        if version != self._version:
+            # Read again with the document, a snapshot may have been
+            # published since, and the document is cached under its version
+            version, raw, traceparent = await redis.mget(
+                version_key,
+                self._key,
+                add_key("train-snapshot-traceparent", self._namespace),
+            )
+            if version is None or raw is None:
+                return None
+
+            self._value = self._parse(raw)
+            self._version = version
+            self._traceparent = traceparent
+
+        link_snapshot(version, self._traceparent)
+        return self._value
@@ -1,8 +1,16 @@
-from taskiq import TaskiqScheduler
+from redis.asyncio import Redis
+from taskiq import TaskiqEvents, TaskiqScheduler, TaskiqState
 from taskiq.schedule_sources import LabelScheduleSource
 from taskiq_redis import RedisAsyncResultBackend, RedisStreamBroker
 
 from api.core.config import settings
+from api.core.logging_config import get_logger
+from api.core.metrics import start_worker_exporter
+from api.core.redis import redis_bytes_pool
+from api.core.tracing import setup_tracing, shutdown_tracing
+from api.util.route_cache import route_cache
+
+logger = get_logger(__name__)
 
 broker = RedisStreamBroker(f"redis://{settings.REDIS_HOST}:6379").with_result_backend(
     RedisAsyncResultBackend(
@@ -11,3 +19,24 @@ broker = RedisStreamBroker(f"redis://{settings.REDIS_HOST}:6379").with_result_ba
 )
 
 scheduler = TaskiqScheduler(broker=broker, sources=[LabelScheduleSource(broker)])
+
+
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def startup(state: TaskiqState) -> None:
+    start_worker_exporter()
+    setup_tracing("worker")
+
+    # Start from the routes compiled before the restart
+    client = Redis(connection_pool=redis_bytes_pool)
+    try:
+        loaded = await route_cache.load(client)
+        logger.info(f"Loaded {loaded} compiled routes")
+    except Exception as e:
+        logger.error(f"Failed to load compiled routes: {e}")
+    finally:
+        await client.close()
+
+
+@broker.on_event(TaskiqEvents.WORKER_SHUTDOWN)
+async def shutdown(state: TaskiqState) -> None:
+    shutdown_tracing()
@@ -0,0 +1,188 @@
+"""OpenTelemetry tracing of the refresh pipeline and the API"""
+
+from collections.abc import Sequence
+
+from opentelemetry import context, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import (
+    ParentBased,
+    Sampler,
+    SamplingResult,
+    TraceIdRatioBased,
+)
+from opentelemetry.trace import Link, SpanKind
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+from opentelemetry.util.types import Attributes
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.core.config import settings
+from api.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Spans are no-ops until setup_tracing installs a provider
+tracer = trace.get_tracer("api")
+
+_propagator = TraceContextTextMapPropagator()
+
+
+class RootSampler(Sampler):
+    """
+    Samples new traces with separate ratios for API requests and refreshes.
+    Refreshes are rare and serve as link targets for every request that
+    reads their snapshot, so they are usually worth keeping in full.
+    """
+
+    def __init__(self, request_ratio: float, refresh_ratio: float) -> None:
+        self.request_sampler = TraceIdRatioBased(request_ratio)
+        self.refresh_sampler = TraceIdRatioBased(refresh_ratio)
+
+    def should_sample(
+        self,
+        parent_context: context.Context | None,
+        trace_id: int,
+        name: str,
+        kind: SpanKind | None = None,
+        attributes: Attributes = None,
+        links: Sequence[Link] | None = None,
+        trace_state: trace.TraceState | None = None,
+    ) -> SamplingResult:
+        sampler = (
+            self.request_sampler if kind == SpanKind.SERVER else self.refresh_sampler
+        )
+        return sampler.should_sample(
+            parent_context, trace_id, name, kind, attributes, links, trace_state
+        )
+
+    def get_description(self) -> str:
+        return (
+            f"RootSampler{{requests={self.request_sampler.rate}, "
+            f"refreshes={self.refresh_sampler.rate}}}"
+        )
+
+
+def _get_exporter() -> SpanExporter:
+    if settings.TRACING_EXPORTER == "file":
+        # One JSON document per line, the file stays open for the process lifetime
+        return ConsoleSpanExporter(
+            out=open(settings.TRACING_FILE_PATH, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+
+    # Imported lazily, as it pulls in protobuf
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+        OTLPSpanExporter,
+    )
+
+    # Configured through the standard OTEL_EXPORTER_OTLP_* variables
+    return OTLPSpanExporter()
+
+
+def setup_tracing(service_name: str) -> None:
+    """
+    Installs the tracer provider of this process if tracing is enabled.
+    """
+    if not settings.TRACING_ENABLE:
+        return
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(
+            RootSampler(
+                settings.TRACING_SAMPLE_RATIO, settings.TRACING_REFRESH_SAMPLE_RATIO
+            )
+        ),
+    )
+    provider.add_span_processor(BatchSpanProcessor(_get_exporter()))
+    trace.set_tracer_provider(provider)
+    logger.info(
+        f"Tracing enabled ({settings.TRACING_EXPORTER}, "
+        f"sample ratio: {settings.TRACING_SAMPLE_RATIO})"
+    )
+
+
+def shutdown_tracing() -> None:
+    """
+    Flushes pending spans before the process exits.
+    """
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        provider.shutdown()
+
+
+def get_traceparent() -> str | None:
+    """
+    Returns the W3C traceparent of the current span, if it is sampled.
+    """
+    if not trace.get_current_span().is_recording():
+        return None
+
+    carrier: dict[str, str] = {}
+    _propagator.inject(carrier)
+    return carrier.get("traceparent")
+
+
+def link_snapshot(version: int | str, traceparent: str | None) -> None:
+    """
+    Tags the current span with the snapshot it served, and links it to the
+    refresh that published the snapshot.
+    """
+    span = trace.get_current_span()
+    if not span.is_recording():
+        return
+
+    span.set_attribute("snapshot.version", int(version))
+    if traceparent:
+        refresh_context = trace.get_current_span(
+            _propagator.extract({"traceparent": traceparent})
+        ).get_span_context()
+        if refresh_context.is_valid:
+            span.add_link(refresh_context, {"link.type": "snapshot"})
+
+
+class TracingMiddleware:
+    """
+    Wraps every HTTP request in a server span, continuing the trace of an
+    incoming traceparent header.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope["headers"]
+            if key in (b"traceparent", b"tracestate")
+        }
+        method = scope["method"]
+
+        with tracer.start_as_current_span(
+            method,
+            context=_propagator.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={"http.request.method": method, "url.path": scope["path"]},
+        ) as span:
+
+            async def send_with_status(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # The router stores the matched route in the scope
+                route = scope.get("route")
+                if route is not None:
+                    span.update_name(f"{method} {route.name}")
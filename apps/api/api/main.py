@@ -1,12 +1,29 @@
+import asyncio
+import contextlib
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.routing import APIRoute, APIRouter
 
+from api.core.config import settings
 from api.core.logging_config import get_logger, setup_logging
+from api.core.metrics import MetricsMiddleware
+from api.core.shared_snapshot import run_shared_snapshot_writer
 from api.core.taskiq_broker import broker
-from api.routers import posthog, redis_test, root, trains
+from api.core.tracing import TracingMiddleware, setup_tracing, shutdown_tracing
+from api.routers import (
+    catalog,
+    debug,
+    metrics,
+    posthog,
+    redis_test,
+    root,
+    search,
+    stations,
+    stats,
+    trains,
+)
 
 # Initialize logging
 setup_logging()
@@ -24,12 +41,21 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None]:
     # Startup
+    setup_tracing("api")
     await broker.startup()
+    shared_snapshot_writer = None
+    if settings.SHARED_SNAPSHOT_DIR is not None:
+        shared_snapshot_writer = asyncio.create_task(run_shared_snapshot_writer())
 
     yield
 
     # Shutdown
+    if shared_snapshot_writer is not None:
+        shared_snapshot_writer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await shared_snapshot_writer
     await broker.shutdown()
+    shutdown_tracing()
 
 
 def create_app() -> FastAPI:
@@ -45,14 +71,23 @@ def create_app() -> FastAPI:
         generate_unique_id_function=custom_generate_unique_id,
     )
 
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(TracingMiddleware)
+
     v1_router = APIRouter(prefix="/v1")
 
     # Include routers
     v1_router.include_router(redis_test.router)
     v1_router.include_router(trains.router)
+    v1_router.include_router(search.router)
+    v1_router.include_router(stations.router)
+    v1_router.include_router(catalog.router)
+    v1_router.include_router(stats.router)
     v1_router.include_router(posthog.router)
+    v1_router.include_router(debug.router)
 
     app.include_router(root.router)
+    app.include_router(metrics.router)
     app.include_router(v1_router)
 
     return app
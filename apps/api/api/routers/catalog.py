@@ -0,0 +1,112 @@
+"""Catalog API endpoints"""
+
+from typing import Any
+
+from fastapi import APIRouter, Header, HTTPException, Response
+from redis.asyncio import Redis
+
+from api.core.logging_config import get_logger
+from api.core.redis import RedisDep
+from api.routers.trains import select_feeds
+from api.schemas.catalog import AlertCatalog, InfoServiceCatalog, StopCatalog
+from api.services.catalog import get_catalog
+
+logger = get_logger(__name__)
+
+router = APIRouter(tags=["catalog"])
+
+# Records are only ever added to a catalog generation, clients revalidate
+# with the ETag once this is up
+CATALOG_MAX_AGE = 60
+
+
+async def load_section(
+    redis: Redis,
+    section: str,
+    feed: str | None,
+    if_none_match: str | None,
+    response: Response,
+) -> tuple[int, list[dict[str, Any]]] | None:
+    """
+    Returns the generation and records of a catalog section, or None if the
+    client has them already.
+    """
+    selected = select_feeds([feed] if feed else None)[0]
+    try:
+        catalog = await get_catalog(redis, selected)
+    except Exception as e:
+        logger.error(f"Error fetching catalog: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch catalog") from e
+
+    if catalog is None:
+        raise HTTPException(status_code=404, detail="No catalog available")
+
+    records = catalog[section]
+    # A generation only grows, so its size identifies its contents
+    etag = f'"{selected.name}-{catalog["generation"]}-{len(records)}"'
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = f"public, max-age={CATALOG_MAX_AGE}"
+    if if_none_match == etag:
+        return None
+
+    return catalog["generation"], [
+        {"id": record_id, **record} for record_id, record in enumerate(records)
+    ]
+
+
+def not_modified(response: Response) -> Response:
+    return Response(status_code=304, headers=dict(response.headers))
+
+
+@router.get("/stops", response_model=StopCatalog)
+async def get_stops(
+    redis: RedisDep,
+    response: Response,
+    feed: str | None = None,
+    if_none_match: str | None = Header(default=None, include_in_schema=False),
+) -> StopCatalog | Response:
+    """
+    Get the stops compact vehicle details refer to by id, from the given
+    `feed` or the first one.
+    """
+    section = await load_section(redis, "stops", feed, if_none_match, response)
+    if section is None:
+        return not_modified(response)
+    generation, records = section
+    return StopCatalog(generation=generation, stops=records)
+
+
+@router.get("/alerts", response_model=AlertCatalog)
+async def get_alerts(
+    redis: RedisDep,
+    response: Response,
+    feed: str | None = None,
+    if_none_match: str | None = Header(default=None, include_in_schema=False),
+) -> AlertCatalog | Response:
+    """
+    Get the alerts compact vehicle details refer to by id, from the given
+    `feed` or the first one.
+    """
+    section = await load_section(redis, "alerts", feed, if_none_match, response)
+    if section is None:
+        return not_modified(response)
+    generation, records = section
+    return AlertCatalog(generation=generation, alerts=records)
+
+
+@router.get("/info-services", response_model=InfoServiceCatalog)
+async def get_info_services(
+    redis: RedisDep,
+    response: Response,
+    feed: str | None = None,
+    if_none_match: str | None = Header(default=None, include_in_schema=False),
+) -> InfoServiceCatalog | Response:
+    """
+    Get the information services compact vehicle details refer to by id,
+    from the given `feed` or the first one.
+    """
+    section = await load_section(redis, "infoServices", feed, if_none_match, response)
+    if section is None:
+        return not_modified(response)
+    generation, records = section
+    return InfoServiceCatalog(generation=generation, infoServices=records)
@@ -0,0 +1,145 @@
+"""Debug and profiling API endpoints"""
+
+import json
+from datetime import UTC, datetime
+
+from fastapi import APIRouter, HTTPException, Query, Response
+
+from api.core.admin import AdminDep
+from api.core.config import settings
+from api.core.logging_config import get_logger
+from api.core.redis import RedisBytesDep, RedisDep, add_key
+from api.schemas.debug import ProcessingCosts, ProfileStatus
+from api.services.profiling import (
+    PROFILE_PSTATS_KEY,
+    PROFILE_REPORT_KEY,
+    PROFILE_STATUS_KEY,
+    PROFILE_TRACEMALLOC_KEY,
+    request_profile,
+)
+
+logger = get_logger(__name__)
+
+# Internal endpoints, kept out of the schema the web client is generated from
+router = APIRouter(
+    prefix="/debug",
+    tags=["debug"],
+    dependencies=[AdminDep],
+    include_in_schema=False,
+)
+
+
+def _isoformat(timestamp_ms: str | None) -> str | None:
+    if timestamp_ms is None:
+        return None
+    return datetime.fromtimestamp(int(timestamp_ms) / 1000, tz=UTC).isoformat()
+
+
+@router.get("/costs")
+async def get_processing_costs(
+    redis: RedisDep,
+    limit: int = Query(default=20, ge=1, le=100),
+) -> ProcessingCosts:
+    """
+    Get the vehicles that were the most expensive to process in the last
+    refresh. Requires COST_TRACKING_ENABLE on the worker.
+    """
+    try:
+        data = await redis.get(
+            add_key("train-processing-costs", settings.FEEDS[0].key_namespace)
+        )
+
+        if not data:
+            raise HTTPException(status_code=404, detail="No processing costs recorded")
+
+        costs = json.loads(data)
+        return ProcessingCosts(
+            timestamp=_isoformat(costs["timestamp"]) or "",
+            vehicles=costs["vehicles"],
+            totalSeconds=costs["totalSeconds"],
+            costs=costs["costs"][:limit],
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching processing costs: {e}")
+        raise HTTPException(
+            status_code=500, detail="Failed to fetch processing costs"
+        ) from e
+
+
+@router.post("/profile", status_code=202)
+async def request_refresh_profile(redis: RedisDep) -> ProfileStatus:
+    """
+    Ask the worker to capture a cProfile and tracemalloc snapshot of its next
+    refresh.
+    """
+    try:
+        await request_profile(redis)
+        return await get_profile_status(redis)
+
+    except Exception as e:
+        logger.error(f"Error requesting profile: {e}")
+        raise HTTPException(status_code=500, detail="Failed to request profile") from e
+
+
+@router.get("/profile")
+async def get_profile_status(redis: RedisDep) -> ProfileStatus:
+    """Get the state of the last requested profile"""
+    try:
+        status = await redis.hgetall(PROFILE_STATUS_KEY)  # type: ignore[misc]
+
+        duration = status.get("durationSeconds")
+        return ProfileStatus(
+            requestedAt=_isoformat(status.get("requestedAt")),
+            capturedAt=_isoformat(status.get("capturedAt")),
+            durationSeconds=float(duration) if duration is not None else None,
+        )
+
+    except Exception as e:
+        logger.error(f"Error fetching profile status: {e}")
+        raise HTTPException(
+            status_code=500, detail="Failed to fetch profile status"
+        ) from e
+
+
+async def _download(
+    redis: RedisBytesDep, key: str, media_type: str, filename: str
+) -> Response:
+    data = await redis.get(key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="No profile captured")
+
+    return Response(
+        data,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/profile/pstats")
+async def download_profile_pstats(redis_bytes: RedisBytesDep) -> Response:
+    """
+    Download the cProfile stats of the last captured refresh, readable with
+    `python -m pstats` or snakeviz.
+    """
+    return await _download(
+        redis_bytes, PROFILE_PSTATS_KEY, "application/octet-stream", "refresh.prof"
+    )
+
+
+@router.get("/profile/report")
+async def download_profile_report(redis_bytes: RedisBytesDep) -> Response:
+    """Download the cProfile summary of the last captured refresh"""
+    return await _download(
+        redis_bytes, PROFILE_REPORT_KEY, "text/plain", "refresh-profile.txt"
+    )
+
+
+@router.get("/profile/tracemalloc")
+async def download_profile_tracemalloc(redis_bytes: RedisBytesDep) -> Response:
+    """Download the top allocation sites of the last captured refresh"""
+    return await _download(
+        redis_bytes, PROFILE_TRACEMALLOC_KEY, "text/plain", "refresh-tracemalloc.txt"
+    )
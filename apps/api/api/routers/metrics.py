@@ -0,0 +1,38 @@
+"""Prometheus metrics endpoint"""
+
+import time
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from api.core.config import settings
+from api.core.logging_config import get_logger
+from api.core.metrics import SNAPSHOT_AGE, get_registry
+from api.core.redis import RedisDep, add_key
+
+logger = get_logger(__name__)
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics(redis: RedisDep) -> Response:
+    """Expose the API process metrics in the Prometheus text format"""
+    try:
+        versions = await redis.mget(
+            [
+                add_key("train-snapshot-version", feed.key_namespace)
+                for feed in settings.FEEDS
+            ]
+        )
+        for feed, version in zip(settings.FEEDS, versions, strict=True):
+            # The version expires with the snapshot, so a missing one means
+            # nothing fresh was published for at least CACHE_DURATION
+            SNAPSHOT_AGE.labels(feed.name).set(
+                time.time() - int(version) / 1000 if version else float("inf")
+            )
+    except Exception as e:
+        # Still export the other metrics when Redis is unavailable
+        logger.error(f"Error reading snapshot version: {e}")
+
+    return Response(generate_latest(get_registry()), media_type=CONTENT_TYPE_LATEST)
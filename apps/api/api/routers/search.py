@@ -0,0 +1,45 @@
+"""Search API endpoints"""
+
+import json
+
+from fastapi import APIRouter, HTTPException, Query
+
+from api.core.config import settings
+from api.core.logging_config import get_logger
+from api.core.redis import RedisDep, add_key
+from api.core.snapshot import SnapshotCache
+from api.schemas.search import SearchResponse, SearchResult
+from api.util.search import search
+
+logger = get_logger(__name__)
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+# Of the primary feed
+_search_index = SnapshotCache(
+    add_key("train-search-index", settings.FEEDS[0].key_namespace),
+    json.loads,
+    settings.FEEDS[0].key_namespace,
+)
+
+
+@router.get("")
+async def search_trains(
+    redis: RedisDep,
+    q: str = Query(min_length=1, max_length=100),
+    limit: int = Query(default=10, ge=1, le=50),
+) -> SearchResponse:
+    """Search trains, routes, stations and counties of the current snapshot"""
+    try:
+        index = await _search_index.get(redis)
+    except Exception as e:
+        logger.error(f"Error loading search index: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search") from e
+
+    if index is None:
+        return SearchResponse(query=q, results=[])
+
+    return SearchResponse(
+        query=q,
+        results=[SearchResult(**hit) for hit in search(index, q, limit)],
+    )
@@ -0,0 +1,98 @@
+"""Stations API endpoints"""
+
+import json
+
+from fastapi import APIRouter, HTTPException, Query
+
+from api.core.config import settings
+from api.core.logging_config import get_logger
+from api.core.redis import RedisDep, add_key
+from api.schemas.stations import NearbyStation, NearbyStations, StationBoard
+from api.services.nearby import find_nearby
+from api.util.spatial import STATION_FIELDS
+from api.util.station import station_county_key, station_key
+
+logger = get_logger(__name__)
+
+router = APIRouter(prefix="/stations", tags=["stations"])
+
+
+@router.get("/nearby")
+async def get_nearby_stations(
+    redis: RedisDep,
+    lat: float = Query(ge=-90, le=90),
+    lon: float = Query(ge=-180, le=180),
+    k: int = Query(default=10, ge=1, le=100),
+    radius: float | None = Query(default=None, gt=0, description="km"),
+) -> NearbyStations:
+    """
+    Get the `k` stations nearest to a point, within `radius` km if given,
+    with their great-circle distance. Covers the stations on the trips of
+    the current snapshot.
+    """
+    try:
+        nearby = await find_nearby(
+            redis, settings.FEEDS, "stations", lat, lon, k, radius
+        )
+    except Exception as e:
+        logger.error(f"Error finding nearby stations: {e}")
+        raise HTTPException(
+            status_code=500, detail="Failed to find nearby stations"
+        ) from e
+
+    return NearbyStations(
+        stations=[
+            NearbyStation(
+                **dict(zip(STATION_FIELDS, entry, strict=True)),
+                distanceKm=round(distance, 3),
+            )
+            for distance, _, entry in nearby
+        ]
+    )
+
+
+@router.get("/{name}/board")
+async def get_station_board(
+    name: str,
+    redis: RedisDep,
+    limit: int = Query(default=20, ge=1, le=100),
+    county: str | None = Query(
+        default=None, description="Required where stations share the name"
+    ),
+) -> StationBoard:
+    """Get upcoming arrivals at a station"""
+    try:
+        data = await redis.hget(  # type: ignore[misc]
+            add_key("train-station-boards", settings.FEEDS[0].key_namespace),
+            station_key(name),
+        )
+
+        if not data:
+            raise HTTPException(status_code=404, detail="Station not found")
+
+        boards = json.loads(data)
+        if county is not None:
+            key = station_county_key(name, county)
+            boards = [
+                b for b in boards if station_county_key(b["name"], b["county"]) == key
+            ]
+            if not boards:
+                raise HTTPException(status_code=404, detail="Station not found")
+        elif len(boards) > 1:
+            counties = ", ".join(sorted(b["county"] or "" for b in boards))
+            raise HTTPException(
+                status_code=409,
+                detail=f"Several stations share the name, pass a county: {counties}",
+            )
+
+        board = boards[0]
+        board["arrivals"] = board["arrivals"][:limit]
+        return StationBoard(**board)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching station board: {e}")
+        raise HTTPException(
+            status_code=500, detail="Failed to fetch station board"
+        ) from e
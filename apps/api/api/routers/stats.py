@@ -0,0 +1,41 @@
+"""Delay statistics API endpoints"""
+
+import json
+from datetime import UTC, datetime
+
+from fastapi import APIRouter, HTTPException
+
+from api.core.config import settings
+from api.core.logging_config import get_logger
+from api.core.redis import RedisDep, add_key
+from api.schemas.stats import DelayStats
+
+logger = get_logger(__name__)
+
+router = APIRouter(prefix="/stats", tags=["stats"])
+
+
+@router.get("")
+async def get_delay_stats(redis: RedisDep) -> DelayStats:
+    """Get delay aggregates per county, route and vehicle type"""
+    try:
+        data = await redis.get(
+            add_key("train-delay-stats", settings.FEEDS[0].key_namespace)
+        )
+
+        if not data:
+            raise HTTPException(status_code=404, detail="No statistics available")
+
+        stats = json.loads(data)
+        stats["timestamp"] = datetime.fromtimestamp(
+            stats["timestamp"] / 1000, tz=UTC
+        ).isoformat()
+        return DelayStats(**stats)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching delay stats: {e}")
+        raise HTTPException(
+            status_code=500, detail="Failed to fetch delay statistics"
+        ) from e
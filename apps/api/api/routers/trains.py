@@ -1,40 +1,229 @@
 """Trains API endpoints"""
 
+import asyncio
 import json
 import time
 from datetime import UTC, datetime
+from typing import Any, NamedTuple
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from redis.asyncio import Redis
 
+from api.core.config import FeedConfig, settings
 from api.core.logging_config import get_logger
-from api.core.redis import RedisDep, add_key
+from api.core.metrics import REDIS_SECONDS
+from api.core.redis import RedisBytesDep, RedisDep, add_key, codec
+from api.core.shared_snapshot import shared_snapshots
+from api.core.tracing import link_snapshot
 from api.schemas.trains import (
+    CompactVehiclePosition,
+    NearbyTrain,
+    NearbyTrains,
     TrainFeatureCollection,
+    TrainHistory,
     VehiclePositionWithDelay,
 )
+from api.services.archive import load_archived_snapshot
+from api.services.catalog import CatalogGenerationError
+from api.services.details import get_vehicle_details
+from api.services.nearby import find_nearby
+from api.util.extrapolate import extrapolate_feature
+from api.util.geometry import RouteDetail, detail_for_zoom, with_route_detail
+from api.util.history import downsample, history_key, unpack_history
+from api.util.spatial import VEHICLE_FIELDS
 
 logger = get_logger(__name__)
 
 router = APIRouter(prefix="/trains", tags=["trains"])
 
 
-@router.get("")
+def accepts_zstd(accept_encoding: str | None) -> bool:
+    """
+    Returns whether an Accept-Encoding header lists zstd with a nonzero q.
+    """
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() != "zstd":
+            continue
+
+        _, _, quality = params.replace(" ", "").partition("q=")
+        try:
+            return float(quality or 1) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def select_feeds(names: list[str] | None) -> list[FeedConfig]:
+    """
+    Returns the requested feeds, or all of them when none are requested.
+    """
+    if not names:
+        return settings.FEEDS
+
+    feeds = {feed.name: feed for feed in settings.FEEDS}
+    unknown = [name for name in names if name not in feeds]
+    if unknown:
+        raise HTTPException(
+            status_code=404, detail=f"Unknown feed: {', '.join(unknown)}"
+        )
+    return [feeds[name] for name in dict.fromkeys(names)]
+
+
+async def load_feature_collection(
+    redis: Redis, feed: FeedConfig
+) -> dict[str, Any] | None:
+    """
+    Returns the feature collection of a feed in the format the refresh
+    stores it, from the shared snapshot or Redis.
+    """
+    shared = shared_snapshots[feed.name].get()
+    if shared is not None:
+        return shared.feature_collection()
+
+    namespace = feed.key_namespace
+    with REDIS_SECONDS.labels("get_trains").time():
+        raw = await redis.get(add_key("train-positions-geojson", namespace))
+        if not raw:
+            # Serve the last known good snapshot, its age flags it as stale
+            raw = await redis.get(add_key("train-positions-geojson-lkg", namespace))
+
+    return json.loads(codec.decode(raw)) if raw else None
+
+
+class VehicleMatch(NamedTuple):
+    feed: FeedConfig
+    # The vehicle document as the refresh stores it
+    data: bytes | memoryview
+    # Snapshot version of the document, None for the last known good one
+    version: int | None
+
+
+async def find_vehicle(
+    redis: Redis, vehicle_id: str, feeds: list[FeedConfig]
+) -> VehicleMatch | None:
+    """
+    Returns the document of a vehicle from the first of `feeds` it is in.
+    """
+    for feed in feeds:
+        shared = shared_snapshots[feed.name].get()
+        if shared is not None:
+            data = shared.vehicle(vehicle_id)
+            if data is not None:
+                return VehicleMatch(feed, data, shared.version)
+            continue
+
+        namespace = feed.key_namespace
+        with REDIS_SECONDS.labels("get_train_details").time():
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hget(add_key("train-positions-hash", namespace), vehicle_id)
+                pipe.get(add_key("train-snapshot-version", namespace))
+                data, version = await pipe.execute()
+            if not data:
+                version = None
+                data = await redis.hget(  # type: ignore[misc]
+                    add_key("train-positions-hash-lkg", namespace), vehicle_id
+                )
+        if data:
+            return VehicleMatch(
+                feed, codec.decode(data), int(version) if version else None
+            )
+
+    return None
+
+
+@router.get("", response_model=TrainFeatureCollection)
 async def get_trains(
-    redis: RedisDep,
-) -> TrainFeatureCollection:
-    """Get trains information as GeoJSON FeatureCollection"""
+    redis: RedisBytesDep,
+    response: Response,
+    extrapolate: bool = False,
+    detail: RouteDetail | None = None,
+    zoom: int | None = Query(default=None, ge=0, le=22),
+    feed: list[str] | None = Query(default=None),
+    at: datetime | None = None,
+    accept_encoding: str | None = Header(default=None, include_in_schema=False),
+) -> TrainFeatureCollection | Response:
+    """
+    Get trains information as GeoJSON FeatureCollection.
+    With `extrapolate`, positions are advanced along the route to the
+    predicted position at request time.
+
+    Route polylines are simplified to the given `detail` level, or to the
+    one that looks exact at the map `zoom`. They are full resolution when
+    neither is given.
+
+    Vehicles of every feed are merged, unless `feed` selects some of them.
+
+    With `at`, the last archived snapshot published by then is served, and
+    the data age and extrapolation are relative to `at`. Naive times are
+    taken as UTC.
+    """
     req_start = time.time()
+    response.headers["Vary"] = "Accept-Encoding"
+    if detail is None:
+        detail = detail_for_zoom(zoom) if zoom is not None else "full"
+    feeds = select_feeds(feed)
+    if at is not None and not settings.ARCHIVE_ENABLE:
+        raise HTTPException(status_code=404, detail="Snapshot archive is disabled")
 
     try:
-        step_start = time.time()
-        cached_data_string = await redis.get(add_key("train-positions-geojson"))
+        # A single snapshot can be served as published
+        if len(feeds) == 1 and not extrapolate and at is None:
+            shared = shared_snapshots[feeds[0].name].get()
+            if shared is not None:
+                link_snapshot(shared.version, shared.traceparent)
+                return shared.trains_response(
+                    int(time.time() * 1000), accepts_zstd(accept_encoding), detail
+                )
 
-        cached_data = json.loads(cached_data_string) if cached_data_string else None
-        logger.info(f"Redis get (Time: {(time.time() - step_start):.4f}s)")
+            if accepts_zstd(accept_encoding):
+                # The stored responses expire once their data age would change
+                namespace = feeds[0].key_namespace
+                with REDIS_SECONDS.labels("get_trains").time():
+                    async with redis.pipeline(transaction=False) as pipe:
+                        pipe.hget(
+                            add_key("train-positions-response", namespace), detail
+                        )
+                        pipe.get(add_key("train-snapshot-version", namespace))
+                        pipe.get(add_key("train-snapshot-traceparent", namespace))
+                        compressed, version, traceparent = await pipe.execute()
 
-        now = int(time.time() * 1000)
+                if compressed is not None and version is not None:
+                    link_snapshot(version, traceparent and traceparent.decode())
+                    logger.info(
+                        "Serving compressed data "
+                        f"(Time: {(time.time() - req_start):.4f}s)"
+                    )
+                    return Response(
+                        compressed,
+                        media_type="application/json",
+                        headers={
+                            "Content-Encoding": "zstd",
+                            "Vary": "Accept-Encoding",
+                        },
+                    )
 
-        if not cached_data:
+        step_start = time.time()
+        if at is None:
+            now = int(time.time() * 1000)
+            loaded = await asyncio.gather(
+                *(load_feature_collection(redis, selected) for selected in feeds)
+            )
+        else:
+            if at.tzinfo is None:
+                at = at.replace(tzinfo=UTC)
+            now = int(at.timestamp() * 1000)
+            with REDIS_SECONDS.labels("get_trains_archive").time():
+                loaded = await asyncio.gather(
+                    *(
+                        load_archived_snapshot(redis, selected.key_namespace, now)
+                        for selected in feeds
+                    )
+                )
+        collections = [collection for collection in loaded if collection]
+        logger.info(f"Redis get (Time: {(time.time() - step_start):.4f}s)")
+
+        if not collections:
             logger.info("No cached data, returning empty response")
             return TrainFeatureCollection(
                 timestamp=datetime.now(UTC).isoformat(),
@@ -43,18 +232,30 @@ async def get_trains(
                 features=[],
             )
 
-        # Calculate data age
-        data_age_ms = (now - cached_data["timestamp"]) if cached_data else 0
-        data_age_minutes = data_age_ms // 60000
+        for collection in collections:
+            link_snapshot(collection["timestamp"], collection.get("traceparent"))
+
+        # The oldest snapshot sets the data age, so a stalled feed shows
+        timestamp = min(collection["timestamp"] for collection in collections)
+        data_age_minutes = (now - timestamp) // 60000
+
+        features = [
+            feature for collection in collections for feature in collection["features"]
+        ]
+        if extrapolate:
+            # Along the full resolution route, simplified afterwards
+            features = [extrapolate_feature(f, now / 1000) for f in features]
+        if detail != "full":
+            features = [with_route_detail(f, detail) for f in features]
 
         logger.info(f"Serving cached data (Time: {(time.time() - req_start):.4f}s)")
         return TrainFeatureCollection(
-            timestamp=datetime.fromtimestamp(
-                cached_data["timestamp"] / 1000, tz=UTC
-            ).isoformat(),
-            noDataReceived=cached_data.get("noDataReceived", False),
+            timestamp=datetime.fromtimestamp(timestamp / 1000, tz=UTC).isoformat(),
+            noDataReceived=all(
+                collection.get("noDataReceived", False) for collection in collections
+            ),
             dataAgeMinutes=data_age_minutes,
-            features=cached_data["features"],
+            features=features,
         )
 
     except Exception as e:
@@ -69,25 +270,133 @@ async def get_trains(
         ) from e
 
 
-@router.get("/{vehicle_id}")
-async def get_train_details(
-    vehicle_id: str,
+@router.get("/nearby")
+async def get_nearby_trains(
     redis: RedisDep,
-) -> VehiclePositionWithDelay:
-    """Get specific train details"""
+    lat: float = Query(ge=-90, le=90),
+    lon: float = Query(ge=-180, le=180),
+    k: int = Query(default=10, ge=1, le=100),
+    radius: float | None = Query(default=None, gt=0, description="km"),
+    feed: list[str] | None = Query(default=None),
+) -> NearbyTrains:
+    """
+    Get the `k` trains nearest to a point, within `radius` km if given, with
+    their great-circle distance. Positions are as of the last refresh.
+    """
+    feeds = select_feeds(feed)
     try:
-        hash_key = add_key("train-positions-hash")
-        data = await redis.hget(hash_key, vehicle_id)
+        nearby = await find_nearby(redis, feeds, "vehicles", lat, lon, k, radius)
+    except Exception as e:
+        logger.error(f"Error finding nearby trains: {e}")
+        raise HTTPException(
+            status_code=500, detail="Failed to find nearby trains"
+        ) from e
+
+    return NearbyTrains(
+        trains=[
+            NearbyTrain(
+                **dict(zip(VEHICLE_FIELDS, entry, strict=True)),
+                feed=match_feed.name,
+                distanceKm=round(distance, 3),
+            )
+            for distance, match_feed, entry in nearby
+        ]
+    )
+
 
-        if not data:
+@router.get(
+    "/{vehicle_id}", response_model=VehiclePositionWithDelay | CompactVehiclePosition
+)
+async def get_train_details(
+    vehicle_id: str,
+    redis: RedisBytesDep,
+    text_redis: RedisDep,
+    feed: str | None = None,
+    compact: bool = False,
+) -> VehiclePositionWithDelay | CompactVehiclePosition | Response:
+    """
+    Get specific train details, from the given `feed` or the first feed
+    the train is in.
+
+    With `compact`, stops, alerts and information services are given by
+    their id in the catalog of the feed (see /v1/stops, /v1/alerts and
+    /v1/info-services), instead of in full.
+    """
+    feeds = select_feeds([feed] if feed else None)
+    try:
+        match = await find_vehicle(redis, vehicle_id, feeds)
+        if match is None:
             raise HTTPException(status_code=404, detail="Train not found")
 
-        return VehiclePositionWithDelay(**json.loads(data))
+        # Computed on the first request for the vehicle in the snapshot
+        details = await get_vehicle_details(
+            text_redis, match.feed, vehicle_id, match.version, match.data, compact
+        )
+        return Response(details, media_type="application/json")
 
     except HTTPException:
         raise
+    except CatalogGenerationError as e:
+        # The document outlived the catalog generation it refers to
+        logger.error(f"Error expanding train details: {e}")
+        raise HTTPException(
+            status_code=409,
+            detail="Train details refer to a replaced catalog, retry the request",
+        ) from e
     except Exception as e:
         logger.error(f"Error fetching train details: {e}")
         raise HTTPException(
             status_code=500, detail="Failed to fetch train details"
         ) from e
+
+
+@router.get("/{vehicle_id}/history")
+async def get_train_history(
+    vehicle_id: str,
+    redis_bytes: RedisBytesDep,
+    service_date: str | None = Query(default=None, alias="serviceDate"),
+    trip_short_name: str | None = Query(default=None, alias="tripShortName"),
+    max_points: int = Query(default=0, alias="maxPoints", ge=0, le=1000),
+    feed: str | None = None,
+) -> TrainHistory:
+    """
+    Get the recorded delay history of a train.
+    Defaults to the trip the train is currently running, in the given `feed`
+    or the first feed the train is in.
+    """
+    feeds = select_feeds([feed] if feed else None)
+    try:
+        history_feed = feeds[0]
+        if service_date is None or trip_short_name is None:
+            match = await find_vehicle(redis_bytes, vehicle_id, feeds)
+            if match is None:
+                raise HTTPException(status_code=404, detail="Train not found")
+
+            history_feed = match.feed
+            trip = json.loads(bytes(match.data)).get("trip", {})
+            service_date = trip.get("serviceDate", "")
+            trip_short_name = trip.get("tripShortName", "")
+
+        records = await redis_bytes.lrange(  # type: ignore[misc]
+            add_key(
+                history_key(vehicle_id, service_date, trip_short_name),
+                history_feed.key_namespace,
+            ),
+            0,
+            -1,
+        )
+
+        return TrainHistory(
+            vehicleId=vehicle_id,
+            serviceDate=service_date,
+            tripShortName=trip_short_name,
+            points=downsample(unpack_history(records), max_points),
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching train history: {e}")
+        raise HTTPException(
+            status_code=500, detail="Failed to fetch train history"
+        ) from e
@@ -0,0 +1,52 @@
+from pydantic import BaseModel
+
+
+class CatalogStop(BaseModel):
+    """A stop of the catalog"""
+
+    id: int
+    name: str
+    lat: float
+    lon: float
+    county: str | None = None
+
+
+class CatalogAlert(BaseModel):
+    """An alert of the catalog"""
+
+    id: int
+    alertDescriptionText: str
+    alertUrl: str | None = None
+    effectiveStartDate: int
+    effectiveEndDate: int
+
+
+class CatalogInfoService(BaseModel):
+    """An information service of the catalog"""
+
+    id: int
+    name: str
+    fontCharSet: str
+    fontCode: int
+    displayable: bool
+
+
+class StopCatalog(BaseModel):
+    """Stops referred to by id from compact vehicle details"""
+
+    generation: int
+    stops: list[CatalogStop]
+
+
+class AlertCatalog(BaseModel):
+    """Alerts referred to by id from compact vehicle details"""
+
+    generation: int
+    alerts: list[CatalogAlert]
+
+
+class InfoServiceCatalog(BaseModel):
+    """Information services referred to by id from compact vehicle details"""
+
+    generation: int
+    infoServices: list[CatalogInfoService]
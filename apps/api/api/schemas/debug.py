@@ -0,0 +1,30 @@
+from pydantic import BaseModel
+
+
+class ProcessingCost(BaseModel):
+    """Processing cost of a single vehicle in the last refresh"""
+
+    vehicleId: str
+    tripShortName: str
+    routeShortName: str
+    seconds: float
+    geometryPoints: int
+    stopCount: int
+    projectionFallbacks: int
+
+
+class ProcessingCosts(BaseModel):
+    """Most expensive vehicles of the last refresh"""
+
+    timestamp: str
+    vehicles: int
+    totalSeconds: float
+    costs: list[ProcessingCost]
+
+
+class ProfileStatus(BaseModel):
+    """State of the last requested refresh profile"""
+
+    requestedAt: str | None = None
+    capturedAt: str | None = None
+    durationSeconds: float | None = None
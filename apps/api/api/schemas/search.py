@@ -0,0 +1,20 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class SearchResult(BaseModel):
+    """A single ranked search hit"""
+
+    kind: Literal["train", "route", "station", "county"]
+    label: str
+    detail: str | None = None
+    vehicleId: str | None = None
+    score: float
+
+
+class SearchResponse(BaseModel):
+    """Ranked search results for a query"""
+
+    query: str
+    results: list[SearchResult]
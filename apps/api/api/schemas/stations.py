@@ -0,0 +1,42 @@
+from pydantic import BaseModel
+
+
+class StationBoardEntry(BaseModel):
+    """An upcoming arrival at a station"""
+
+    vehicleId: str
+    tripShortName: str
+    routeShortName: str
+    destination: str | None = None
+    platformCode: str | None = None
+    scheduledArrival: int
+    realtimeArrival: int
+    scheduledDeparture: int
+    realtimeDeparture: int
+    predictedArrival: int | None = None
+    predictedDeparture: int | None = None
+    delay: int
+
+
+class StationBoard(BaseModel):
+    """Upcoming arrivals at a station, ordered by predicted arrival"""
+
+    name: str
+    county: str | None = None
+    arrivals: list[StationBoardEntry]
+
+
+class NearbyStation(BaseModel):
+    """A station near a point, with its great-circle distance"""
+
+    name: str
+    county: str | None = None
+    lat: float
+    lon: float
+    distanceKm: float
+
+
+class NearbyStations(BaseModel):
+    """Stations nearest to a point, nearest first"""
+
+    stations: list[NearbyStation]
@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+
+
+class DelayAggregate(BaseModel):
+    """Delay summary of a group of trains, in minutes"""
+
+    count: int
+    mean: float
+    p50: int
+    p90: int
+    max: int
+    overThreshold: int
+
+
+class DelayStats(BaseModel):
+    """Delay aggregates of the current snapshot"""
+
+    timestamp: str
+    thresholdMinutes: int
+    overall: DelayAggregate | None = None
+    counties: dict[str, DelayAggregate]
+    routes: dict[str, DelayAggregate]
+    vehicleTypes: dict[str, DelayAggregate]
@@ -89,6 +89,14 @@ class VehicleProgress(BaseModel):
     progress: float
 
 
+class StopPredictions(BaseModel):
+    """Predicted times of the stoptimes from fromStopIndex on, in service day seconds"""
+
+    fromStopIndex: int
+    arrivals: list[int]
+    departures: list[int]
+
+
 class VehiclePositionWithDelay(BaseModel):
     """Complete vehicle position with delay and processing data"""
 
@@ -104,6 +112,68 @@ class VehiclePositionWithDelay(BaseModel):
     totalRouteDistance: float
     processedStops: list[ProcessedStop]
     vehicleProgress: VehicleProgress
+    predictions: StopPredictions | None = None
+
+
+class CompactStopTime(BaseModel):
+    """Stop time referring to its stop in the catalog"""
+
+    scheduledArrival: int
+    realtimeArrival: int
+    scheduledDeparture: int
+    realtimeDeparture: int
+    stopId: int
+    platformCode: str | None = None
+
+
+class CompactInfoService(BaseModel):
+    """Information service referring to its record in the catalog"""
+
+    infoServiceId: int
+    fromStopIndex: int
+    tillStopIndex: int
+
+
+class CompactTrip(BaseModel):
+    """Trip information referring to stops, alerts and services by id"""
+
+    serviceDate: str
+    tripShortName: str
+    route: Route
+    tripGeometry: TripGeometry
+    stoptimes: list[CompactStopTime]
+    wheelchairAccessible: str
+    bikesAllowed: str
+    infoServices: list[CompactInfoService]
+    alertIds: list[int]
+
+
+class CompactProcessedStop(BaseModel):
+    """Processed stop referring to its stop time by index"""
+
+    id: str
+    originalCoords: list[float]
+    distanceAlongRoute: float
+    stopTimeIndex: int | None = None
+
+
+class CompactVehiclePosition(BaseModel):
+    """Vehicle position with ids into the catalog of the given generation"""
+
+    vehicleId: str
+    lat: float
+    lon: float
+    heading: float | None = None
+    speed: float | None = None
+    lastUpdated: int
+    trip: CompactTrip
+    delay: int
+    trainPosition: float
+    totalRouteDistance: float
+    processedStops: list[CompactProcessedStop]
+    vehicleProgress: VehicleProgress
+    predictions: StopPredictions | None = None
+    catalog: int
 
 
 class APIResponse(BaseModel):
@@ -119,7 +189,7 @@ class APIResponse(BaseModel):
 class TrainFeatureProperties(BaseModel):
     """Properties for a train feature (lighter version)"""
 
-    type: Literal["train", "hev", "tramtrain"]
+    type: Literal["train", "hev", "tramtrain", "tram", "bus", "trolleybus"]
     vehicleId: str
     lat: float
     lon: float
@@ -131,6 +201,9 @@ class TrainFeatureProperties(BaseModel):
     delay: int
     routePolyline: str | None = None
     distanceToNextStop: float | None = None
+    extrapolatedSeconds: int | None = None
+    routeProgress: float | None = None
+    feed: str | None = None
 
 
 class TrainFeature(BaseModel):
@@ -149,3 +222,42 @@ class TrainFeatureCollection(BaseModel):
     noDataReceived: bool | None = False
     dataAgeMinutes: int | None = None
     features: list[TrainFeature]
+
+
+class TrainHistoryPoint(BaseModel):
+    """A recorded position and delay of a train"""
+
+    timestamp: int
+    delay: int
+    progress: float
+    lat: float
+    lon: float
+
+
+class TrainHistory(BaseModel):
+    """Recorded delay history of a train on a trip"""
+
+    vehicleId: str
+    serviceDate: str
+    tripShortName: str
+    points: list[TrainHistoryPoint]
+
+
+class NearbyTrain(BaseModel):
+    """A train near a point, with its great-circle distance"""
+
+    vehicleId: str
+    feed: str
+    type: Literal["train", "hev", "tramtrain", "tram", "bus", "trolleybus"]
+    lat: float
+    lon: float
+    tripShortName: str
+    routeShortName: str
+    delay: int
+    distanceKm: float
+
+
+class NearbyTrains(BaseModel):
+    """Trains nearest to a point, nearest first"""
+
+    trains: list[NearbyTrain]
@@ -0,0 +1,100 @@
+"""Archive of the published snapshots, kept in Redis in rotating segments"""
+
+from collections.abc import AsyncIterator
+from typing import Any
+
+from redis.asyncio import Redis
+
+from api.core.config import FeedConfig, settings
+from api.core.redis import add_key
+from api.util.archive import ArchiveEncoder, decode_until
+
+
+def archive_index_key(namespace: str) -> str:
+    """Sorted set of the segments of a feed, scored by their start (ms)"""
+    return add_key("train-archive-segments", namespace)
+
+
+def archive_segment_key(segment: str, namespace: str) -> str:
+    """List of the frames of a segment"""
+    return add_key(f"train-archive:{segment}", namespace)
+
+
+# Start (ms) and encoder of the segment being written per feed. Every worker
+# process starts a segment of its own, as frames only decode from the
+# keyframe of their segment on.
+archive_segments: dict[str, tuple[int, ArchiveEncoder]] = {}
+
+
+async def archive_snapshot(
+    redis: Redis, feed: FeedConfig, version: int, feature_collection: dict[str, Any]
+) -> int:
+    """
+    Appends a published snapshot to the archive of the feed, starting a new
+    segment every ARCHIVE_SEGMENT_SECONDS. Segments expire and leave the
+    index ARCHIVE_RETENTION_SECONDS after they end.
+    Returns the stored size of the frame.
+    """
+    segment_ms = settings.ARCHIVE_SEGMENT_SECONDS * 1000
+    start, encoder = archive_segments.get(feed.name, (0, None))
+    if encoder is None or version - start >= segment_ms:
+        start, encoder = archive_segments[feed.name] = (version, ArchiveEncoder())
+
+    frame = encoder.encode(version, feature_collection)
+
+    namespace = feed.key_namespace
+    segment_key = archive_segment_key(str(start), namespace)
+    retention_ms = settings.ARCHIVE_RETENTION_SECONDS * 1000
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(segment_key, frame)
+            pipe.pexpireat(segment_key, start + segment_ms + retention_ms)
+            pipe.zadd(archive_index_key(namespace), {str(start): start})
+            pipe.zremrangebyscore(
+                archive_index_key(namespace),
+                "-inf",
+                version - segment_ms - retention_ms,
+            )
+            await pipe.execute()
+    except Exception:
+        # The next frames would be encoded against one that was never stored
+        archive_segments.pop(feed.name, None)
+        raise
+
+    return len(frame)
+
+
+async def load_archived_snapshot(
+    redis: Redis, namespace: str, at: int
+) -> dict[str, Any] | None:
+    """
+    Returns the last archived snapshot published at or before `at` (ms), in
+    the format the refresh stores it. `redis` must return raw bytes.
+    """
+    segments = await redis.zrevrangebyscore(
+        archive_index_key(namespace), at, "-inf", start=0, num=1
+    )
+    if not segments:
+        return None
+
+    frames = await redis.lrange(  # type: ignore[misc]
+        archive_segment_key(segments[0].decode(), namespace), 0, -1
+    )
+    return decode_until(frames, at)
+
+
+async def iter_archived_frames(
+    redis: Redis, namespace: str, start: int, end: int
+) -> AsyncIterator[bytes]:
+    """
+    Yields the frames of the segments overlapping `start` to `end` (ms), as
+    stored. `redis` must return raw bytes.
+    """
+    index_key = archive_index_key(namespace)
+    first = await redis.zrevrangebyscore(index_key, start, "-inf", start=0, num=1)
+    later = await redis.zrangebyscore(index_key, f"({start}", end)
+    for segment in [*first, *later]:
+        for frame in await redis.lrange(  # type: ignore[misc]
+            archive_segment_key(segment.decode(), namespace), 0, -1
+        ):
+            yield frame
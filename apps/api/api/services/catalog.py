@@ -0,0 +1,84 @@
+"""Catalog of the records and trips the vehicle documents refer to"""
+
+import json
+from typing import Any
+
+from redis.asyncio import Redis
+
+from api.core.config import FeedConfig, settings
+from api.core.redis import add_key
+from api.core.snapshot import SnapshotCache
+
+# Catalog replaced by the current generation of each feed
+previous_catalogs: dict[str, dict[str, Any]] = {}
+
+
+class CatalogGenerationError(Exception):
+    """The catalog generation a vehicle document refers to is gone"""
+
+
+catalog_caches = {
+    feed.name: SnapshotCache(
+        add_key("train-catalog", feed.key_namespace), json.loads, feed.key_namespace
+    )
+    for feed in settings.FEEDS
+}
+
+
+async def get_catalog(redis: Redis, feed: FeedConfig) -> dict[str, Any] | None:
+    """
+    Returns the catalog document of a feed, parsed once per snapshot.
+    """
+    catalog = await catalog_caches[feed.name].get(redis)
+    if catalog is None:
+        # Without a current snapshot, the last known good one refers to it
+        raw = await redis.get(add_key("train-catalog", feed.key_namespace))
+        catalog = json.loads(raw) if raw else None
+    return catalog
+
+
+async def get_catalog_generation(
+    redis: Redis, feed: FeedConfig, generation: int
+) -> dict[str, Any]:
+    """
+    Returns the catalog document of a given generation of a feed, the
+    current one or the one it replaced.
+
+    Raises CatalogGenerationError if neither is of that generation.
+    """
+    catalog = await get_catalog(redis, feed)
+    if catalog is not None and catalog["generation"] == generation:
+        return catalog
+
+    previous = previous_catalogs.get(feed.name)
+    if previous is None or previous["generation"] != generation:
+        raw = await redis.get(add_key("train-catalog-previous", feed.key_namespace))
+        previous = json.loads(raw) if raw else None
+        if previous is not None:
+            previous_catalogs[feed.name] = previous
+
+    if previous is None or previous["generation"] != generation:
+        raise CatalogGenerationError(
+            f"Catalog generation {generation} of feed {feed.name} is gone"
+        )
+    return previous
+
+
+async def get_catalog_trip(
+    redis: Redis, feed: FeedConfig, generation: int, digest: str
+) -> dict[str, Any]:
+    """
+    Returns a trip interned in the catalog of a given generation of a feed.
+
+    Raises CatalogGenerationError if the trips of that generation are gone.
+    """
+    raw = await redis.hget(  # type: ignore[misc]
+        add_key(f"train-catalog-trips:{generation}", feed.key_namespace), digest
+    )
+    if raw is None:
+        raise CatalogGenerationError(
+            f"Trip {digest} of catalog generation {generation} of feed "
+            f"{feed.name} is gone"
+        )
+    trip: dict[str, Any] = json.loads(raw)
+    return trip
@@ -0,0 +1,148 @@
+"""Vehicle details, computed on the first request for a vehicle per snapshot"""
+
+import asyncio
+import json
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from redis.asyncio import Redis
+
+from api.core.config import FeedConfig, settings
+from api.schemas.trains import CompactVehiclePosition, VehiclePositionWithDelay
+from api.services.catalog import (
+    CatalogGenerationError,
+    get_catalog_generation,
+    get_catalog_trip,
+)
+from api.util.catalog import expand, restore_trip
+from api.util.preprocess import get_processed_stops
+
+
+def build_details(
+    location: dict[str, Any],
+    catalog: dict[str, Any] | None,
+    compact: bool,
+    trip: dict[str, Any] | None = None,
+) -> bytes:
+    """
+    Returns the serialized details of a vehicle document as the refresh
+    stores it, with the processed stops rebuilt from the stop distances.
+    `catalog` is the catalog document the vehicle document was compacted
+    against, and `trip` the catalog trip it refers to. Unless `compact`, the
+    catalog records are expanded in place of the ids.
+    """
+    model = CompactVehiclePosition if compact else VehiclePositionWithDelay
+    if "catalog" in location:
+        if catalog is None or catalog["generation"] != location["catalog"]:
+            raise CatalogGenerationError(
+                f"Catalog generation {location['catalog']} is missing"
+            )
+
+        # Earlier refreshes stored the trip itself
+        if "tripDigest" in location["trip"]:
+            if trip is None:
+                raise CatalogGenerationError(
+                    f"Trip {location['trip']['tripDigest']} is missing"
+                )
+            location = restore_trip(location, trip)
+
+        # Earlier refreshes stored the processed stops themselves
+        if "stopDistances" in location:
+            location = location.copy()
+            stops = catalog["stops"]
+            location["processedStops"] = get_processed_stops(
+                [stops[st["stopId"]] for st in location["trip"]["stoptimes"]],
+                location.pop("stopDistances"),
+            )
+        if not compact:
+            location = expand(location, catalog)
+
+    return model.model_validate(location).model_dump_json().encode()
+
+
+class DetailCache:
+    """
+    Keeps the serialized details of the vehicles requested for the current
+    snapshot version of a feed. Concurrent requests for a vehicle whose
+    details are still being computed wait for that computation instead of
+    starting their own.
+    """
+
+    def __init__(self) -> None:
+        self._version: int | None = None
+        self._details: dict[tuple[str, bool], bytes] = {}
+        self._pending: dict[tuple[str, bool], asyncio.Task[bytes]] = {}
+
+    async def get(
+        self,
+        version: int | None,
+        key: tuple[str, bool],
+        compute: Callable[[], Awaitable[bytes]],
+    ) -> bytes:
+        """
+        Returns the details stored under `key` for the snapshot `version`,
+        computing them if needed. Details without a version are not kept.
+        """
+        if version is None:
+            return await compute()
+
+        if version != self._version:
+            self._version = version
+            self._details = {}
+            self._pending = {}
+
+        details = self._details.get(key)
+        if details is not None:
+            return details
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._settle(version, key, done))
+
+        # A cancelled request leaves the computation to the others waiting
+        return await asyncio.shield(task)
+
+    def _settle(
+        self, version: int, key: tuple[str, bool], task: asyncio.Task[bytes]
+    ) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if version == self._version:
+            self._details[key] = task.result()
+
+
+vehicle_details = {feed.name: DetailCache() for feed in settings.FEEDS}
+
+
+async def get_vehicle_details(
+    redis: Redis,
+    feed: FeedConfig,
+    vehicle_id: str,
+    version: int | None,
+    data: bytes | memoryview,
+    compact: bool = False,
+) -> bytes:
+    """
+    Returns the serialized details of a vehicle of snapshot `version`, from
+    its document `data` as the refresh stores it.
+    """
+
+    # Read before the mapping of a shared snapshot may be replaced
+    raw = bytes(data)
+
+    async def compute() -> bytes:
+        location = json.loads(raw)
+        catalog = trip = None
+        if "catalog" in location:
+            generation = location["catalog"]
+            catalog = await get_catalog_generation(redis, feed, generation)
+            digest = location["trip"].get("tripDigest")
+            if digest is not None:
+                trip = await get_catalog_trip(redis, feed, generation, digest)
+        return build_details(location, catalog, compact, trip)
+
+    return await vehicle_details[feed.name].get(version, (vehicle_id, compact), compute)
@@ -0,0 +1,68 @@
+"""Nearest train and station queries over the spatial index of every feed"""
+
+import heapq
+import json
+from typing import Any
+
+from redis.asyncio import Redis
+
+from api.core.config import FeedConfig, settings
+from api.core.redis import add_key
+from api.core.snapshot import SnapshotCache
+from api.util.spatial import NearbyIndex
+from api.util.station import station_county_key
+
+
+def parse_nearby_index(raw: str) -> dict[str, NearbyIndex]:
+    document = json.loads(raw)
+    return {
+        "vehicles": NearbyIndex(document["vehicles"]),
+        "stations": NearbyIndex(document["stations"]),
+    }
+
+
+nearby_indexes = {
+    feed.name: SnapshotCache(
+        add_key("train-nearby-index", feed.key_namespace),
+        parse_nearby_index,
+        feed.key_namespace,
+    )
+    for feed in settings.FEEDS
+}
+
+
+async def find_nearby(
+    redis: Redis,
+    feeds: list[FeedConfig],
+    kind: str,
+    lat: float,
+    lon: float,
+    k: int,
+    radius_km: float | None = None,
+) -> list[tuple[float, FeedConfig, list[Any]]]:
+    """
+    Returns up to `k` (distance km, feed, entry) triples of the `kind`
+    ("vehicles" or "stations") nearest to the point across `feeds`, nearest
+    first. Stations served by several feeds are returned once.
+    """
+    candidates: list[tuple[float, FeedConfig, list[Any]]] = []
+    for feed in feeds:
+        indexes = await nearby_indexes[feed.name].get(redis)
+        if indexes is None:
+            continue
+        candidates.extend(
+            (distance, feed, entry)
+            for distance, entry in indexes[kind].nearest(lat, lon, k, radius_km)
+        )
+
+    if kind == "stations":
+        seen: set[tuple[str, str]] = set()
+        unique = []
+        for candidate in sorted(candidates, key=lambda c: c[0]):
+            key = station_county_key(candidate[2][0], candidate[2][3])
+            if key not in seen:
+                seen.add(key)
+                unique.append(candidate)
+        candidates = unique
+
+    return heapq.nsmallest(k, candidates, key=lambda c: c[0])
@@ -0,0 +1,119 @@
+"""On-demand profiling of a refresh cycle"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable
+
+from redis.asyncio import Redis
+
+from api.core.logging_config import get_logger
+from api.core.redis import add_key
+
+logger = get_logger(__name__)
+
+# Profiles are kept for a day after capture
+PROFILE_TTL_SECONDS = 24 * 60 * 60
+
+# Entries of the text reports
+PSTATS_TOP_FUNCTIONS = 50
+TRACEMALLOC_TOP_LINES = 50
+
+# Frames kept per allocation. The report groups by line, which needs only
+# one, and every extra frame makes the traced refresh markedly slower.
+TRACEMALLOC_FRAMES = 1
+
+PROFILE_REQUEST_KEY = add_key("refresh-profile-request")
+PROFILE_STATUS_KEY = add_key("refresh-profile-status")
+PROFILE_PSTATS_KEY = add_key("refresh-profile-pstats")
+PROFILE_REPORT_KEY = add_key("refresh-profile-report")
+PROFILE_TRACEMALLOC_KEY = add_key("refresh-profile-tracemalloc")
+
+
+async def request_profile(redis: Redis) -> None:
+    """
+    Asks the worker to profile its next refresh.
+    """
+    now = int(time.time() * 1000)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.set(PROFILE_REQUEST_KEY, now, ex=PROFILE_TTL_SECONDS)
+        pipe.hset(PROFILE_STATUS_KEY, mapping={"requestedAt": now})
+        pipe.hdel(PROFILE_STATUS_KEY, "capturedAt", "durationSeconds")
+        pipe.expire(PROFILE_STATUS_KEY, PROFILE_TTL_SECONDS)
+        await pipe.execute()
+
+
+async def take_profile_request(redis: Redis) -> bool:
+    """
+    Returns whether a profile was requested, consuming the request.
+    """
+    return await redis.getdel(PROFILE_REQUEST_KEY) is not None
+
+
+def _tracemalloc_report(snapshot: tracemalloc.Snapshot, peak: int) -> str:
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+    )
+    lines = [f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB", ""]
+    for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP_LINES]:
+        lines.append(str(stat))
+    return "\n".join(lines)
+
+
+async def profile_refresh(redis: Redis, refresh: Callable[[], Awaitable[int]]) -> int:
+    """
+    Runs a refresh under cProfile and tracemalloc, and stores the profile,
+    a text summary of it and the top allocation sites in Redis.
+
+    The profiler sees the whole event loop, so other tasks of the worker
+    running during the refresh show up as well. Tracing allocations slows
+    the refresh down several times, so the profiled refresh is not
+    representative of the usual refresh duration.
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        return await refresh()
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats("cumulative").print_stats(PSTATS_TOP_FUNCTIONS)
+
+        async with redis.pipeline(transaction=True) as pipe:
+            # Same format as Profile.dump_stats, loadable with pstats or snakeviz
+            pipe.set(
+                PROFILE_PSTATS_KEY,
+                marshal.dumps(stats.stats),  # type: ignore[attr-defined]
+                ex=PROFILE_TTL_SECONDS,
+            )
+            pipe.set(PROFILE_REPORT_KEY, report.getvalue(), ex=PROFILE_TTL_SECONDS)
+            pipe.set(
+                PROFILE_TRACEMALLOC_KEY,
+                _tracemalloc_report(snapshot, peak),
+                ex=PROFILE_TTL_SECONDS,
+            )
+            pipe.hset(
+                PROFILE_STATUS_KEY,
+                mapping={
+                    "capturedAt": int(time.time() * 1000),
+                    "durationSeconds": round(duration, 4),
+                },
+            )
+            pipe.expire(PROFILE_STATUS_KEY, PROFILE_TTL_SECONDS)
+            await pipe.execute()
+
+        logger.info(f"Stored refresh profile (Time: {duration:.4f}s)")
@@ -0,0 +1,189 @@
+import asyncio
+import functools
+import time
+from datetime import datetime
+
+from redis.asyncio import Redis
+
+from api.core.config import settings
+from api.core.lock import FencingTokenError, RedisLock
+from api.core.logging_config import get_logger
+from api.core.redis import add_key
+from api.core.resilience import CircuitOpenError
+from api.services.profiling import profile_refresh, take_profile_request
+from api.services.train_service import TrainService
+from api.util.time import BUDAPEST_TZ
+
+logger = get_logger(__name__)
+
+# The coordinator is started by the scheduler once per period and keeps
+# refreshing until the next start is due.
+SCHEDULE_PERIOD_SECONDS = 60
+
+# The lease is renewed every third of this while a refresh runs. A leader
+# that stops renewing it loses it after this long, and any snapshot it
+# produces afterwards is rejected by the fencing token.
+LOCK_TTL_SECONDS = 90
+
+# Hours (Budapest time) with only a handful of night trains
+QUIET_HOURS = range(1, 4)
+
+# Fleet size at which the minimum interval is used
+FULL_FLEET_SIZE = 800
+
+# Refreshes may use at most this share of the interval
+MAX_DUTY_CYCLE = 0.5
+
+# Smoothing factor of the refresh duration moving average
+DURATION_EWMA_ALPHA = 0.3
+
+
+def get_refresh_interval(
+    now: datetime, fleet_size: int, refresh_duration: float
+) -> float:
+    """
+    Picks the interval until the next refresh.
+
+    Quiet hours use the maximum interval, otherwise it shrinks towards the
+    minimum as the fleet grows. The interval never drops below what the
+    measured refresh duration allows at the maximum duty cycle.
+    """
+    min_interval = settings.REFRESH_MIN_INTERVAL
+    max_interval = settings.REFRESH_MAX_INTERVAL
+
+    if now.astimezone(BUDAPEST_TZ).hour in QUIET_HOURS:
+        interval = max_interval
+    else:
+        fleet_factor = min(1.0, fleet_size / FULL_FLEET_SIZE)
+        interval = max_interval - (max_interval - min_interval) * fleet_factor
+
+    return max(interval, refresh_duration / MAX_DUTY_CYCLE)
+
+
+class RefreshCoordinator:
+    """
+    Runs refreshes for one schedule period while holding the leader lock,
+    so refreshes never overlap, even with several schedulers or workers.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self.stats_key = add_key("refresh-stats")
+
+    async def _load_stats(self) -> tuple[float, int]:
+        stats = await self.redis.hgetall(self.stats_key)  # type: ignore[misc]
+        return float(stats.get("duration", 0.0)), int(stats.get("fleetSize", 0))
+
+    async def _save_stats(self, duration: float, fleet_size: int) -> None:
+        await self.redis.hset(  # type: ignore[misc]
+            self.stats_key,
+            mapping={"duration": round(duration, 4), "fleetSize": fleet_size},
+        )
+
+    async def _renew_lease(self, lock: RedisLock) -> None:
+        """
+        Extends the lease of the lock until cancelled or lost, so a refresh
+        outliving LOCK_TTL_SECONDS keeps the leadership.
+        """
+        while True:
+            await asyncio.sleep(LOCK_TTL_SECONDS / 3)
+            if not await lock.extend():
+                logger.warning("Refresh lock lost while refreshing")
+                return
+
+    async def refresh_feeds(self, fencing_token: int | None = None) -> int:
+        """
+        Refreshes every feed concurrently. A failing feed keeps serving its
+        previous snapshot without holding back the others, the refresh only
+        fails if all feeds did. Returns the number of vehicles published.
+        """
+        feeds = settings.FEEDS
+        results = await asyncio.gather(
+            *(
+                TrainService(self.redis, feed).refresh_data(fencing_token)
+                for feed in feeds
+            ),
+            return_exceptions=True,
+        )
+
+        fleet_size = 0
+        errors = []
+        for feed, result in zip(feeds, results, strict=True):
+            if isinstance(result, FencingTokenError):
+                raise result
+            if isinstance(result, BaseException):
+                logger.error(f"Refresh of feed {feed.name} failed: {result}")
+                errors.append(result)
+            else:
+                fleet_size += result
+
+        if len(errors) == len(feeds):
+            raise errors[0]
+        return fleet_size
+
+    async def run(self) -> None:
+        period_start = time.monotonic()
+        deadline = period_start + SCHEDULE_PERIOD_SECONDS
+
+        lock = RedisLock(self.redis, add_key("refresh-lock"), LOCK_TTL_SECONDS)
+        if not await lock.acquire():
+            logger.info("Another refresh is still running, skipping this period")
+            return
+
+        avg_duration, fleet_size = await self._load_stats()
+
+        try:
+            while True:
+                refresh_start = time.monotonic()
+                renewal = asyncio.create_task(self._renew_lease(lock))
+                try:
+                    if await take_profile_request(self.redis):
+                        logger.info("Profiling this refresh")
+                        fleet_size = await profile_refresh(
+                            self.redis,
+                            functools.partial(
+                                self.refresh_feeds, fencing_token=lock.fencing_token
+                            ),
+                        )
+                    else:
+                        fleet_size = await self.refresh_feeds(
+                            fencing_token=lock.fencing_token
+                        )
+                except FencingTokenError as e:
+                    logger.warning(f"Lost refresh leadership: {e}")
+                    return
+                except CircuitOpenError as e:
+                    logger.warning(f"Skipping refresh, upstream unavailable: {e}")
+                    return
+                finally:
+                    renewal.cancel()
+
+                duration = time.monotonic() - refresh_start
+                avg_duration = (
+                    duration
+                    if avg_duration == 0
+                    else DURATION_EWMA_ALPHA * duration
+                    + (1 - DURATION_EWMA_ALPHA) * avg_duration
+                )
+                await self._save_stats(avg_duration, fleet_size)
+
+                interval = get_refresh_interval(
+                    datetime.now(BUDAPEST_TZ), fleet_size, avg_duration
+                )
+                next_start = refresh_start + interval
+
+                # Leave the rest of the period to the next scheduled run
+                if next_start + avg_duration > deadline:
+                    break
+
+                logger.info(
+                    f"Next refresh in {next_start - time.monotonic():.1f}s "
+                    f"(interval: {interval:.1f}s, avg duration: {avg_duration:.2f}s)"
+                )
+                await asyncio.sleep(max(0.0, next_start - time.monotonic()))
+
+                if not await lock.extend():
+                    logger.warning("Refresh lock expired, stopping")
+                    return
+        finally:
+            await lock.release()
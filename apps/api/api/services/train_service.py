@@ -1,42 +1,99 @@
+import asyncio
 import json
 import math
 import time
+import zlib
+from collections import defaultdict
 from datetime import UTC, datetime
 from typing import Any
 
 import httpx
-import polyline  # type: ignore[import-untyped]
 from httpx_socks import AsyncProxyTransport  # type: ignore[import-untyped]
+from opentelemetry import trace
 from redis.asyncio import Redis
+from redis.exceptions import WatchError
+from taskiq.kicker import AsyncKicker
 
-from api.core.config import settings
+from api.core.config import FeedConfig, settings
+from api.core.lock import FencingTokenError
 from api.core.logging_config import get_logger
-from api.core.queries import POSITIONS_QUERY
-from api.core.redis import add_key
+from api.core.metrics import (
+    REDIS_SECONDS,
+    REFRESH_PARTITION_EFFICIENCY,
+    REFRESH_PARTITION_FALLBACKS,
+    REFRESH_PARTITION_SECONDS,
+    REFRESH_VEHICLES,
+    SNAPSHOT_PAYLOAD_BYTES,
+    SNAPSHOT_TIMESTAMP,
+    observe_stage,
+)
+from api.core.queries import positions_query
+from api.core.redis import add_key, codec, redis_bytes_pool
+from api.core.resilience import CircuitBreaker, LatencyTracker, hedged
+from api.core.taskiq_broker import broker
+from api.core.tracing import get_traceparent, tracer
+from api.schemas.trains import TrainFeatureCollection
+from api.services.archive import archive_snapshot
+from api.util.catalog import Catalog
 from api.util.county import get_county_for_point
-from api.util.preprocess import get_delay_and_position
+from api.util.extrapolate import get_leg_speed
+from api.util.geometry import (
+    ROUTE_DETAILS,
+    get_simplified_polylines,
+    with_route_detail,
+)
+from api.util.history import (
+    HISTORY_LENGTH,
+    get_history_expiry,
+    history_key,
+    pack_history_record,
+)
+from api.util.preprocess import (
+    get_delay_and_position,
+    get_processed_stops,
+    projection_counts,
+)
+from api.util.route_cache import route_cache
+from api.util.search import build_search_index
+from api.util.spatial import build_nearby_index
+from api.util.station import build_station_boards
+from api.util.stats import build_delay_stats
 from api.util.vehicle import should_remove
 
 logger = get_logger(__name__)
 
+# Per feed, shared by all refreshes of the worker process
+upstream_breakers: defaultdict[str, CircuitBreaker] = defaultdict(
+    lambda: CircuitBreaker(
+        settings.UPSTREAM_BREAKER_FAILURES, settings.UPSTREAM_BREAKER_RESET
+    )
+)
+upstream_latencies: defaultdict[str, LatencyTracker] = defaultdict(LatencyTracker)
 
-def route_length(route_coords: list[tuple[float, float]]) -> float:
-    """
-    Returns the total haversine length of the route in km.
-    """
-    total = 0.0
-    for (lat1, lon1), (lat2, lon2) in zip(route_coords[:-1], route_coords[1:]):
-        phi1, phi2 = math.radians(lat1), math.radians(lat2)
-        dphi = phi2 - phi1
-        dlam = math.radians(lon2 - lon1)
-        a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
-        total += 2 * 6371.0 * math.asin(min(1.0, math.sqrt(a)))
-    return total
+# Route digest and position along it of every vehicle of each feed in the
+# last refresh, where the projection of its next position starts searching
+position_hints: dict[str, dict[str, tuple[str, float]]] = {}
+
+# Catalog the vehicle documents of each feed are compacted against
+catalogs: dict[str, Catalog] = {}
+
+# Subtask processing one partition of a refresh, in api/tasks/partition.py
+PARTITION_TASK_NAME = "process_partition"
 
 
 class TrainService:
-    def __init__(self, redis: Redis):
+    def __init__(self, redis: Redis, feed: FeedConfig | None = None):
         self.redis = redis
+        # The primary feed unless given
+        self.feed = feed or settings.FEEDS[0]
+        # Filled by process_locations when cost tracking is enabled
+        self.processing_costs: list[dict[str, Any]] = []
+        # Position hints of the vehicles in the last process_locations
+        self.next_hints: dict[str, tuple[str, float]] = {}
+
+    def key(self, key: str) -> str:
+        """Redis key in the namespace of the feed"""
+        return add_key(key, self.feed.key_namespace)
 
     @staticmethod
     def get_vehicle_type(location: dict[str, Any]) -> str:
@@ -45,14 +102,24 @@ class TrainService:
             "RAIL": "train",
             "SUBURBAN_RAILWAY": "hev",
             "TRAMTRAIN": "tramtrain",
+            "TRAM": "tram",
+            "BUS": "bus",
+            "TROLLEYBUS": "trolleybus",
         }
         return mode_to_type.get(route_mode, "train")
 
+    @tracer.start_as_current_span("fetch_graphql_data")
     async def fetch_graphql_data(self) -> dict[str, Any]:
         """
-        Fetches data from the GraphQL endpoint, optionally using a SOCKS5 proxy.
+        Fetches data from the GraphQL endpoint of the feed, optionally using a
+        SOCKS5 proxy.
         """
         transport = None
+        span = trace.get_current_span()
+        span.set_attribute("proxy.enabled", settings.SOCKS5_PROXY_ENABLE)
+        span.set_attribute("feed.name", self.feed.name)
+        upstream_breaker = upstream_breakers[self.feed.name]
+        upstream_latency = upstream_latencies[self.feed.name]
 
         if settings.SOCKS5_PROXY_ENABLE:
             if not settings.SOCKS5_PROXY_HOST or not settings.SOCKS5_PROXY_PORT:
@@ -69,22 +136,45 @@ class TrainService:
             transport = AsyncProxyTransport.from_url(proxy_url)
 
         async with httpx.AsyncClient(transport=transport) as client:
-            if not settings.GRAPHQL_ENDPOINT:
+            endpoint = self.feed.endpoint or settings.GRAPHQL_ENDPOINT
+            if not endpoint:
                 raise ValueError("GRAPHQL_ENDPOINT is not set.")
+            query = self.feed.query or positions_query(self.feed.modes)
+
+            async def post() -> dict[str, Any]:
+                with tracer.start_as_current_span("graphql.post") as span:
+                    request_start = time.monotonic()
+                    response = await client.post(
+                        endpoint,
+                        json={"query": query},
+                        timeout=settings.UPSTREAM_TIMEOUT,
+                    )
+                    span.set_attribute(
+                        "http.response.status_code", response.status_code
+                    )
+                    span.set_attribute("http.response.body.size", len(response.content))
+                    response.raise_for_status()
+                    result: dict[str, Any] = response.json()
+                    upstream_latency.record(time.monotonic() - request_start)
+                    return result
+
+            hedge_after = (
+                upstream_latency.percentile(settings.UPSTREAM_HEDGE_PERCENTILE)
+                if settings.UPSTREAM_HEDGE_ENABLE
+                else None
+            )
 
+            upstream_breaker.before_call()
             try:
-                response = await client.post(
-                    settings.GRAPHQL_ENDPOINT,
-                    json={"query": POSITIONS_QUERY},
-                    timeout=30.0,
-                )
-                response.raise_for_status()
-                result: dict[str, Any] = response.json()
-                return result
+                result = await hedged(post, hedge_after)
             except httpx.HTTPError as e:
+                upstream_breaker.record_failure()
                 logger.error(f"HTTP Error: {e}")
                 raise e
 
+            upstream_breaker.record_success()
+            return result
+
     def dedupe_by_vehicle_id(
         self, locations: list[dict[str, Any]]
     ) -> list[dict[str, Any]]:
@@ -141,18 +231,38 @@ class TrainService:
         return [process_location(loc) for loc in locations]
 
     def process_locations(
-        self, locations: list[dict[str, Any]]
+        self,
+        locations: list[dict[str, Any]],
+        hints: dict[str, tuple[str, float]] | None = None,
     ) -> list[dict[str, Any]]:
         """
-        Process delays and filter stale data
+        Process delays and filter stale data.
+
+        Positions are projected starting from `hints`, by default the ones
+        this process kept for the feed, which are then replaced. The hints of
+        the vehicles processed are left in `next_hints`.
+
+        With COST_TRACKING_ENABLE, the processing time of every vehicle is
+        recorded in `processing_costs`, most expensive first.
         """
+        track_costs = settings.COST_TRACKING_ENABLE
+        costs = []
+
         locations_processed = []
+        feed_hints = position_hints.get(self.feed.name, {}) if hints is None else hints
+        next_hints: dict[str, tuple[str, float]] = {}
         for location in locations:
+            if track_costs:
+                vehicle_start = time.perf_counter()
+                fallbacks_before = projection_counts["fallback"]
+
             trip = location.get("trip", {})
             trip_geometry = trip.get("tripGeometry", {})
             points = trip_geometry.get("points", "")
 
-            route_coords = polyline.decode(points)
+            # Decoded, deduplicated and stop-snapped once per route
+            route_digest = route_cache.digest(points)
+            route = route_cache.get(points, route_digest)
 
             last_updated_dt = datetime.fromtimestamp(
                 location.get("lastUpdated", 0), tz=UTC
@@ -161,15 +271,23 @@ class TrainService:
             lat: float = location.get("lat", 0.0)
             lon: float = location.get("lon", 0.0)
 
+            # Only a position along the same route is a valid starting point
+            vehicle_id = location.get("vehicleId", "")
+            hint_digest, hint = feed_hints.get(vehicle_id, (None, None))
+
             delay_data = get_delay_and_position(
                 last_updated_dt,
                 trip.get("serviceDate"),
                 trip.get("stoptimes", []),
-                route_coords,
+                [],
                 lat,
                 lon,
                 location.get("heading"),
+                route,
+                hint if hint_digest == route_digest else None,
             )
+            if vehicle_id:
+                next_hints[vehicle_id] = (route_digest, delay_data["trainPosition"])
 
             processed_location = location.copy()
             processed_location.update(
@@ -177,95 +295,225 @@ class TrainService:
                     "delay": round(delay_data["delay"] / 60),
                     "trainPosition": delay_data["trainPosition"],
                     "totalRouteDistance": delay_data["totalRouteDistance"],
-                    "processedStops": delay_data["processedStops"],
+                    "stopDistances": delay_data["stopDistances"],
                     "vehicleProgress": delay_data["vehicleProgress"],
-                    "routeLengthKm": route_length(route_coords),
+                    "predictions": delay_data["predictions"],
+                    "routeLengthKm": route.length_km,
                 }
             )
 
+            if track_costs:
+                costs.append(
+                    {
+                        "vehicleId": location.get("vehicleId", ""),
+                        "tripShortName": trip.get("tripShortName", ""),
+                        "routeShortName": trip.get("route", {}).get("shortName", ""),
+                        "seconds": time.perf_counter() - vehicle_start,
+                        "geometryPoints": len(route.coords),
+                        "stopCount": len(trip.get("stoptimes", [])),
+                        "projectionFallbacks": projection_counts["fallback"]
+                        - fallbacks_before,
+                    }
+                )
+
             if not should_remove(processed_location):
                 locations_processed.append(processed_location)
 
+        if track_costs:
+            costs.sort(key=lambda cost: cost["seconds"], reverse=True)
+            self.processing_costs = costs
+
+        self.next_hints = next_hints
+        if hints is None:
+            # Vehicles gone from the feed are dropped with the previous hints
+            position_hints[self.feed.name] = next_hints
+
         return locations_processed
 
-    async def refresh_data(self) -> None:
+    def process_batch(
+        self,
+        locations: list[dict[str, Any]],
+        hints: dict[str, tuple[str, float]],
+    ) -> dict[str, Any]:
         """
-        Fetches new data, and updates Redis.
+        Adds counties to and processes a batch of vehicles, starting from the
+        position hints given for them. Returns the processed locations with
+        their new hints, processing costs and the time it took.
         """
-        start_time = time.time()
-        logger.info("Starting refresh_data...")
-
-        now = int(time.time() * 1000)
+        start = time.perf_counter()
+        with_counties = self.add_counties_to_locations(locations)
+        processed = self.process_locations(with_counties, hints)
+        return {
+            "locations": processed,
+            "hints": self.next_hints,
+            "costs": self.processing_costs,
+            "seconds": time.perf_counter() - start,
+        }
 
-        try:
-            step_start = time.time()
-            data = await self.fetch_graphql_data()
-            logger.info(
-                f"GraphQL data fetched (Time: {(time.time() - step_start):.4f}s)"
+    async def process_partition(
+        self, redis_bytes: Redis, version: int, index: int
+    ) -> int:
+        """
+        Processes one partition of the refresh of snapshot `version`, and
+        pushes the result to the refresh. Returns the vehicles processed, 0
+        if the refresh stopped waiting for the partition already.
+        """
+        raw = await redis_bytes.get(self.key(f"refresh-partition:{version}:{index}"))
+        if raw is None:
+            logger.warning(
+                f"Partition {index} of {self.feed.name} refresh {version} "
+                f"is no longer awaited"
             )
+            return 0
 
-            # Extract locations array
-            locations_raw = data.get("data", {}).get("vehiclePositions", [])
-            # Fallback if flattened
-            if not locations_raw and "vehiclePositions" in data:
-                locations_raw = data["vehiclePositions"]
+        batch = json.loads(codec.decode(raw))
+        result = self.process_batch(batch["locations"], batch["hints"])
+        result["index"] = index
 
-            vehicle_count = len(locations_raw)
-            proxy_status = "✅" if settings.SOCKS5_PROXY_ENABLE else "❌"
+        results_key = self.key(f"refresh-partition-results:{version}")
+        async with redis_bytes.pipeline(transaction=True) as pipe:
+            pipe.rpush(results_key, codec.compress(json.dumps(result).encode()))
+            pipe.expire(results_key, math.ceil(2 * settings.REFRESH_PARTITION_TIMEOUT))
+            await pipe.execute()
 
+        # Routes compiled by this worker, the refresh only persists its own
+        persisted_routes = await route_cache.persist(self.redis)
+        if persisted_routes:
             logger.info(
-                f"Request sent to GraphQL endpoint | "
-                f"Proxy: {proxy_status} | Vehicle Count: {vehicle_count}"
+                f"Persisted {persisted_routes} compiled routes of partition {index}"
             )
+        return len(batch["locations"])
 
-        except Exception as e:
-            logger.error(f"Failed to fetch train positions: {e}")
-            raise e
+    async def process_partitioned(
+        self, locations: list[dict[str, Any]], version: int
+    ) -> list[dict[str, Any]]:
+        """
+        Processes the vehicles in REFRESH_PARTITIONS batches partitioned by a
+        hash of the vehicle id. Every batch but the first is published as a
+        subtask for the workers of any node, while the refresh processes the
+        first one itself, in a thread so that subtasks run by the same worker
+        and their results are not held up by it.
+
+        Batches without a result by REFRESH_PARTITION_TIMEOUT, because their
+        subtask failed or is still queued or running, are processed by the
+        refresh after all, and late results are dropped.
+        """
+        feed = self.feed.name
+        partitions = settings.REFRESH_PARTITIONS
+        batches: list[list[dict[str, Any]]] = [[] for _ in range(partitions)]
+        for loc in locations:
+            vehicle_id = loc.get("vehicleId", "")
+            batches[zlib.crc32(vehicle_id.encode()) % partitions].append(loc)
 
-        step_start = time.time()
-        locations = self.dedupe_by_vehicle_id(locations_raw)
-        logger.info(
-            f"Deduplicated locations: {len(locations_raw)} -> {len(locations)} "
-            f"(Time: {(time.time() - step_start):.4f}s)"
-        )
+        feed_hints = position_hints.get(feed, {})
 
-        no_data_received = len(locations_raw) == 0
+        def batch_hints(batch: list[dict[str, Any]]) -> dict[str, tuple[str, float]]:
+            return {
+                loc["vehicleId"]: feed_hints[loc["vehicleId"]]
+                for loc in batch
+                if loc.get("vehicleId") in feed_hints
+            }
 
-        if no_data_received:
-            logger.warning("External endpoint returned no data, keeping existing cache")
-            return
+        start = time.perf_counter()
+        deadline = start + settings.REFRESH_PARTITION_TIMEOUT
+        expiry = math.ceil(2 * settings.REFRESH_PARTITION_TIMEOUT)
+        batch_keys = [
+            self.key(f"refresh-partition:{version}:{index}")
+            for index in range(partitions)
+        ]
+        results_key = self.key(f"refresh-partition-results:{version}")
 
-        step_start = time.time()
-        locations_with_counties = self.add_counties_to_locations(locations)
-        logger.info(f"Added counties (Time: {(time.time() - step_start):.4f}s)")
+        client = Redis(connection_pool=redis_bytes_pool)
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for index in range(1, partitions):
+                    batch = batches[index]
+                    document = {"locations": batch, "hints": batch_hints(batch)}
+                    pipe.set(
+                        batch_keys[index],
+                        codec.compress(json.dumps(document).encode()),
+                        ex=expiry,
+                    )
+                await pipe.execute()
 
-        step_start = time.time()
-        locations_processed = self.process_locations(locations_with_counties)
+            kicker: AsyncKicker[[str, int, int], int] = AsyncKicker(
+                PARTITION_TASK_NAME, broker, {}
+            )
+            for index in range(1, partitions):
+                await kicker.kiq(feed, version, index)
 
+            first = asyncio.create_task(
+                asyncio.to_thread(
+                    self.process_batch, batches[0], batch_hints(batches[0])
+                )
+            )
+            results: dict[int, dict[str, Any]] = {}
+            while len(results) < partitions - 1:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                # Short waits, as the pool's socket timeout is 5 seconds
+                popped = await client.blpop([results_key], timeout=min(remaining, 1))  # type: ignore[misc]
+                if popped is not None:
+                    result = json.loads(codec.decode(popped[1]))
+                    # A redelivered subtask may push the same partition twice
+                    results.setdefault(result.pop("index"), result)
+
+            # Subtasks not started yet find their batch gone and skip it
+            await client.delete(results_key, *batch_keys)
+            results[0] = await first
+        finally:
+            await client.close()
+
+        for index, batch in enumerate(batches):
+            if index not in results:
+                logger.warning(
+                    f"No result for partition {index} of {feed} in time, "
+                    f"processing it in the refresh"
+                )
+                REFRESH_PARTITION_FALLBACKS.labels(feed).inc()
+                results[index] = self.process_batch(batch, batch_hints(batch))
+
+        elapsed = time.perf_counter() - start
+        busy = 0.0
+        for result in results.values():
+            REFRESH_PARTITION_SECONDS.labels(feed).observe(result["seconds"])
+            busy += result["seconds"]
+        efficiency = busy / (elapsed * partitions)
+        REFRESH_PARTITION_EFFICIENCY.labels(feed).set(efficiency)
         logger.info(
-            f"Processed delays & filtered: {len(locations_with_counties)} -> "
-            f"{len(locations_processed)} (Time: {(time.time() - step_start):.4f}s)"
+            f"Processed {partitions} partitions of {feed}: {busy:.4f}s of "
+            f"processing in {elapsed:.4f}s, speedup {busy / elapsed:.2f}x, "
+            f"efficiency {efficiency:.0%}"
         )
 
-        step_start = time.time()
-
-        hash_key = add_key("train-positions-hash")
-
-        # Clear existing hash first to remove stale vehicles
-        await self.redis.delete(hash_key)
+        position_hints[feed] = {
+            vehicle_id: hint
+            for result in results.values()
+            for vehicle_id, hint in result["hints"].items()
+        }
+        if settings.COST_TRACKING_ENABLE:
+            self.processing_costs = sorted(
+                (cost for result in results.values() for cost in result["costs"]),
+                key=lambda cost: cost["seconds"],
+                reverse=True,
+            )
 
-        if locations_processed:
-            mapping = {
-                loc["vehicleId"]: json.dumps(loc)
-                for loc in locations_processed
-                if "vehicleId" in loc
-            }
-            if mapping:
-                await self.redis.hset(hash_key, mapping=mapping)
-                await self.redis.expire(hash_key, settings.CACHE_DURATION)
+        # Back in the order of the feed
+        order = {loc.get("vehicleId"): rank for rank, loc in enumerate(locations)}
+        return sorted(
+            (loc for result in results.values() for loc in result["locations"]),
+            key=lambda loc: order.get(loc.get("vehicleId"), 0),
+        )
 
+    def build_feature_collection(
+        self, locations: list[dict[str, Any]], timestamp: int
+    ) -> dict[str, Any]:
+        """
+        Builds the lightweight GeoJSON FeatureCollection served to the map.
+        """
         features = []
-        for loc in locations_processed:
+        for loc in locations:
             if "vehicleId" not in loc:
                 continue
 
@@ -273,7 +521,11 @@ class TrainService:
 
             distance_to_next_stop_km: float | None = None
             next_stop_id = loc.get("vehicleProgress", {}).get("nextStop")
-            processed_stops = loc.get("processedStops", [])
+            stoptimes = trip.get("stoptimes", [])
+            processed_stops = get_processed_stops(
+                [stoptime.get("stop", {}) for stoptime in stoptimes],
+                loc.get("stopDistances", []),
+            )
             train_position = loc.get("trainPosition", 0.0)
             total_route_distance = loc.get("totalRouteDistance", 0.0)
             route_length_km = loc.get("routeLengthKm", 0.0)
@@ -291,6 +543,25 @@ class TrainService:
                         shapely_dist / total_route_distance * route_length_km, 4
                     )
 
+            # Hints for extrapolating the position between refreshes
+            points = trip.get("tripGeometry", {}).get("points")
+            train_position_km: float | None = None
+            leg_speed: float | None = None
+            route_polylines: dict[str, str] | None = None
+            if points:
+                # Looked up once, simplified once per route for clients
+                # asking for less detail
+                route = route_cache.get(points)
+                route_polylines = get_simplified_polylines(route)
+                train_position_km = round(route.deg_to_km(train_position), 4)
+                leg_speed = get_leg_speed(
+                    processed_stops,
+                    stoptimes,
+                    loc.get("vehicleProgress", {}).get("lastStop", ""),
+                    next_stop_id or "",
+                    route.deg_to_km,
+                )
+
             feature = {
                 "type": "Feature",
                 "geometry": {
@@ -310,24 +581,435 @@ class TrainService:
                     "routeTextColor": trip.get("route", {}).get("textColor", ""),
                     "delay": loc.get("delay"),
                     "routePolyline": trip.get("tripGeometry", {}).get("points"),
+                    "routePolylines": route_polylines,
                     "distanceToNextStop": distance_to_next_stop_km,
+                    "trainPositionKm": train_position_km,
+                    "legSpeed": leg_speed,
+                    "feed": self.feed.name,
                 },
             }
             features.append(feature)
 
-        feature_collection = {
+        return {
             "type": "FeatureCollection",
-            "timestamp": now,
+            "timestamp": timestamp,
             "noDataReceived": False,
             "features": features,
         }
 
-        await self.redis.set(
-            add_key("train-positions-geojson"),
-            json.dumps(feature_collection),
-            ex=settings.CACHE_DURATION,
+    async def publish_snapshot(
+        self,
+        version: int,
+        locations: list[dict[str, Any]],
+        feature_collection: dict[str, Any],
+        documents: dict[str, Any],
+        indexes: dict[str, dict[str, Any]],
+        fencing_token: int | None = None,
+        traceparent: str | None = None,
+        catalog: dict[str, Any] | None = None,
+        catalog_trips: dict[str, str] | None = None,
+    ) -> None:
+        """
+        Replaces the cached snapshot in a single transaction, so readers never
+        see the vehicle hash, the feature collection and the derived documents
+        from different refreshes.
+
+        `catalog` is the document of the catalog the vehicle documents in
+        `locations` were compacted against, and `catalog_trips` the
+        serialized trips by digest they refer to that are not published yet.
+        Neither expires, as the last known good vehicle hash refers to them
+        as well.
+
+        `documents` are stored as single JSON values, `indexes` as Redis hashes
+        with one JSON value per field.
+
+        With a fencing token, the snapshot is only written if no refresh holding
+        a newer token has published in the meantime. A refresh publishing
+        concurrently fences this one off as well.
+
+        The traceparent of the refresh is stored with the snapshot, so requests
+        serving it can link to the refresh trace.
+
+        With compression enabled, the vehicle hash and the feature collection
+        are stored zstd-compressed, and the /v1/trains response of every route
+        detail level is stored ready to be passed through to clients accepting
+        zstd until it would report a data age above zero minutes.
+        """
+        hash_key = self.key("train-positions-hash")
+        fence_key = self.key("train-snapshot-fence")
+        response_key = self.key("train-positions-response")
+        mapping = {
+            loc["vehicleId"]: codec.encode(json.dumps(loc), use_dictionary=True)
+            for loc in locations
+            if "vehicleId" in loc
+        }
+        geojson = codec.encode(json.dumps(feature_collection))
+        serialized_documents = {
+            key: json.dumps(document, separators=(",", ":"))
+            for key, document in documents.items()
+        }
+
+        responses: dict[str, bytes] = {}
+        if settings.REDIS_COMPRESSION_ENABLE:
+            for detail in ROUTE_DETAILS:
+                response_body = TrainFeatureCollection(
+                    timestamp=datetime.fromtimestamp(
+                        version / 1000, tz=UTC
+                    ).isoformat(),
+                    noDataReceived=feature_collection.get("noDataReceived", False),
+                    dataAgeMinutes=0,
+                    features=[
+                        with_route_detail(feature, detail)
+                        for feature in feature_collection["features"]
+                    ],
+                ).model_dump_json()
+                responses[detail] = codec.compress(response_body.encode())
+            SNAPSHOT_PAYLOAD_BYTES.labels(
+                self.feed.name, "train-positions-response"
+            ).set(sum(len(response) for response in responses.values()))
+
+        SNAPSHOT_PAYLOAD_BYTES.labels(self.feed.name, "train-positions-hash").set(
+            sum(len(value) for value in mapping.values())
+        )
+        SNAPSHOT_PAYLOAD_BYTES.labels(self.feed.name, "train-positions-geojson").set(
+            len(geojson)
+        )
+        for key, document in serialized_documents.items():
+            SNAPSHOT_PAYLOAD_BYTES.labels(self.feed.name, key).set(len(document))
+        SNAPSHOT_PAYLOAD_BYTES.labels(self.feed.name, "train-catalog-trips").set(
+            sum(len(trip) for trip in (catalog_trips or {}).values())
+        )
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if fencing_token is not None:
+                await pipe.watch(fence_key)
+                stored_token = await pipe.get(fence_key)
+                current_token = int(stored_token) if stored_token is not None else None
+                if current_token is not None and current_token > fencing_token:
+                    raise FencingTokenError(
+                        f"Snapshot fenced off: token {fencing_token} < {current_token}"
+                    )
+
+                pipe.multi()
+                pipe.set(fence_key, fencing_token)
+
+            # Clear existing hash first to remove stale vehicles
+            pipe.delete(hash_key)
+            if mapping:
+                pipe.hset(hash_key, mapping=mapping)
+                pipe.expire(hash_key, settings.CACHE_DURATION)
+
+            pipe.set(
+                self.key("train-positions-geojson"),
+                geojson,
+                ex=settings.CACHE_DURATION,
+            )
+
+            # Last known good copies never expire, they are served flagged as
+            # stale once the fresh keys above have expired
+            pipe.copy(
+                self.key("train-positions-geojson"),
+                self.key("train-positions-geojson-lkg"),
+                replace=True,
+            )
+            pipe.copy(hash_key, self.key("train-positions-hash-lkg"), replace=True)
+
+            if catalog is not None:
+                pipe.set(
+                    self.key("train-catalog"),
+                    json.dumps(catalog, separators=(",", ":")),
+                )
+                if catalog_trips:
+                    pipe.hset(
+                        self.key(f"train-catalog-trips:{catalog['generation']}"),
+                        mapping=catalog_trips,
+                    )
+
+            pipe.delete(response_key)
+            if responses:
+                pipe.hset(response_key, mapping=responses)
+                pipe.pexpireat(response_key, version + 60_000)
+
+            for key, document in serialized_documents.items():
+                pipe.set(self.key(key), document, ex=settings.CACHE_DURATION)
+
+            for key, index in indexes.items():
+                index_key = self.key(key)
+                pipe.delete(index_key)
+                if index:
+                    pipe.hset(
+                        index_key,
+                        mapping={
+                            field: json.dumps(value, separators=(",", ":"))
+                            for field, value in index.items()
+                        },
+                    )
+                    pipe.expire(index_key, settings.CACHE_DURATION)
+
+            traceparent_key = self.key("train-snapshot-traceparent")
+            if traceparent:
+                pipe.set(traceparent_key, traceparent, ex=settings.CACHE_DURATION)
+            else:
+                pipe.delete(traceparent_key)
+
+            pipe.set(
+                self.key("train-snapshot-version"),
+                version,
+                ex=settings.CACHE_DURATION,
+            )
+            with (
+                tracer.start_as_current_span("redis.publish_snapshot"),
+                REDIS_SECONDS.labels("publish_snapshot").time(),
+            ):
+                try:
+                    await pipe.execute()
+                except WatchError as e:
+                    raise FencingTokenError(
+                        f"Snapshot fenced off: token {fencing_token} was "
+                        f"replaced while publishing"
+                    ) from e
+
+    async def record_history(self, locations: list[dict[str, Any]]) -> None:
+        """
+        Appends the current state of every vehicle to its per-trip ring buffer.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for loc in locations:
+                trip = loc.get("trip", {})
+                expires_at = get_history_expiry(trip)
+                if "vehicleId" not in loc or expires_at is None:
+                    continue
+
+                key = self.key(
+                    history_key(
+                        loc["vehicleId"],
+                        trip.get("serviceDate", ""),
+                        trip.get("tripShortName", ""),
+                    )
+                )
+                pipe.rpush(key, pack_history_record(loc))
+                pipe.ltrim(key, -HISTORY_LENGTH, -1)
+                pipe.expireat(key, expires_at)
+            with (
+                tracer.start_as_current_span("redis.record_history"),
+                REDIS_SECONDS.labels("record_history").time(),
+            ):
+                await pipe.execute()
+
+    async def load_catalog(self, version: int) -> Catalog:
+        """
+        Returns the catalog of the feed, continuing the published one after a
+        restart so ids stay stable. A new generation starts with `version`
+        once the catalog outgrows CATALOG_MAX_ENTRIES.
+        """
+        catalog = catalogs.get(self.feed.name)
+        if catalog is None:
+            raw = await self.redis.get(self.key("train-catalog"))
+            if raw:
+                document = json.loads(raw)
+                trips_key = self.key(f"train-catalog-trips:{document['generation']}")
+                trip_digests = await self.redis.hkeys(trips_key)  # type: ignore[misc]
+                catalog = Catalog.from_document(document, trip_digests)
+
+        if catalog is None or len(catalog) > settings.CATALOG_MAX_ENTRIES:
+            if catalog is not None:
+                # Documents published before the new generation still refer
+                # to the one it replaces, the one before it is dropped
+                raw = await self.redis.get(self.key("train-catalog-previous"))
+                if raw:
+                    generation = json.loads(raw)["generation"]
+                    await self.redis.delete(
+                        self.key(f"train-catalog-trips:{generation}")
+                    )
+                await self.redis.copy(
+                    self.key("train-catalog"),
+                    self.key("train-catalog-previous"),
+                    replace=True,
+                )
+            catalog = Catalog(version)
+        catalogs[self.feed.name] = catalog
+        return catalog
+
+    @tracer.start_as_current_span("refresh_data")
+    async def refresh_data(self, fencing_token: int | None = None) -> int:
+        """
+        Fetches new data of the feed, and updates its snapshot in Redis.
+        Returns the number of vehicles published.
+        """
+        start_time = time.time()
+        logger.info(f"Starting refresh_data of feed {self.feed.name}...")
+
+        now = int(time.time() * 1000)
+
+        try:
+            step_start = time.time()
+            data = await self.fetch_graphql_data()
+            elapsed = observe_stage(self.feed.name, "fetch", step_start)
+            logger.info(f"GraphQL data fetched (Time: {elapsed:.4f}s)")
+
+            # Extract locations array
+            locations_raw = data.get("data", {}).get("vehiclePositions", [])
+            # Fallback if flattened
+            if not locations_raw and "vehiclePositions" in data:
+                locations_raw = data["vehiclePositions"]
+
+            vehicle_count = len(locations_raw)
+            proxy_status = "✅" if settings.SOCKS5_PROXY_ENABLE else "❌"
+
+            logger.info(
+                f"Request sent to GraphQL endpoint | "
+                f"Proxy: {proxy_status} | Vehicle Count: {vehicle_count}"
+            )
+
+        except Exception as e:
+            logger.error(f"Failed to fetch {self.feed.name} vehicle positions: {e}")
+            raise e
+
+        step_start = time.time()
+        with tracer.start_as_current_span("dedupe"):
+            locations = self.dedupe_by_vehicle_id(locations_raw)
+        elapsed = observe_stage(self.feed.name, "dedupe", step_start)
+        logger.info(
+            f"Deduplicated locations: {len(locations_raw)} -> {len(locations)} "
+            f"(Time: {elapsed:.4f}s)"
+        )
+        REFRESH_VEHICLES.labels(self.feed.name, "raw").set(len(locations_raw))
+        REFRESH_VEHICLES.labels(self.feed.name, "deduped").set(len(locations))
+
+        no_data_received = len(locations_raw) == 0
+
+        if no_data_received:
+            logger.warning(
+                f"Feed {self.feed.name} returned no data, keeping existing cache"
+            )
+            return 0
+
+        if settings.REFRESH_PARTITIONS > 1:
+            # Counties are added by the partitions along with the processing
+            step_start = time.time()
+            with tracer.start_as_current_span("process_partitioned") as span:
+                locations_processed = await self.process_partitioned(locations, now)
+                span.set_attribute("partitions", settings.REFRESH_PARTITIONS)
+                span.set_attribute("vehicles.in", len(locations))
+                span.set_attribute("vehicles.out", len(locations_processed))
+            elapsed = observe_stage(self.feed.name, "process", step_start)
+        else:
+            step_start = time.time()
+            with tracer.start_as_current_span("add_counties"):
+                locations = self.add_counties_to_locations(locations)
+            elapsed = observe_stage(self.feed.name, "counties", step_start)
+            logger.info(f"Added counties (Time: {elapsed:.4f}s)")
+
+            step_start = time.time()
+            with tracer.start_as_current_span("process_locations") as span:
+                locations_processed = self.process_locations(locations)
+                span.set_attribute("vehicles.in", len(locations))
+                span.set_attribute("vehicles.out", len(locations_processed))
+            elapsed = observe_stage(self.feed.name, "process", step_start)
+
+        logger.info(
+            f"Processed delays & filtered: {len(locations)} -> "
+            f"{len(locations_processed)} (Time: {elapsed:.4f}s)"
+        )
+        REFRESH_VEHICLES.labels(self.feed.name, "published").set(
+            len(locations_processed)
+        )
+        REFRESH_VEHICLES.labels(self.feed.name, "removed").set(
+            len(locations) - len(locations_processed)
+        )
+
+        step_start = time.time()
+        with tracer.start_as_current_span("build_snapshot"):
+            feature_collection = self.build_feature_collection(locations_processed, now)
+            search_index = build_search_index(locations_processed)
+            station_boards = build_station_boards(locations_processed)
+            delay_stats = build_delay_stats(locations_processed, self.get_vehicle_type)
+            delay_stats["timestamp"] = now
+            nearby_index = build_nearby_index(
+                locations_processed, self.get_vehicle_type
+            )
+
+        documents = {
+            "train-search-index": search_index,
+            "train-delay-stats": delay_stats,
+            "train-nearby-index": nearby_index,
+        }
+        if settings.COST_TRACKING_ENABLE:
+            documents["train-processing-costs"] = {
+                "timestamp": now,
+                "vehicles": len(self.processing_costs),
+                "totalSeconds": sum(c["seconds"] for c in self.processing_costs),
+                "costs": self.processing_costs[: settings.COST_TRACKING_TOP_N],
+            }
+
+        traceparent = get_traceparent()
+        if traceparent:
+            feature_collection["traceparent"] = traceparent
+        elapsed = observe_stage(self.feed.name, "build", step_start)
+        logger.info(f"Built snapshot (Time: {elapsed:.4f}s)")
+
+        step_start = time.time()
+        with tracer.start_as_current_span("compact_vehicles"):
+            catalog = await self.load_catalog(now)
+            vehicles = [catalog.compact(loc) for loc in locations_processed]
+            catalog_document = catalog.document()
+            catalog_trips = catalog.unpublished_trips()
+        elapsed = observe_stage(self.feed.name, "compact", step_start)
+        logger.info(
+            f"Compacted vehicles against a catalog of {len(catalog)} records "
+            f"(Time: {elapsed:.4f}s)"
+        )
+
+        step_start = time.time()
+        with tracer.start_as_current_span("publish_snapshot") as span:
+            span.set_attribute("snapshot.version", now)
+            await self.publish_snapshot(
+                now,
+                vehicles,
+                feature_collection,
+                documents,
+                {"train-station-boards": station_boards},
+                fencing_token,
+                traceparent,
+                catalog_document,
+                catalog_trips,
+            )
+        catalog.mark_published(catalog_trips)
+        SNAPSHOT_TIMESTAMP.labels(self.feed.name).set(now / 1000)
+
+        elapsed = observe_stage(self.feed.name, "publish", step_start)
+        logger.info(f"Cache updated (Time: {elapsed:.4f}s)")
+
+        step_start = time.time()
+        with tracer.start_as_current_span("record_history"):
+            await self.record_history(locations_processed)
+        elapsed = observe_stage(self.feed.name, "history", step_start)
+        logger.info(f"History recorded (Time: {elapsed:.4f}s)")
+
+        if settings.ARCHIVE_ENABLE:
+            step_start = time.time()
+            try:
+                with tracer.start_as_current_span("archive_snapshot"):
+                    frame_size = await archive_snapshot(
+                        self.redis, self.feed, now, feature_collection
+                    )
+                SNAPSHOT_PAYLOAD_BYTES.labels(self.feed.name, "train-archive").set(
+                    frame_size
+                )
+                elapsed = observe_stage(self.feed.name, "archive", step_start)
+                logger.info(f"Snapshot archived (Time: {elapsed:.4f}s)")
+            except Exception as e:
+                # The snapshot is published already, only the archive misses it
+                logger.error(f"Failed to archive snapshot: {e}")
+
+        step_start = time.time()
+        persisted_routes = await route_cache.persist(self.redis)
+        elapsed = observe_stage(self.feed.name, "route_cache", step_start)
+        logger.info(
+            f"Persisted {persisted_routes} compiled routes (Time: {elapsed:.4f}s)"
         )
 
-        logger.info(f"Cache updated (Time: {(time.time() - step_start):.4f}s)")
+        elapsed = observe_stage(self.feed.name, "total", start_time)
+        logger.info(f"Total revalidation time of {self.feed.name}: {elapsed:.4f}s")
 
-        logger.info(f"Total revalidation time: {(time.time() - start_time):.4f}s")
+        return len(locations_processed)
@@ -0,0 +1,18 @@
+from api.core.config import settings
+from api.core.redis import RedisBytesTaskiqDep, RedisTaskiqDep
+from api.core.taskiq_broker import broker
+from api.services.train_service import PARTITION_TASK_NAME, TrainService
+
+
+@broker.task(task_name=PARTITION_TASK_NAME)
+async def process_partition(
+    feed_name: str,
+    version: int,
+    index: int,
+    redis: RedisTaskiqDep,
+    redis_bytes: RedisBytesTaskiqDep,
+) -> int:
+    feed = next(feed for feed in settings.FEEDS if feed.name == feed_name)
+    return await TrainService(redis, feed).process_partition(
+        redis_bytes, version, index
+    )
@@ -0,0 +1,303 @@
+"""Compact columnar encoding of the published snapshots for the archive"""
+
+import json
+import struct
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from api.core.redis import codec
+
+# Bump whenever the frame layout changes, frames of other versions are skipped
+ARCHIVE_FORMAT = 1
+
+# magic, format version, flags, snapshot version (ms), vehicle count, byte
+# length of the JSON of the vehicle ids and trips first seen in the frame
+_FRAME_HEADER = struct.Struct("<4sHHQII")
+_FRAME_MAGIC = b"MHAF"
+
+# Frame flags
+KEYFRAME = 1
+NO_DATA_RECEIVED = 2
+
+# Archive files are the frames of whole segments, each prefixed by its length
+_FILE_MAGIC = b"MHAR"
+_FILE_HEADER = struct.Struct("<4sH")
+_FRAME_LENGTH = struct.Struct("<I")
+
+# Feature properties that stay the same for the whole trip
+TRIP_PROPERTIES = (
+    "type",
+    "tripShortName",
+    "routeShortName",
+    "routeTextColor",
+    "routePolyline",
+    "routePolylines",
+    "feed",
+)
+
+# Columns stored as the change since the previous frame of the vehicle, and
+# their scale. Coordinates are kept to a millionth of a degree (about 0.1 m),
+# missing values are stored as zero.
+DELTA_COLUMNS = {
+    "lat": 1_000_000,
+    "lon": 1_000_000,
+    "lastUpdated": 1,
+    "delay": 1,
+}
+
+# Columns stored as they are, and their scale. Missing values are stored as
+# MISSING. Distances are kept to 0.1 m, speeds to 1 cm/s.
+PLAIN_COLUMNS = {
+    "heading": 10,
+    "speed": 100,
+    "distanceToNextStop": 10_000,
+    "trainPositionKm": 10_000,
+    "legSpeed": 100,
+}
+
+MISSING = np.iinfo(np.int32).min
+
+# Vehicle index and trip index columns come first
+_COLUMN_COUNT = 2 + len(DELTA_COLUMNS) + len(PLAIN_COLUMNS)
+
+
+def _scaled(values: list[Any], scale: int, missing: int = MISSING) -> np.ndarray:
+    return np.array(
+        [
+            missing if value in (None, "None") else round(float(value) * scale)
+            for value in values
+        ],
+        dtype=np.int64,
+    )
+
+
+def _unscaled(column: np.ndarray, scale: int) -> list[float | None]:
+    return [None if value == MISSING else value / scale for value in column.tolist()]
+
+
+class ArchiveEncoder:
+    """
+    Encodes the snapshots of one archive segment into frames.
+
+    Vehicle ids and the trip properties of the features are interned: a
+    frame only carries the ones the segment has not seen yet. Positions,
+    report times and delays are stored as the change since the vehicle's
+    previous frame, which is mostly small or zero and compresses well.
+    The first frame of a segment is a keyframe to decode from.
+    """
+
+    def __init__(self) -> None:
+        self.vehicles: dict[str, int] = {}
+        self.trips: dict[str, int] = {}
+        # Last values of the delta columns, per vehicle index
+        self._state = np.zeros((len(DELTA_COLUMNS), 0), dtype=np.int64)
+        self.frames = 0
+
+    def encode(self, version: int, feature_collection: dict[str, Any]) -> bytes:
+        new_vehicles: list[str] = []
+        new_trips: list[dict[str, Any]] = []
+        rows = []
+        for feature in feature_collection["features"]:
+            props = feature["properties"]
+            vehicle_id = props["vehicleId"]
+            vehicle = self.vehicles.get(vehicle_id)
+            if vehicle is None:
+                vehicle = self.vehicles[vehicle_id] = len(self.vehicles)
+                new_vehicles.append(vehicle_id)
+
+            trip = {key: props.get(key) for key in TRIP_PROPERTIES}
+            trip_key = json.dumps(trip, sort_keys=True)
+            trip_index = self.trips.get(trip_key)
+            if trip_index is None:
+                trip_index = self.trips[trip_key] = len(self.trips)
+                new_trips.append(trip)
+
+            rows.append((vehicle, trip_index, props))
+        rows.sort(key=lambda row: row[0])
+
+        vehicles = np.array([row[0] for row in rows], dtype=np.int64)
+        values = np.stack(
+            [
+                _scaled([row[2].get(name) for row in rows], scale, missing=0)
+                for name, scale in DELTA_COLUMNS.items()
+            ]
+        ).reshape(len(DELTA_COLUMNS), len(rows))
+        if len(self.vehicles) > self._state.shape[1]:
+            self._state = np.pad(
+                self._state, ((0, 0), (0, len(self.vehicles) - self._state.shape[1]))
+            )
+        deltas = values - self._state[:, vehicles]
+        self._state[:, vehicles] = values
+
+        columns = np.vstack(
+            [
+                np.diff(vehicles, prepend=0),
+                np.array([row[1] for row in rows], dtype=np.int64),
+                deltas,
+                *(
+                    _scaled([row[2].get(name) for row in rows], scale)
+                    for name, scale in PLAIN_COLUMNS.items()
+                ),
+            ]
+        ).astype("<i4")
+
+        flags = KEYFRAME if self.frames == 0 else 0
+        if feature_collection.get("noDataReceived"):
+            flags |= NO_DATA_RECEIVED
+        self.frames += 1
+
+        interned = json.dumps(
+            {"vehicles": new_vehicles, "trips": new_trips}, separators=(",", ":")
+        ).encode()
+        header = _FRAME_HEADER.pack(
+            _FRAME_MAGIC, ARCHIVE_FORMAT, flags, version, len(rows), len(interned)
+        )
+        return codec.compress(header + interned + columns.tobytes())
+
+
+def frame_version(frame: bytes) -> int | None:
+    """
+    Returns the snapshot version of a frame, or None if it is not a frame of
+    the current format.
+    """
+    data = codec.decode(frame)
+    if len(data) < _FRAME_HEADER.size:
+        return None
+    magic, frame_format, _, version, _, _ = _FRAME_HEADER.unpack_from(data)
+    if magic != _FRAME_MAGIC or frame_format != ARCHIVE_FORMAT:
+        return None
+    return int(version)
+
+
+class ArchiveDecoder:
+    """
+    Decodes the frames of a segment, fed in order starting from a keyframe,
+    back into feature collections in the format the refresh stores them.
+    """
+
+    def __init__(self) -> None:
+        self.vehicles: list[str] = []
+        self.trips: list[dict[str, Any]] = []
+        self._state = np.zeros((len(DELTA_COLUMNS), 0), dtype=np.int64)
+        self._started = False
+
+    def decode(self, frame: bytes) -> dict[str, Any]:
+        data = codec.decode(frame)
+        magic, frame_format, flags, version, count, interned_length = (
+            _FRAME_HEADER.unpack_from(data)
+        )
+        if magic != _FRAME_MAGIC or frame_format != ARCHIVE_FORMAT:
+            raise ValueError("Not an archive frame of the current format")
+
+        if flags & KEYFRAME:
+            self.vehicles, self.trips = [], []
+            self._state = np.zeros((len(DELTA_COLUMNS), 0), dtype=np.int64)
+            self._started = True
+        elif not self._started:
+            raise ValueError("Frames must be decoded from a keyframe on")
+
+        offset = _FRAME_HEADER.size
+        interned = json.loads(data[offset : offset + interned_length])
+        self.vehicles.extend(interned["vehicles"])
+        self.trips.extend(interned["trips"])
+        offset += interned_length
+
+        columns = np.frombuffer(
+            data, dtype="<i4", count=count * _COLUMN_COUNT, offset=offset
+        ).reshape(_COLUMN_COUNT, count)
+        vehicles = np.cumsum(columns[0], dtype=np.int64)
+        if len(self.vehicles) > self._state.shape[1]:
+            self._state = np.pad(
+                self._state, ((0, 0), (0, len(self.vehicles) - self._state.shape[1]))
+            )
+        values = self._state[:, vehicles] + columns[2 : 2 + len(DELTA_COLUMNS)]
+        self._state[:, vehicles] = values
+
+        properties: dict[str, list[Any]] = {
+            name: _unscaled(values[i], scale)
+            for i, (name, scale) in enumerate(DELTA_COLUMNS.items())
+        }
+        properties.update(
+            {
+                name: _unscaled(columns[2 + len(DELTA_COLUMNS) + i], scale)
+                for i, (name, scale) in enumerate(PLAIN_COLUMNS.items())
+            }
+        )
+
+        features = []
+        for row, (vehicle, trip) in enumerate(
+            zip(vehicles.tolist(), columns[1].tolist(), strict=True)
+        ):
+            props = {name: column[row] for name, column in properties.items()}
+            lat, lon = props["lat"], props["lon"]
+            props.update(
+                {
+                    **self.trips[trip],
+                    "vehicleId": self.vehicles[vehicle],
+                    "lastUpdated": str(int(props["lastUpdated"])),
+                    "delay": int(props["delay"]),
+                }
+            )
+            features.append(
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                    "properties": props,
+                }
+            )
+
+        return {
+            "type": "FeatureCollection",
+            "timestamp": int(version),
+            "noDataReceived": bool(flags & NO_DATA_RECEIVED),
+            "features": features,
+        }
+
+
+def decode_until(frames: Iterable[bytes], at: int) -> dict[str, Any] | None:
+    """
+    Returns the last snapshot of a segment published at or before `at` (ms).
+    """
+    decoder = ArchiveDecoder()
+    snapshot = None
+    for frame in frames:
+        version = frame_version(frame)
+        if version is None:
+            continue
+        if version > at:
+            break
+        snapshot = decoder.decode(frame)
+    return snapshot
+
+
+def write_archive_file(path: Path, frames: Iterable[bytes]) -> int:
+    """
+    Writes frames to an archive file, returns the number written. The
+    frames must be whole segments, each starting with its keyframe.
+    """
+    written = 0
+    with open(path, "wb") as f:
+        f.write(_FILE_HEADER.pack(_FILE_MAGIC, ARCHIVE_FORMAT))
+        for frame in frames:
+            f.write(_FRAME_LENGTH.pack(len(frame)))
+            f.write(frame)
+            written += 1
+    return written
+
+
+def read_archive_file(path: Path) -> Iterator[dict[str, Any]]:
+    """
+    Yields the snapshots of an archive file in order.
+    """
+    decoder = ArchiveDecoder()
+    with open(path, "rb") as f:
+        magic, file_format = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+        if magic != _FILE_MAGIC or file_format != ARCHIVE_FORMAT:
+            raise ValueError(f"{path} is not an archive file of the current format")
+
+        while length_bytes := f.read(_FRAME_LENGTH.size):
+            (length,) = _FRAME_LENGTH.unpack(length_bytes)
+            yield decoder.decode(f.read(length))
@@ -0,0 +1,217 @@
+import hashlib
+import json
+from collections.abc import Iterable
+from typing import Any
+
+# Fields of the interned records, per catalog section. Platforms are per
+# trip, so they stay on the stoptimes.
+STOP_FIELDS = ("name", "lat", "lon", "county")
+ALERT_FIELDS = (
+    "alertDescriptionText",
+    "alertUrl",
+    "effectiveStartDate",
+    "effectiveEndDate",
+)
+INFO_SERVICE_FIELDS = ("name", "fontCharSet", "fontCode", "displayable")
+
+CATALOG_SECTIONS = {
+    "stops": STOP_FIELDS,
+    "alerts": ALERT_FIELDS,
+    "infoServices": INFO_SERVICE_FIELDS,
+}
+
+
+def trip_digest(serialized: str) -> str:
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+
+class Catalog:
+    """
+    Interns the stops, alerts and info services of the vehicles into integer
+    ids, so a vehicle document carries only ids and the fields that differ
+    per trip.
+
+    The trips themselves, without their realtime times, are interned by the
+    digest of their serialized record. They are kept out of the catalog
+    document, and published one by one as they first appear.
+
+    Ids are only ever added to a catalog, so a catalog of a `generation`
+    expands every vehicle document compacted with an earlier state of it.
+    """
+
+    def __init__(self, generation: int) -> None:
+        self.generation = generation
+        self.sections: dict[str, list[dict[str, Any]]] = {
+            section: [] for section in CATALOG_SECTIONS
+        }
+        self._ids: dict[str, dict[tuple[Any, ...], int]] = {
+            section: {} for section in CATALOG_SECTIONS
+        }
+        self._trips: set[str] = set()
+        # Serialized trips by digest, interned since they were last published
+        self._unpublished_trips: dict[str, str] = {}
+
+    @classmethod
+    def from_document(
+        cls, document: dict[str, Any], trip_digests: Iterable[str] = ()
+    ) -> "Catalog":
+        catalog = cls(document["generation"])
+        for section in CATALOG_SECTIONS:
+            for record in document[section]:
+                catalog.intern(section, record)
+        catalog._trips.update(trip_digests)
+        return catalog
+
+    def document(self) -> dict[str, Any]:
+        return {"generation": self.generation, **self.sections}
+
+    def __len__(self) -> int:
+        records = sum(len(records) for records in self.sections.values())
+        return records + len(self._trips)
+
+    def unpublished_trips(self) -> dict[str, str]:
+        """
+        Returns the serialized trips by digest not published yet.
+        """
+        return dict(self._unpublished_trips)
+
+    def mark_published(self, trips: Iterable[str]) -> None:
+        for digest in trips:
+            self._unpublished_trips.pop(digest, None)
+
+    def intern_trip(self, trip: dict[str, Any]) -> str:
+        """
+        Returns the digest of the trip record, adding it if new.
+        """
+        serialized = json.dumps(trip, separators=(",", ":"))
+        digest = trip_digest(serialized)
+        if digest not in self._trips:
+            self._trips.add(digest)
+            self._unpublished_trips[digest] = serialized
+        return digest
+
+    def intern(self, section: str, record: dict[str, Any]) -> int:
+        """
+        Returns the id of the record in a section, adding it if new.
+        """
+        fields = CATALOG_SECTIONS[section]
+        key = tuple(record.get(field) for field in fields)
+        ids = self._ids[section]
+        record_id = ids.get(key)
+        if record_id is None:
+            record_id = ids[key] = len(self.sections[section])
+            self.sections[section].append(dict(zip(fields, key, strict=True)))
+        return record_id
+
+    def compact(self, location: dict[str, Any]) -> dict[str, Any]:
+        """
+        Returns the vehicle document with its trip replaced by a reference
+        to the interned trip, and the realtime times of its stoptimes.
+        Within the interned trip, stops, alerts and info services are
+        replaced by catalog ids.
+        """
+        trip = location.get("trip", {})
+        stoptimes = trip.get("stoptimes", [])
+        compact_stoptimes = []
+        for stoptime in stoptimes:
+            stop = stoptime.get("stop", {})
+            compact_stoptime = {
+                k: v
+                for k, v in stoptime.items()
+                if k not in ("stop", "realtimeArrival", "realtimeDeparture")
+            }
+            compact_stoptime["stopId"] = self.intern("stops", stop)
+            compact_stoptime["platformCode"] = stop.get("platformCode")
+            compact_stoptimes.append(compact_stoptime)
+
+        compact_trip = {
+            k: v for k, v in trip.items() if k not in ("alerts", "infoServices")
+        }
+        compact_trip["stoptimes"] = compact_stoptimes
+        compact_trip["alertIds"] = [
+            self.intern("alerts", alert) for alert in trip.get("alerts", [])
+        ]
+        compact_trip["infoServices"] = [
+            {
+                "infoServiceId": self.intern("infoServices", service),
+                "fromStopIndex": service.get("fromStopIndex"),
+                "tillStopIndex": service.get("tillStopIndex"),
+            }
+            for service in trip.get("infoServices", [])
+        ]
+
+        # Service date and name identify the trip for the vehicle history
+        trip_reference = {
+            "tripDigest": self.intern_trip(compact_trip),
+            "serviceDate": trip.get("serviceDate"),
+            "tripShortName": trip.get("tripShortName"),
+            "realtimeArrivals": [st.get("realtimeArrival") for st in stoptimes],
+            "realtimeDepartures": [st.get("realtimeDeparture") for st in stoptimes],
+        }
+        return {**location, "trip": trip_reference, "catalog": self.generation}
+
+
+def restore_trip(compact: dict[str, Any], trip: dict[str, Any]) -> dict[str, Any]:
+    """
+    Returns a vehicle document compacted by Catalog.compact with the trip it
+    refers to put back, along with its realtime times.
+    """
+    reference = compact["trip"]
+    stoptimes = [
+        {**stoptime, "realtimeArrival": arrival, "realtimeDeparture": departure}
+        for stoptime, arrival, departure in zip(
+            trip["stoptimes"],
+            reference["realtimeArrivals"],
+            reference["realtimeDepartures"],
+            strict=True,
+        )
+    ]
+    return {**compact, "trip": {**trip, "stoptimes": stoptimes}}
+
+
+def expand(compact: dict[str, Any], catalog: dict[str, Any]) -> dict[str, Any]:
+    """
+    Returns a vehicle document compacted by Catalog.compact, its trip put
+    back by restore_trip, with the records of the catalog document put back
+    in place of their ids.
+    """
+    stops, alerts = catalog["stops"], catalog["alerts"]
+    info_services = catalog["infoServices"]
+
+    trip = dict(compact.get("trip", {}))
+    stoptimes = []
+    for compact_stoptime in trip.get("stoptimes", []):
+        stoptime = {
+            k: v
+            for k, v in compact_stoptime.items()
+            if k not in ("stopId", "platformCode")
+        }
+        stoptime["stop"] = {
+            **stops[compact_stoptime["stopId"]],
+            "platformCode": compact_stoptime.get("platformCode"),
+        }
+        stoptimes.append(stoptime)
+    trip["stoptimes"] = stoptimes
+    trip["alerts"] = [alerts[alert_id] for alert_id in trip.pop("alertIds", [])]
+    trip["infoServices"] = [
+        {
+            **info_services[service["infoServiceId"]],
+            "fromStopIndex": service["fromStopIndex"],
+            "tillStopIndex": service["tillStopIndex"],
+        }
+        for service in trip.get("infoServices", [])
+    ]
+
+    location = {k: v for k, v in compact.items() if k != "catalog"}
+    location["trip"] = trip
+    if "processedStops" in compact:
+        location["processedStops"] = [
+            {
+                **{k: v for k, v in stop.items() if k != "stopTimeIndex"},
+                "stopTimeInfo": stoptimes[stop["stopTimeIndex"]]
+                if stop.get("stopTimeIndex") is not None
+                else None,
+            }
+            for stop in compact["processedStops"]
+        ]
+    return location
@@ -0,0 +1,93 @@
+from collections.abc import Callable
+from typing import Any
+
+from api.util.route_cache import route_cache
+
+# Positions older than this are not advanced any further
+MAX_EXTRAPOLATION_SECONDS = 5 * 60
+
+
+def get_leg_speed(
+    processed_stops: list[dict[str, Any]],
+    stoptimes: list[dict[str, Any]],
+    last_stop_id: str,
+    next_stop_id: str,
+    distance_to_km: Callable[[float], float],
+) -> float | None:
+    """
+    Returns the scheduled average speed (m/s) between the last and the next
+    stop, or None if the timetable doesn't allow computing it.
+    """
+    last_stop = next((s for s in processed_stops if s["id"] == last_stop_id), None)
+    next_stop = next((s for s in processed_stops if s["id"] == next_stop_id), None)
+    if not last_stop or not next_stop or last_stop is next_stop:
+        return None
+
+    last_info = stoptimes[last_stop["stopTimeIndex"]]
+    next_info = stoptimes[next_stop["stopTimeIndex"]]
+    leg_seconds = float(next_info.get("scheduledArrival", 0)) - float(
+        last_info.get("scheduledDeparture", 0)
+    )
+    leg_km = distance_to_km(float(next_stop["distanceAlongRoute"])) - distance_to_km(
+        float(last_stop["distanceAlongRoute"])
+    )
+    if leg_seconds <= 0 or leg_km <= 0:
+        return None
+
+    return leg_km * 1000 / leg_seconds
+
+
+def extrapolate_feature(feature: dict[str, Any], now: float) -> dict[str, Any]:
+    """
+    Advances a train feature along its route to the predicted position at
+    `now` (unix seconds).
+
+    The train moves at its reported speed, falling back to the scheduled leg
+    speed, and is held at the next stop instead of running past it.
+    """
+    props = feature["properties"]
+    points = props.get("routePolyline")
+    position_km = props.get("trainPositionKm")
+    if not points or position_km is None:
+        return feature
+
+    elapsed = min(
+        max(0.0, now - float(props.get("lastUpdated") or now)),
+        MAX_EXTRAPOLATION_SECONDS,
+    )
+
+    speed = props.get("speed")
+    if speed is None:
+        speed = props.get("legSpeed")
+
+    # Compiled once per route, as the refresh compiles it
+    route = route_cache.get(points)
+    length_km = route.cum_km[-1]
+    advance_km = (speed or 0.0) * elapsed / 1000
+
+    distance_to_next_stop = props.get("distanceToNextStop")
+    if distance_to_next_stop is not None:
+        advance_km = min(advance_km, distance_to_next_stop)
+
+    predicted_km = min(position_km + advance_km, length_km)
+    advanced = predicted_km - position_km
+
+    new_props = props.copy()
+    new_props["extrapolatedSeconds"] = round(elapsed)
+    if length_km > 0:
+        new_props["routeProgress"] = round(predicted_km / length_km, 4)
+
+    # Keep the reported position as-is when the train isn't moving
+    if advanced <= 0:
+        return {**feature, "properties": new_props}
+
+    lon, lat, bearing = route.point_at_km(predicted_km)
+    new_props.update({"lat": lat, "lon": lon, "heading": bearing})
+    if distance_to_next_stop is not None:
+        new_props["distanceToNextStop"] = round(distance_to_next_stop - advanced, 4)
+
+    return {
+        "type": feature.get("type", "Feature"),
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": new_props,
+    }
@@ -0,0 +1,118 @@
+import itertools
+import math
+from bisect import bisect_left
+from typing import Any, Literal, get_args
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString
+
+from api.util.polyline_codec import encode_lonlat
+from api.util.preprocess import EARTH_RADIUS_KM, CompiledRoute, segment_lengths_km
+
+RouteDetail = Literal["low", "medium", "high", "full"]
+ROUTE_DETAILS: tuple[RouteDetail, ...] = get_args(RouteDetail)
+
+# Highest map zoom each simplified detail level is served for, and its
+# Douglas-Peucker tolerance in degrees: about half a pixel at that zoom, where
+# a 256 px tile spans 360 / 2**zoom degrees of longitude
+ROUTE_DETAIL_LEVELS: dict[RouteDetail, tuple[int, float]] = {
+    "low": (7, 0.005),
+    "medium": (10, 0.0007),
+    "high": (13, 0.00009),
+}
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Returns the great-circle distance between two points in km.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def path_length_km(coords: np.ndarray) -> float:
+    """
+    Returns the haversine length in km of an (n, 2) array of [lon, lat].
+    """
+    if len(coords) < 2:
+        return 0.0
+    return float(segment_lengths_km(coords).sum())
+
+
+def detail_for_zoom(zoom: int) -> RouteDetail:
+    """
+    Returns the coarsest detail level that still looks exact at `zoom`.
+    """
+    for detail, (max_zoom, _) in ROUTE_DETAIL_LEVELS.items():
+        if zoom <= max_zoom:
+            return detail
+    return "full"
+
+
+def _stop_vertices(route: CompiledRoute) -> list[int]:
+    """
+    Returns the sorted indices of the route vertices closest to the snapped
+    stops, along with the first and last vertex.
+    """
+    offsets = route.segment_offsets
+    vertices = {0, len(route.coords) - 1}
+    for offset in route.stop_offsets.values():
+        i = min(bisect_left(offsets, offset), len(offsets) - 1)
+        if i > 0 and offset - offsets[i - 1] < offsets[i] - offset:
+            i -= 1
+        vertices.add(i)
+    return sorted(vertices)
+
+
+def get_simplified_polylines(route: CompiledRoute) -> dict[str, str]:
+    """
+    Returns the route as an encoded polyline for every simplified detail
+    level, computed once per route and again only when stops were snapped
+    to it since.
+
+    The route is split at the vertices closest to its stops and the pieces
+    are simplified separately, so stops stay on the drawn line.
+    """
+    if route.simplified is not None and route.simplified_stops == len(
+        route.stop_offsets
+    ):
+        return route.simplified
+
+    simplified: dict[str, str] = {}
+    if len(route.coords) >= 2:
+        vertices = _stop_vertices(route)
+        pieces = [
+            LineString(route.coords[start : end + 1])
+            for start, end in itertools.pairwise(vertices)
+        ]
+        for detail, (_, tolerance) in ROUTE_DETAIL_LEVELS.items():
+            lines = shapely.simplify(pieces, tolerance, preserve_topology=False)
+            coords = [route.coords[0]]
+            for line in lines:
+                coords.extend(line.coords[1:])
+            simplified[detail] = encode_lonlat(coords)
+
+    route.simplified = simplified
+    route.simplified_stops = len(route.stop_offsets)
+    return simplified
+
+
+def with_route_detail(feature: dict[str, Any], detail: RouteDetail) -> dict[str, Any]:
+    """
+    Returns the feature with its route polyline at the given detail level.
+    """
+    polylines = feature["properties"].get("routePolylines")
+    if detail == "full" or not polylines or detail not in polylines:
+        return feature
+
+    return {
+        **feature,
+        "properties": {**feature["properties"], "routePolyline": polylines[detail]},
+    }
@@ -0,0 +1,87 @@
+import struct
+from typing import Any
+
+from api.util.time import get_service_day_start
+
+# Number of records kept per vehicle and trip (6 hours at one per minute)
+HISTORY_LENGTH = 360
+
+# Keep the history around for a while after the service day has ended
+HISTORY_GRACE_SECONDS = 60 * 60
+
+# timestamp (s), delay (min), route progress (0-1), lat, lon
+HISTORY_RECORD = struct.Struct("<Ihfff")
+
+
+def history_key(vehicle_id: str, service_date: str, trip_short_name: str) -> str:
+    return f"train-history:{vehicle_id}:{service_date}:{trip_short_name}"
+
+
+def pack_history_record(location: dict[str, Any]) -> bytes:
+    """
+    Packs the current state of a processed vehicle into a fixed-size record.
+    """
+    total_route_distance = location.get("totalRouteDistance", 0.0)
+    progress = 0.0
+    if total_route_distance > 0:
+        progress = location.get("trainPosition", 0.0) / total_route_distance
+
+    return HISTORY_RECORD.pack(
+        location.get("lastUpdated", 0),
+        max(-32768, min(32767, location.get("delay", 0))),
+        min(1.0, max(0.0, progress)),
+        location.get("lat", 0.0),
+        location.get("lon", 0.0),
+    )
+
+
+def unpack_history(records: list[bytes]) -> list[dict[str, Any]]:
+    """
+    Unpacks history records, dropping consecutive records without a new
+    position report.
+    """
+    points: list[dict[str, Any]] = []
+    for record in records:
+        timestamp, delay, progress, lat, lon = HISTORY_RECORD.unpack(record)
+        if points and points[-1]["timestamp"] == timestamp:
+            continue
+
+        points.append(
+            {
+                "timestamp": timestamp,
+                "delay": delay,
+                "progress": round(progress, 4),
+                "lat": round(lat, 5),
+                "lon": round(lon, 5),
+            }
+        )
+    return points
+
+
+def downsample[T](items: list[T], max_points: int) -> list[T]:
+    """
+    Picks evenly spaced items, always keeping the first and the last one.
+    """
+    if max_points <= 0 or len(items) <= max_points:
+        return items
+    if max_points == 1:
+        return items[-1:]
+
+    step = (len(items) - 1) / (max_points - 1)
+    return [items[round(i * step)] for i in range(max_points)]
+
+
+def get_history_expiry(trip: dict[str, Any]) -> int | None:
+    """
+    Returns the unix timestamp at which the trip's service day ends, taking
+    trips running past midnight into account.
+    """
+    try:
+        day_start = get_service_day_start(trip.get("serviceDate", ""))
+    except ValueError:
+        return None
+
+    stoptimes = trip.get("stoptimes", [])
+    last_arrival = stoptimes[-1].get("realtimeArrival", 0) if stoptimes else 0
+
+    return day_start + max(86400, last_arrival) + HISTORY_GRACE_SECONDS
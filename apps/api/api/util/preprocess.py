@@ -1,11 +1,42 @@
+import bisect
+import itertools
 import math
+from collections.abc import Iterable
 from datetime import datetime
 from typing import Any
 
+import numpy as np
+import shapely
+from shapely import STRtree
 from shapely.geometry import LineString, Point
 
 from api.util.time import get_seconds_since_day
 
+# Number of projections that had to search the route for a segment matching
+# the heading, read by the per-vehicle cost tracking
+projection_counts = {"fallback": 0}
+
+# Window searched around the previous position of a vehicle along its route,
+# in the degree units of the route line. 0.1 is 8 to 11 km, a few minutes at
+# line speed, and a little is allowed backwards for GPS jitter.
+HINT_WINDOW_AHEAD = 0.1
+HINT_WINDOW_BEHIND = 0.005
+
+# Farthest a vehicle may be from the route for a windowed match to be taken
+HINT_MAX_OFFSET = 0.005
+
+# Routes with more segments than this are searched through an STRtree
+STRTREE_MIN_SEGMENTS = 64
+
+# Share of the scheduled running time between stops that is recovery margin,
+# which a late train makes up on the way
+RUNNING_TIME_RECOVERY = 0.05
+
+# Shortest stop of a late train, it makes up the rest of the scheduled dwell
+MIN_DWELL_SECONDS = 30
+
+EARTH_RADIUS_KM = 6371.0
+
 # --- Helpers ---
 
 
@@ -26,13 +57,56 @@ def calculate_bearing(p1: tuple[float, float], p2: tuple[float, float]) -> float
     return (bearing + 360) % 360
 
 
+def segment_lengths_km(coords: np.ndarray) -> np.ndarray:
+    """
+    Returns the haversine length in km of every segment of an (n, 2) array
+    of [lon, lat].
+    """
+    lam, phi = np.radians(coords).T
+    a = (
+        np.sin(np.diff(phi) / 2) ** 2
+        + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2
+    )
+    lengths: np.ndarray = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+    return lengths
+
+
+def is_aligned(heading: float, bearing: float) -> bool:
+    """
+    Returns whether a bearing points within 90 degrees of the heading.
+    """
+    diff = abs(heading - bearing)
+    if diff > 180:
+        diff = 360 - diff
+    return diff <= 90
+
+
 def project_with_heading(
-    line: LineString, point: Point, heading: float | None
+    line: LineString,
+    point: Point,
+    heading: float | None,
+    route: "CompiledRoute | None" = None,
+    hint: float | None = None,
 ) -> float:
     """
     Projects a point onto a line, respecting vehicle heading to handle
     loops/intersections.
+
+    With the compiled route and `hint`, the previous position of the vehicle
+    along it, a window ahead of the hint is searched first. Where the route
+    crosses itself, this keeps the position on the pass the vehicle is on.
     """
+    if route is not None and hint is not None:
+        windowed = route.project_window(
+            point.x,
+            point.y,
+            heading,
+            hint - HINT_WINDOW_BEHIND,
+            hint + HINT_WINDOW_AHEAD,
+        )
+        if windowed is not None:
+            return windowed
+
     default_proj = line.project(point)
 
     if heading is None:
@@ -63,6 +137,11 @@ def project_with_heading(
         return default_proj
 
     # Otherwise, search for a better segment
+    projection_counts["fallback"] += 1
+    if route is not None and len(route.coords) > STRTREE_MIN_SEGMENTS:
+        nearest = route.project_nearest_aligned(point, heading)
+        return nearest if nearest is not None else default_proj
+
     # Iterate through segments to find one that matches heading and is close
     coords = list(line.coords)
     best_dist = default_proj
@@ -105,30 +184,284 @@ def project_with_heading(
     return best_dist if found_better else default_proj
 
 
-def snap_stops(
-    route_coords: list[tuple[float, float]], stops: list[dict[str, Any]]
-) -> list[dict[str, Any]]:
-    """
-    Snaps stops to the route line and calculates distance along route.
+class CompiledRoute:
     """
-    if len(route_coords) < 2:
-        return []
+    A deduplicated route line in [lon, lat] order with its length, and the
+    distances along it of the stops snapped to it so far.
 
-    line = LineString(route_coords)
-    processed_stops = []
+    The segment offsets and bearings and, for long routes, the STRtree of
+    segments used by the projection are built on first use, as are the
+    haversine distances of the vertices used to convert positions to km.
+    """
 
-    for stop in stops:
-        stop_point = Point(stop["coords"])
-        distance_along_route = line.project(stop_point)
+    __slots__ = (
+        "_cum_km",
+        "_line",
+        "_segment_bearings",
+        "_segment_offsets",
+        "_segment_tree",
+        "coords",
+        "dirty",
+        "length_km",
+        "simplified",
+        "simplified_stops",
+        "stop_offsets",
+    )
 
-        processed_stops.append(
-            {
-                "id": stop["id"],
-                "originalCoords": stop["coords"],
-                "distanceAlongRoute": distance_along_route,
-            }
+    def __init__(
+        self,
+        coords: list[tuple[float, float]],
+        length_km: float = 0.0,
+        stop_offsets: dict[tuple[float, float], float] | None = None,
+    ) -> None:
+        self.coords = coords
+        self.length_km = length_km
+        self.stop_offsets = stop_offsets if stop_offsets is not None else {}
+        # Set when stops were snapped since the route was last persisted
+        self.dirty = False
+        self._line: LineString | None = None
+        self._segment_offsets: list[float] | None = None
+        self._segment_bearings: list[float] | None = None
+        self._segment_tree: STRtree | None = None
+        self._cum_km: list[float] | None = None
+        # Encoded polylines per detail level, see api.util.geometry, and the
+        # number of snapped stops they preserve
+        self.simplified: dict[str, str] | None = None
+        self.simplified_stops = 0
+
+    @property
+    def line(self) -> LineString:
+        if self._line is None:
+            self._line = LineString(self.coords)
+        return self._line
+
+    @property
+    def segment_offsets(self) -> list[float]:
+        """
+        Distance along the line of the start of every segment, followed by
+        the length of the line.
+        """
+        if self._segment_offsets is None:
+            self._segment_offsets = list(
+                itertools.accumulate(
+                    (
+                        math.hypot(x2 - x1, y2 - y1)
+                        for (x1, y1), (x2, y2) in itertools.pairwise(self.coords)
+                    ),
+                    initial=0.0,
+                )
+            )
+        return self._segment_offsets
+
+    @property
+    def segment_bearings(self) -> list[float]:
+        if self._segment_bearings is None:
+            self._segment_bearings = [
+                calculate_bearing(p1, p2) for p1, p2 in itertools.pairwise(self.coords)
+            ]
+        return self._segment_bearings
+
+    @property
+    def segment_tree(self) -> STRtree:
+        if self._segment_tree is None:
+            self._segment_tree = STRtree(
+                [LineString(segment) for segment in itertools.pairwise(self.coords)]
+            )
+        return self._segment_tree
+
+    @property
+    def cum_km(self) -> list[float]:
+        """
+        Haversine distance along the line of every vertex in km, the
+        counterpart of segment_offsets.
+        """
+        if self._cum_km is None:
+            self._cum_km = [0.0]
+            if len(self.coords) >= 2:
+                lengths = segment_lengths_km(np.asarray(self.coords))
+                self._cum_km.extend(np.cumsum(lengths).tolist())
+        return self._cum_km
+
+    def deg_to_km(self, distance: float) -> float:
+        """
+        Converts a distance along the line to km along the route.
+        """
+        if len(self.coords) < 2:
+            return 0.0
+
+        offsets, cum_km = self.segment_offsets, self.cum_km
+        i = min(bisect.bisect_right(offsets, distance), len(offsets) - 1)
+        seg_deg = offsets[i] - offsets[i - 1]
+        if seg_deg <= 0:
+            return cum_km[i]
+
+        t = min(1.0, max(0.0, (distance - offsets[i - 1]) / seg_deg))
+        return cum_km[i - 1] + t * (cum_km[i] - cum_km[i - 1])
+
+    def point_at_km(self, km: float) -> tuple[float, float, float]:
+        """
+        Returns (lon, lat, bearing) of the point `km` along the route.
+        """
+        if len(self.coords) < 2:
+            lon, lat = self.coords[0] if self.coords else (0.0, 0.0)
+            return lon, lat, 0.0
+
+        cum_km = self.cum_km
+        km = min(max(km, 0.0), cum_km[-1])
+        i = min(max(bisect.bisect_right(cum_km, km), 1), len(cum_km) - 1)
+        (x1, y1), (x2, y2) = self.coords[i - 1], self.coords[i]
+
+        seg_km = cum_km[i] - cum_km[i - 1]
+        t = (km - cum_km[i - 1]) / seg_km if seg_km > 0 else 0.0
+
+        return x1 + t * (x2 - x1), y1 + t * (y2 - y1), self.segment_bearings[i - 1]
+
+    def _nearest_segment(
+        self,
+        segments: Iterable[int],
+        x: float,
+        y: float,
+        heading: float | None,
+        max_offset: float,
+    ) -> float | None:
+        """
+        Returns the distance along the line of the point closest to (x, y) on
+        the given segments, considering only segments aligned with the
+        heading and at most `max_offset` away.
+        """
+        offsets = self.segment_offsets
+        bearings = self.segment_bearings if heading is not None else []
+        coords = self.coords
+        best = None
+        best_offset = max_offset
+
+        for i in segments:
+            x1, y1 = coords[i]
+            x2, y2 = coords[i + 1]
+            dx, dy = x2 - x1, y2 - y1
+            length_sq = dx * dx + dy * dy
+            if length_sq == 0:
+                continue
+
+            t = min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / length_sq))
+            offset = math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+            if offset >= best_offset:
+                continue
+            if heading is not None and not is_aligned(heading, bearings[i]):
+                continue
+
+            best_offset = offset
+            best = offsets[i] + t * (offsets[i + 1] - offsets[i])
+
+        return best
+
+    def project_window(
+        self,
+        x: float,
+        y: float,
+        heading: float | None,
+        start: float,
+        end: float,
+    ) -> float | None:
+        """
+        Projects (x, y) onto the part of the line between the distances
+        `start` and `end`, or returns None if no segment there is aligned
+        with the heading and within HINT_MAX_OFFSET of the point.
+        """
+        offsets = self.segment_offsets
+        first = max(0, bisect.bisect_right(offsets, start) - 1)
+        last = min(len(offsets) - 1, bisect.bisect_left(offsets, end))
+
+        segments: Iterable[int] = range(first, last)
+        if last - first > STRTREE_MIN_SEGMENTS:
+            nearby = self.segment_tree.query(
+                Point(x, y), predicate="dwithin", distance=HINT_MAX_OFFSET
+            )
+            segments = sorted(int(i) for i in nearby if first <= i < last)
+
+        return self._nearest_segment(segments, x, y, heading, HINT_MAX_OFFSET)
+
+    def project_nearest_aligned(self, point: Point, heading: float) -> float | None:
+        """
+        Projects the point onto the closest segment aligned with the heading,
+        or returns None if no segment is aligned.
+
+        The segments near the point are looked up in the STRtree first. Only
+        if none of them is aligned are the distances to all aligned segments
+        computed, in a single vectorized call rather than a Python loop.
+        """
+        nearby = self.segment_tree.query(
+            point, predicate="dwithin", distance=HINT_MAX_OFFSET
+        )
+        nearest = self._nearest_segment(
+            sorted(int(i) for i in nearby), point.x, point.y, heading, HINT_MAX_OFFSET
         )
+        if nearest is not None:
+            return nearest
+
+        diff = np.abs(np.asarray(self.segment_bearings) - heading)
+        aligned = np.flatnonzero(np.minimum(diff, 360 - diff) <= 90)
+        if not len(aligned):
+            return None
+
+        distances = shapely.distance(self.segment_tree.geometries[aligned], point)
+        segment = int(aligned[distances.argmin()])
+        return self._nearest_segment([segment], point.x, point.y, None, math.inf)
+
+    def stop_offset(self, coords: tuple[float, float]) -> float:
+        """
+        Returns the distance along the route of the stop at `coords`.
+        """
+        offset = self.stop_offsets.get(coords)
+        if offset is None:
+            offset = self.line.project(Point(coords))
+            self.stop_offsets[coords] = offset
+            self.dirty = True
+        return offset
+
+
+def unique_lonlat_coords(
+    route_coords: list[tuple[float, float]],
+) -> list[tuple[float, float]]:
+    """
+    Swaps [lat, lon] polyline coordinates to GeoJSON [lon, lat] order and
+    removes duplicate points.
+    """
+    unique_coords: list[tuple[float, float]] = []
+    seen = set()
+    for coord in route_coords:
+        t_coord: tuple[float, float] = (coord[1], coord[0])
+        if t_coord not in seen:
+            unique_coords.append(t_coord)
+            seen.add(t_coord)
+    return unique_coords
+
 
+def get_processed_stops(
+    stops: list[dict[str, Any]], stop_distances: list[float]
+) -> list[dict[str, Any]]:
+    """
+    Returns the stops of the stoptimes ordered along the route, given the
+    distance along the route of each. stopTimeIndex is the first stoptime of
+    the stop's name. There are no processed stops without distances, as for
+    routes too short to snap to.
+    """
+    if not stop_distances:
+        return []
+
+    first_index: dict[str | None, int] = {}
+    for index, stop in enumerate(stops):
+        first_index.setdefault(stop.get("name"), index)
+
+    processed_stops: list[dict[str, Any]] = [
+        {
+            "id": stop.get("name"),
+            "originalCoords": [stop.get("lon"), stop.get("lat")],
+            "distanceAlongRoute": distance,
+            "stopTimeIndex": first_index[stop.get("name")],
+        }
+        for stop, distance in zip(stops, stop_distances, strict=True)
+    ]
     processed_stops.sort(key=lambda x: x["distanceAlongRoute"])
 
     return processed_stops
@@ -139,10 +472,14 @@ def get_vehicle_progress(
     processed_stops: list[dict[str, Any]],
     vehicle_pos: tuple[float, float],
     heading: float | None = None,
+    line: LineString | None = None,
+    distance_along_route: float | None = None,
 ) -> dict[str, Any]:
     """
     Determines the last and next stop based on vehicle position.
     vehicle_pos: [lon, lat]
+    The position is projected onto the route unless `distance_along_route`
+    is given.
     """
     # Handle empty stops array
     if not processed_stops:
@@ -151,11 +488,17 @@ def get_vehicle_progress(
     if len(route_coords) < 2:
         return {"lastStop": "", "nextStop": "", "progress": 0}
 
-    line = LineString(route_coords)
-    vehicle_point = Point(vehicle_pos)
+    if distance_along_route is not None:
+        vehicle_distance_along_route = distance_along_route
+    else:
+        if line is None:
+            line = LineString(route_coords)
+        vehicle_point = Point(vehicle_pos)
 
-    # Use heading-aware projection
-    vehicle_distance_along_route = project_with_heading(line, vehicle_point, heading)
+        # Use heading-aware projection
+        vehicle_distance_along_route = project_with_heading(
+            line, vehicle_point, heading
+        )
 
     last_stop = processed_stops[0]
     next_stop = None
@@ -190,6 +533,58 @@ def get_vehicle_progress(
     }
 
 
+def predict_stop_times(
+    stoptimes: list[dict[str, Any]],
+    next_index: int,
+    delay: float,
+    progress: float,
+    current_time: float,
+) -> dict[str, Any]:
+    """
+    Predicts the arrival and departure of every stop from `next_index` on,
+    in seconds since the start of the service day, propagating the current
+    `delay` (seconds) of a vehicle `progress` of the way to the next stop.
+
+    A late train makes up RUNNING_TIME_RECOVERY of the scheduled running
+    time of every leg, and the scheduled dwell beyond MIN_DWELL_SECONDS at
+    every stop. An early train is expected to wait for its scheduled
+    departure.
+    """
+    arrivals: list[int] = []
+    departures: list[int] = []
+    previous_departure = None
+    if next_index > 0:
+        previous = stoptimes[next_index - 1]
+        previous_departure = previous.get("scheduledDeparture", 0)
+
+    for index, stoptime in enumerate(stoptimes[next_index:]):
+        scheduled_arrival = stoptime.get("scheduledArrival", 0)
+        scheduled_departure = stoptime.get("scheduledDeparture", scheduled_arrival)
+
+        if delay > 0 and previous_departure is not None:
+            running = max(0, scheduled_arrival - previous_departure)
+            if index == 0:
+                # Only the rest of the current leg is left to recover on
+                running *= 1 - progress
+            delay = max(0.0, delay - RUNNING_TIME_RECOVERY * running)
+
+        arrival = scheduled_arrival + delay
+        if index == 0:
+            arrival = max(arrival, current_time)
+
+        dwell = max(0, scheduled_departure - scheduled_arrival)
+        departure = max(
+            float(scheduled_departure), arrival + min(dwell, MIN_DWELL_SECONDS)
+        )
+        delay = departure - scheduled_departure
+
+        arrivals.append(round(arrival))
+        departures.append(round(departure))
+        previous_departure = scheduled_departure
+
+    return {"fromStopIndex": next_index, "arrivals": arrivals, "departures": departures}
+
+
 # --- Main Function ---
 
 
@@ -201,60 +596,51 @@ def get_delay_and_position(
     lat: float,
     lon: float,
     heading: float | None = None,
+    route: CompiledRoute | None = None,
+    position_hint: float | None = None,
 ) -> dict[str, Any]:
+    """
+    `position_hint` is the trainPosition of the vehicle on the same route in
+    the previous refresh, if known.
+    """
     # Calculate current time in seconds since midnight
     current_time = get_seconds_since_day(service_date, calculate_date)
 
-    # Swap coords of routeCoords for GeoJSON [lon, lat]
-    # route_coords input is [lat, lon], we need [lon, lat]
-    geojson_route_coords = [[coord[1], coord[0]] for coord in route_coords]
+    # Swap coords of routeCoords for GeoJSON [lon, lat] and remove duplicates,
+    # unless the caller already compiled the route
+    if route is None:
+        route = CompiledRoute(unique_lonlat_coords(route_coords))
+    unique_geojson_route_coords = route.coords
+
+    # Snap the stop of every stoptime to the line. Only the distances are
+    # kept, the processed stops of the details are rebuilt from them.
+    has_line = len(unique_geojson_route_coords) >= 2
+    stops = [stop_time.get("stop", {}) for stop_time in stoptimes]
+    stop_distances = []
+    if has_line:
+        stop_distances = [
+            route.stop_offset((stop.get("lon"), stop.get("lat"))) for stop in stops
+        ]
+    processed_stops = get_processed_stops(stops, stop_distances)
 
-    # Remove duplicates
-    unique_geojson_route_coords: list[tuple[float, float]] = []
-    seen = set()
-    for coord in geojson_route_coords:
-        t_coord: tuple[float, float] = (coord[0], coord[1])
-        if t_coord not in seen:
-            unique_geojson_route_coords.append(t_coord)
-            seen.add(t_coord)
-
-    # Prepare stops for processing
-    stops = []
-    for stop_time in stoptimes:
-        stop_data = stop_time.get("stop", {})
-        stops.append(
-            {
-                "id": stop_data.get("name"),
-                "coords": [stop_data.get("lon"), stop_data.get("lat")],
-            }
-        )
-
-    # Process stops (snap to line)
-    processed_stops = snap_stops(unique_geojson_route_coords, stops)
-
-    # Add stop time info back
-    processed_stops_with_info = []
-    for p_stop in processed_stops:
-        original_stop_time = next(
-            (st for st in stoptimes if st.get("stop", {}).get("name") == p_stop["id"]),
-            None,
+    # Calculate train position along route (re-using the robust projection)
+    train_position = 0.0
+    if has_line:
+        vehicle_point = Point(lon, lat)
+        train_position = project_with_heading(
+            route.line, vehicle_point, heading, route, position_hint
         )
-        new_p_stop = p_stop.copy()
-        new_p_stop["stopTimeInfo"] = original_stop_time
-        processed_stops_with_info.append(new_p_stop)
 
     # Get vehicle progress
     vehicle_progress = get_vehicle_progress(
-        unique_geojson_route_coords, processed_stops, (lon, lat), heading
+        unique_geojson_route_coords,
+        processed_stops,
+        (lon, lat),
+        heading,
+        route.line if has_line else None,
+        train_position if has_line else None,
     )
 
-    # Calculate train position along route (re-using the robust projection)
-    train_position = 0.0
-    if len(unique_geojson_route_coords) >= 2:
-        line = LineString(unique_geojson_route_coords)
-        vehicle_point = Point(lon, lat)
-        train_position = project_with_heading(line, vehicle_point, heading)
-
     total_route_distance = 0
     if processed_stops:
         total_route_distance = max(s["distanceAlongRoute"] for s in processed_stops)
@@ -291,10 +677,25 @@ def get_delay_and_position(
 
         delay = current_time - interpolated_time
 
+    next_index = next(
+        (
+            i
+            for i, st in enumerate(stoptimes)
+            if st.get("stop", {}).get("name") == vehicle_progress["nextStop"]
+        ),
+        None,
+    )
+    predictions = None
+    if next_index is not None:
+        predictions = predict_stop_times(
+            stoptimes, next_index, delay, vehicle_progress["progress"], current_time
+        )
+
     return {
         "delay": delay,
+        "predictions": predictions,
         "trainPosition": train_position,
         "totalRouteDistance": total_route_distance,
-        "processedStops": processed_stops_with_info,
+        "stopDistances": stop_distances,
         "vehicleProgress": vehicle_progress,
     }
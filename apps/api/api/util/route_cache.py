@@ -0,0 +1,210 @@
+"""Compiled route cache, persisted in Redis across worker restarts"""
+
+import hashlib
+import itertools
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from typing import NamedTuple
+
+from redis.asyncio import Redis
+
+from api.core.logging_config import get_logger
+from api.core.redis import add_key
+from api.util.geometry import path_length_km
+from api.util.polyline_codec import decode_lonlat, unique_coords
+from api.util.preprocess import CompiledRoute
+
+logger = get_logger(__name__)
+
+# Bump whenever the binary format or the way routes are compiled changes,
+# routes persisted by older versions are then ignored and rebuilt.
+ROUTE_CACHE_VERSION = 1
+
+# Persisted routes expire this long after they were last written
+ROUTE_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Routes kept in process memory, a day of service has a few thousand
+MAX_ROUTES = 8192
+
+# magic, format version, coordinate count, stop count, route length in km
+_HEADER = struct.Struct("<4sHIId")
+_MAGIC = b"MHRC"
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+def route_cache_key(digest: str) -> str:
+    return add_key(f"route-cache:v{ROUTE_CACHE_VERSION}:{digest}")
+
+
+def pack_route(route: CompiledRoute) -> bytes:
+    """
+    Serializes a route as a header followed by the flat [lon, lat] coordinate
+    array and [lon, lat, offset] stop triples, all little-endian doubles.
+    """
+    coords = array("d", itertools.chain.from_iterable(route.coords))
+    # Copied at once, stops may be snapped to the route in another thread
+    stop_offsets = list(route.stop_offsets.items())
+    stops = array(
+        "d",
+        itertools.chain.from_iterable(
+            (lon, lat, offset) for (lon, lat), offset in stop_offsets
+        ),
+    )
+    header = _HEADER.pack(
+        _MAGIC,
+        ROUTE_CACHE_VERSION,
+        len(route.coords),
+        len(stop_offsets),
+        route.length_km,
+    )
+    return header + coords.tobytes() + stops.tobytes()
+
+
+def unpack_route(data: bytes) -> CompiledRoute | None:
+    """
+    Deserializes a route written by pack_route, or returns None if it was
+    written in another format version or is truncated.
+    """
+    if len(data) < _HEADER.size:
+        return None
+
+    magic, version, coord_count, stop_count, length_km = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != ROUTE_CACHE_VERSION:
+        return None
+
+    values = array("d")
+    values.frombytes(data[_HEADER.size :])
+    if len(values) != coord_count * 2 + stop_count * 3:
+        return None
+
+    end = coord_count * 2
+    coords = list(zip(values[0:end:2], values[1:end:2], strict=True))
+    stops = zip(values[end::3], values[end + 1 :: 3], values[end + 2 :: 3], strict=True)
+    return CompiledRoute(
+        coords, length_km, {(lon, lat): offset for lon, lat, offset in stops}
+    )
+
+
+def compile_route(points: str) -> CompiledRoute:
+    """
+    Decodes an encoded polyline into a CompiledRoute.
+    """
+    coords = decode_lonlat(points)
+    return CompiledRoute(unique_coords(coords), path_length_km(coords))
+
+
+class RouteCache:
+    """
+    LRU cache of compiled routes keyed by a digest of the encoded polyline.
+
+    Routes compiled or extended with newly snapped stops are marked dirty and
+    written to Redis by `persist`, so a restarted worker can `load` them
+    instead of decoding and snapping every route again.
+
+    The refresh processes a batch in a thread while the event loop serves
+    requests and subtasks, so the LRU order is kept under a lock.
+    """
+
+    def __init__(self, max_routes: int = MAX_ROUTES) -> None:
+        self.max_routes = max_routes
+        self._routes: OrderedDict[str, CompiledRoute] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(points: str) -> str:
+        return hashlib.blake2b(points.encode(), digest_size=16).hexdigest()
+
+    def get(self, points: str, digest: str | None = None) -> CompiledRoute:
+        key = digest or self.digest(points)
+        with self._lock:
+            route = self._routes.get(key)
+            if route is not None:
+                self.hits += 1
+                self._routes.move_to_end(key)
+                return route
+            self.misses += 1
+
+        # Compiled outside the lock, a route compiled twice concurrently
+        # keeps the first
+        route = compile_route(points)
+        route.dirty = True
+        return self._put(key, route)
+
+    def _put(self, key: str, route: CompiledRoute) -> CompiledRoute:
+        with self._lock:
+            route = self._routes.setdefault(key, route)
+            self._routes.move_to_end(key)
+            while len(self._routes) > self.max_routes:
+                self._routes.popitem(last=False)
+        return route
+
+    def clear(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.max_routes, len(self._routes))
+
+    async def persist(self, redis: Redis) -> int:
+        """
+        Writes routes changed since the last call to Redis.
+        Returns the number of routes written.
+        """
+        with self._lock:
+            dirty = [(key, route) for key, route in self._routes.items() if route.dirty]
+        if not dirty:
+            return 0
+
+        # Cleared before packing, so stops snapped meanwhile mark it again
+        for _, route in dirty:
+            route.dirty = False
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for key, route in dirty:
+                    pipe.set(
+                        route_cache_key(key), pack_route(route), ex=ROUTE_CACHE_TTL
+                    )
+                await pipe.execute()
+        except Exception:
+            for _, route in dirty:
+                route.dirty = True
+            raise
+        return len(dirty)
+
+    async def load(self, redis: Redis, batch_size: int = 500) -> int:
+        """
+        Loads the routes persisted for the current format version.
+        `redis` must return raw bytes. Returns the number of routes loaded.
+        """
+        prefix = route_cache_key("")[:-1]
+        keys = [key async for key in redis.scan_iter(match=f"{prefix}*", count=1000)]
+
+        loaded = 0
+        for batch in itertools.batched(
+            keys[: self.max_routes], batch_size, strict=False
+        ):
+            for key, data in zip(batch, await redis.mget(batch), strict=True):
+                route = unpack_route(data) if data is not None else None
+                if route is None:
+                    continue
+
+                digest = key.decode()[len(prefix) : -1]
+                with self._lock:
+                    self._routes.setdefault(digest, route)
+                loaded += 1
+
+        return loaded
+
+
+# Shared by all refreshes of the worker process
+route_cache = RouteCache()
@@ -0,0 +1,187 @@
+import heapq
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Any
+
+# Queries shorter than this are answered from the prefix table, longer ones
+# from the trigram table.
+TRIGRAM_SIZE = 3
+
+# Minimum share of query trigrams an entry has to contain to be returned
+MIN_TRIGRAM_SCORE = 0.5
+
+KIND_WEIGHTS = {
+    "train": 0.3,
+    "station": 0.2,
+    "route": 0.1,
+    "county": 0.0,
+}
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercases, strips accents and collapses punctuation, so that
+    "Győr-Moson-Sopron" and "gyor moson sopron" match.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(" ", stripped).strip()
+
+
+def _trigrams(term: str) -> set[str]:
+    padded = f" {term} "
+    return {padded[i : i + TRIGRAM_SIZE] for i in range(len(padded) - 2)}
+
+
+def build_search_index(locations: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Builds a compact search index over trains, routes, stations and counties.
+
+    Entries are stored as [kind, label, detail, vehicleId, terms] lists and
+    referenced by position from the prefix and trigram posting lists.
+    """
+    entries: list[list[Any]] = []
+    routes: dict[str, int] = {}
+    stations: dict[str, int] = {}
+    counties: dict[str, int] = {}
+
+    for loc in locations:
+        vehicle_id = loc.get("vehicleId")
+        if not vehicle_id:
+            continue
+
+        trip = loc.get("trip", {})
+        route = trip.get("route", {})
+        trip_short_name = trip.get("tripShortName") or ""
+        route_short_name = route.get("shortName") or ""
+        route_long_name = route.get("longName") or ""
+
+        entries.append(
+            [
+                "train",
+                trip_short_name or vehicle_id,
+                route_long_name or route_short_name or None,
+                vehicle_id,
+                [trip_short_name, route_short_name],
+            ]
+        )
+
+        route_key = f"{route_short_name}|{route_long_name}"
+        if (route_short_name or route_long_name) and route_key not in routes:
+            routes[route_key] = len(entries)
+            entries.append(
+                [
+                    "route",
+                    route_short_name or route_long_name,
+                    route_long_name or None,
+                    None,
+                    [route_short_name, route_long_name],
+                ]
+            )
+
+        for stoptime in trip.get("stoptimes", []):
+            stop = stoptime.get("stop", {})
+            name = stop.get("name")
+            county = stop.get("county")
+
+            if name and name not in stations:
+                stations[name] = len(entries)
+                entries.append(["station", name, county, None, [name]])
+
+            if county and county not in counties:
+                counties[county] = len(entries)
+                entries.append(["county", county, None, None, [county]])
+
+    prefixes: dict[str, set[int]] = defaultdict(set)
+    trigrams: dict[str, set[int]] = defaultdict(set)
+
+    for idx, entry in enumerate(entries):
+        terms = [normalize(t) for t in entry[4] if t]
+        entry[4] = [t for t in terms if t]
+
+        for term in entry[4]:
+            for word in term.split():
+                for length in range(1, TRIGRAM_SIZE):
+                    if len(word) >= length:
+                        prefixes[word[:length]].add(idx)
+
+            for gram in _trigrams(term):
+                trigrams[gram].add(idx)
+
+    return {
+        "entries": entries,
+        "prefixes": {k: sorted(v) for k, v in prefixes.items()},
+        "trigrams": {k: sorted(v) for k, v in trigrams.items()},
+    }
+
+
+def _term_bonus(query: str, terms: list[str]) -> float:
+    bonus = 0.0
+    for term in terms:
+        if term == query:
+            return 2.0
+        if term.startswith(query):
+            bonus = max(bonus, 1.0)
+        elif query in term:
+            bonus = max(bonus, 0.5)
+    return bonus
+
+
+def search(index: dict[str, Any], query: str, limit: int) -> list[dict[str, Any]]:
+    """
+    Ranks index entries against the query.
+
+    Exact and prefix matches on a term rank above fuzzy trigram matches, and
+    trains and stations are nudged ahead of routes and counties. Ties are
+    broken by label.
+    """
+    q = normalize(query)
+    if not q:
+        return []
+
+    entries: list[list[Any]] = index["entries"]
+    scores: dict[int, float] = {}
+
+    if len(q) < TRIGRAM_SIZE:
+        for idx in index["prefixes"].get(q, []):
+            scores[idx] = 1.0
+    else:
+        grams = _trigrams(q)
+        hits: dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for idx in index["trigrams"].get(gram, []):
+                hits[idx] += 1
+
+        for idx, count in hits.items():
+            score = count / len(grams)
+            if score >= MIN_TRIGRAM_SCORE:
+                scores[idx] = score
+
+    ranked = heapq.nsmallest(
+        limit,
+        (
+            (
+                score + _term_bonus(q, entries[idx][4]) + KIND_WEIGHTS[entries[idx][0]],
+                idx,
+            )
+            for idx, score in scores.items()
+        ),
+        key=lambda item: (-item[0], entries[item[1]][1]),
+    )
+
+    results = []
+    for score, idx in ranked:
+        kind, label, detail, vehicle_id, _ = entries[idx]
+        results.append(
+            {
+                "kind": kind,
+                "label": label,
+                "detail": detail,
+                "vehicleId": vehicle_id,
+                "score": round(score, 3),
+            }
+        )
+    return results
@@ -0,0 +1,162 @@
+import heapq
+import math
+from collections.abc import Callable
+from typing import Any
+
+from api.util.geometry import EARTH_RADIUS_KM, haversine_km
+from api.util.station import station_county_key
+
+# Fields of the vehicle and station entries of the nearby index
+VEHICLE_FIELDS = (
+    "vehicleId",
+    "lat",
+    "lon",
+    "type",
+    "tripShortName",
+    "routeShortName",
+    "delay",
+)
+STATION_FIELDS = ("name", "lat", "lon", "county")
+
+
+def _unit_vector(lat: float, lon: float) -> tuple[float, float, float]:
+    """
+    Returns the point on the unit sphere. Straight-line distances between
+    these order points the same way as great-circle distances, so a k-d tree
+    over them answers nearest neighbour queries exactly, anywhere on Earth.
+    """
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def _chord(distance_km: float) -> float:
+    """
+    Returns the straight-line distance on the unit sphere of a great-circle
+    distance.
+    """
+    return 2 * math.sin(min(math.pi, distance_km / EARTH_RADIUS_KM) / 2)
+
+
+def kd_order(entries: list[list[Any]]) -> list[list[Any]]:
+    """
+    Orders [*, lat, lon, ...] entries as an implicit k-d tree: the median
+    along the axis of the depth sits in the middle of every slice, with the
+    entries before it on the lower side and those after it on the upper side.
+    """
+    points = [(_unit_vector(entry[1], entry[2]), entry) for entry in entries]
+    ordered: list[list[Any]] = []
+
+    def place(
+        items: list[tuple[tuple[float, float, float], list[Any]]], depth: int
+    ) -> None:
+        if not items:
+            return
+        items.sort(key=lambda item: item[0][depth % 3])
+        middle = len(items) // 2
+        place(items[:middle], depth + 1)
+        ordered.append(items[middle][1])
+        place(items[middle + 1 :], depth + 1)
+
+    place(points, 0)
+    return ordered
+
+
+def build_nearby_index(
+    locations: list[dict[str, Any]],
+    get_vehicle_type: Callable[[dict[str, Any]], str],
+) -> dict[str, Any]:
+    """
+    Builds the k-d trees of the vehicle positions and of the stations on the
+    trips of a snapshot, as lists of VEHICLE_FIELDS and STATION_FIELDS.
+    """
+    vehicles = []
+    stations: dict[tuple[str, str], list[Any]] = {}
+
+    for loc in locations:
+        vehicle_id = loc.get("vehicleId")
+        if not vehicle_id or loc.get("lat") is None or loc.get("lon") is None:
+            continue
+
+        trip = loc.get("trip", {})
+        vehicles.append(
+            [
+                vehicle_id,
+                loc["lat"],
+                loc["lon"],
+                get_vehicle_type(loc),
+                trip.get("tripShortName", ""),
+                trip.get("route", {}).get("shortName", ""),
+                loc.get("delay", 0),
+            ]
+        )
+
+        for stoptime in trip.get("stoptimes", []):
+            stop = stoptime.get("stop", {})
+            name = stop.get("name")
+            if not name or stop.get("lat") is None or stop.get("lon") is None:
+                continue
+            stations.setdefault(
+                station_county_key(name, stop.get("county")),
+                [name, stop["lat"], stop["lon"], stop.get("county")],
+            )
+
+    return {
+        "vehicles": kd_order(vehicles),
+        "stations": kd_order(list(stations.values())),
+    }
+
+
+class NearbyIndex:
+    """
+    Answers k nearest neighbour queries over the entries of a k-d tree built
+    by kd_order, in O(log n) for nearby points.
+    """
+
+    def __init__(self, entries: list[list[Any]]) -> None:
+        self.entries = entries
+        self._points = [_unit_vector(entry[1], entry[2]) for entry in entries]
+
+    def nearest(
+        self, lat: float, lon: float, k: int, radius_km: float | None = None
+    ) -> list[tuple[float, list[Any]]]:
+        """
+        Returns up to `k` (distance km, entry) pairs closest to the point,
+        nearest first, within `radius_km` if given.
+        """
+        target = _unit_vector(lat, lon)
+        limit = _chord(radius_km) ** 2 if radius_km is not None else math.inf
+        # Max-heap of the best candidates by squared chord length
+        best: list[tuple[float, int]] = []
+
+        def worst() -> float:
+            return -best[0][0] if len(best) == k else limit
+
+        def search(lo: int, hi: int, depth: int) -> None:
+            if lo >= hi:
+                return
+            middle = (lo + hi) // 2
+            point = self._points[middle]
+            distance = sum((a - b) ** 2 for a, b in zip(point, target, strict=True))
+            if distance <= worst():
+                heapq.heappush(best, (-distance, middle))
+                if len(best) > k:
+                    heapq.heappop(best)
+
+            axis = depth % 3
+            offset = target[axis] - point[axis]
+            near, far = (
+                ((middle + 1, hi), (lo, middle))
+                if offset > 0
+                else ((lo, middle), (middle + 1, hi))
+            )
+            search(*near, depth + 1)
+            if offset**2 <= worst():
+                search(*far, depth + 1)
+
+        search(0, len(self.entries), 0)
+
+        results = []
+        for _, index in sorted(best, reverse=True):
+            entry = self.entries[index]
+            results.append((haversine_km(lat, lon, entry[1], entry[2]), entry))
+        return results
@@ -0,0 +1,108 @@
+from typing import Any
+
+from api.util.search import normalize
+from api.util.time import get_service_day_start
+
+
+def station_key(name: str) -> str:
+    """
+    Returns the index key for a station name, tolerant to accents and case.
+    """
+    return normalize(name)
+
+
+def station_county_key(name: str, county: str | None) -> tuple[str, str]:
+    """
+    Returns the key telling apart stations of the same name in different
+    counties, tolerant to accents and case.
+    """
+    return station_key(name), normalize(county or "")
+
+
+def get_upcoming_stop_index(location: dict[str, Any]) -> int | None:
+    """
+    Returns the index of the first stop in `stoptimes` the vehicle has not
+    reached yet, based on the computed vehicle progress.
+    """
+    stoptimes = location.get("trip", {}).get("stoptimes", [])
+    next_stop = location.get("vehicleProgress", {}).get("nextStop")
+    if not next_stop:
+        return None
+
+    for idx, stoptime in enumerate(stoptimes):
+        if stoptime.get("stop", {}).get("name") == next_stop:
+            return idx
+
+    return None
+
+
+def build_station_boards(
+    locations: list[dict[str, Any]],
+) -> dict[str, list[dict[str, Any]]]:
+    """
+    Builds an inverted index from station name to upcoming arrivals, sorted
+    by predicted arrival, or realtime arrival where there is no prediction.
+    Stations sharing a name get a board per county under the same key.
+    """
+    boards: dict[tuple[str, str], dict[str, Any]] = {}
+
+    for loc in locations:
+        vehicle_id = loc.get("vehicleId")
+        start_idx = get_upcoming_stop_index(loc)
+        if not vehicle_id or start_idx is None:
+            continue
+
+        trip = loc.get("trip", {})
+        stoptimes = trip.get("stoptimes", [])
+        try:
+            day_start = get_service_day_start(trip.get("serviceDate", ""))
+        except ValueError:
+            continue
+
+        destination = stoptimes[-1].get("stop", {}).get("name") if stoptimes else None
+
+        # Predicted by the refresh from the current delay, for the same stops
+        predictions = loc.get("predictions") or {}
+        if predictions.get("fromStopIndex") != start_idx:
+            predictions = {}
+
+        for offset, stoptime in enumerate(stoptimes[start_idx:]):
+            stop = stoptime.get("stop", {})
+            name = stop.get("name")
+            if not name:
+                continue
+
+            predicted_arrival = predicted_departure = None
+            if offset < len(predictions.get("arrivals", [])):
+                predicted_arrival = day_start + predictions["arrivals"][offset]
+                predicted_departure = day_start + predictions["departures"][offset]
+
+            board = boards.setdefault(
+                station_county_key(name, stop.get("county")),
+                {"name": name, "county": stop.get("county"), "arrivals": []},
+            )
+            board["arrivals"].append(
+                {
+                    "vehicleId": vehicle_id,
+                    "tripShortName": trip.get("tripShortName", ""),
+                    "routeShortName": trip.get("route", {}).get("shortName", ""),
+                    "destination": destination,
+                    "platformCode": stop.get("platformCode"),
+                    "scheduledArrival": day_start + stoptime["scheduledArrival"],
+                    "realtimeArrival": day_start + stoptime["realtimeArrival"],
+                    "scheduledDeparture": day_start + stoptime["scheduledDeparture"],
+                    "realtimeDeparture": day_start + stoptime["realtimeDeparture"],
+                    "predictedArrival": predicted_arrival,
+                    "predictedDeparture": predicted_departure,
+                    "delay": loc.get("delay", 0),
+                }
+            )
+
+    by_name: dict[str, list[dict[str, Any]]] = {}
+    for (key, _), board in boards.items():
+        board["arrivals"].sort(
+            key=lambda a: a["predictedArrival"] or a["realtimeArrival"]
+        )
+        by_name.setdefault(key, []).append(board)
+
+    return by_name
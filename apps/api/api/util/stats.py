@@ -0,0 +1,82 @@
+import math
+from collections import defaultdict
+from collections.abc import Callable
+from typing import Any
+
+DELAY_THRESHOLD_MINUTES = 5
+
+
+def percentile(sorted_values: list[int], fraction: float) -> int:
+    """
+    Nearest-rank percentile of an already sorted, non-empty list.
+    """
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def aggregate_delays(delays: list[int]) -> dict[str, Any]:
+    """
+    Summarizes a group of delays (in minutes).
+    """
+    values = sorted(delays)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2),
+        "p50": percentile(values, 0.5),
+        "p90": percentile(values, 0.9),
+        "max": values[-1],
+        "overThreshold": sum(1 for v in values if v > DELAY_THRESHOLD_MINUTES),
+    }
+
+
+def get_current_county(location: dict[str, Any]) -> str | None:
+    """
+    Returns the county of the last stop the vehicle has passed.
+    """
+    last_stop = location.get("vehicleProgress", {}).get("lastStop")
+    for stoptime in location.get("trip", {}).get("stoptimes", []):
+        stop = stoptime.get("stop", {})
+        if stop.get("name") == last_stop:
+            county: str | None = stop.get("county")
+            return county
+    return None
+
+
+def build_delay_stats(
+    locations: list[dict[str, Any]],
+    get_vehicle_type: Callable[[dict[str, Any]], str],
+) -> dict[str, Any]:
+    """
+    Computes delay aggregates per county, route and vehicle type.
+    """
+    overall: list[int] = []
+    counties: dict[str, list[int]] = defaultdict(list)
+    routes: dict[str, list[int]] = defaultdict(list)
+    vehicle_types: dict[str, list[int]] = defaultdict(list)
+
+    for loc in locations:
+        delay = loc.get("delay")
+        if delay is None:
+            continue
+
+        overall.append(delay)
+
+        county = get_current_county(loc)
+        if county:
+            counties[county].append(delay)
+
+        route_short_name = loc.get("trip", {}).get("route", {}).get("shortName")
+        if route_short_name:
+            routes[route_short_name].append(delay)
+
+        vehicle_types[get_vehicle_type(loc)].append(delay)
+
+    return {
+        "thresholdMinutes": DELAY_THRESHOLD_MINUTES,
+        "overall": aggregate_delays(overall) if overall else None,
+        "counties": {k: aggregate_delays(v) for k, v in sorted(counties.items())},
+        "routes": {k: aggregate_delays(v) for k, v in sorted(routes.items())},
+        "vehicleTypes": {
+            k: aggregate_delays(v) for k, v in sorted(vehicle_types.items())
+        },
+    }
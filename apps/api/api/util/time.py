@@ -38,3 +38,12 @@ def get_seconds_since_day(since_date_str: str, date: datetime) -> int:
     except ValueError:
         # Fallback if date parsing fails
         return seconds_since_midnight
+
+
+def get_service_day_start(service_date_str: str) -> int:
+    """
+    Returns the unix timestamp of Budapest midnight on the service date.
+    Stop times are given in seconds relative to this instant.
+    """
+    service_date_naive = datetime.strptime(service_date_str, "%Y-%m-%d")
+    return int(BUDAPEST_TZ.localize(service_date_naive).timestamp())
@@ -0,0 +1,100 @@
+"""Loading, anonymizing and scaling recorded vehiclePositions snapshots"""
+
+import copy
+import gzip
+import hashlib
+import json
+import math
+import random
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+DEFAULT_FIXTURE = FIXTURES_DIR / "vehicle_positions.json.gz"
+
+
+def save_fixture(
+    path: Path, locations: list[dict[str, Any]], recorded_at: int, source: str
+) -> None:
+    payload = {
+        "recordedAt": recorded_at,
+        "source": source,
+        "data": {"vehiclePositions": locations},
+    }
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(payload, f, separators=(",", ":"), ensure_ascii=False)
+
+
+def load_fixture(path: Path = DEFAULT_FIXTURE) -> list[dict[str, Any]]:
+    """
+    Loads a fixture and moves it forward by whole days, so that vehicles are
+    not filtered out as stale while delays stay the same as when recorded.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        payload = json.load(f)
+
+    locations: list[dict[str, Any]] = payload["data"]["vehiclePositions"]
+    days = math.ceil((time.time() - payload["recordedAt"]) / 86400)
+    return rebase(locations, days)
+
+
+def rebase(locations: list[dict[str, Any]], days: int) -> list[dict[str, Any]]:
+    if days <= 0:
+        return locations
+
+    rebased = []
+    for loc in locations:
+        new_loc = dict(loc)
+        new_loc["lastUpdated"] = loc.get("lastUpdated", 0) + days * 86400
+
+        trip = loc.get("trip", {})
+        if trip.get("serviceDate"):
+            service_date = date.fromisoformat(trip["serviceDate"])
+            new_loc["trip"] = {
+                **trip,
+                "serviceDate": (service_date + timedelta(days=days)).isoformat(),
+            }
+        rebased.append(new_loc)
+    return rebased
+
+
+def anonymize(locations: list[dict[str, Any]], salt: str) -> list[dict[str, Any]]:
+    """
+    Replaces vehicle ids with salted hashes and drops alert links, keeping
+    everything the pipeline computes with.
+    """
+    anonymized = []
+    for loc in locations:
+        new_loc = copy.deepcopy(loc)
+        digest = hashlib.sha256(f"{salt}:{loc.get('vehicleId')}".encode()).hexdigest()
+        new_loc["vehicleId"] = f"bench:{digest[:12]}"
+
+        for alert in new_loc.get("trip", {}).get("alerts", []):
+            alert["alertUrl"] = None
+        anonymized.append(new_loc)
+    return anonymized
+
+
+def scale_fleet(
+    locations: list[dict[str, Any]], multiplier: int, seed: int = 0
+) -> list[dict[str, Any]]:
+    """
+    Returns a synthetic fleet `multiplier` times the size of the fixture.
+    Copies get their own vehicle ids and a slightly shifted position, so
+    they don't hit each other's caches.
+    """
+    if multiplier <= 1:
+        return locations
+
+    rng = random.Random(seed)
+    fleet = list(locations)
+    for copy_idx in range(1, multiplier):
+        for loc in locations:
+            clone = dict(loc)
+            clone["vehicleId"] = f"{loc['vehicleId']}:{copy_idx}"
+            clone["lat"] = loc["lat"] + rng.uniform(-2e-4, 2e-4)
+            clone["lon"] = loc["lon"] + rng.uniform(-2e-4, 2e-4)
+            fleet.append(clone)
+    return fleet
@@ -0,0 +1,387 @@
+"""
+End-to-end load harness.
+
+Starts a local stand-in for the GraphQL endpoint that replays a fixture (or a
+synthetic fleet) with configurable latency, runs TrainService.refresh_data
+against it, and drives the API with virtual clients polling like the web app
+does: the train list every 60 s, and the open train's details every 5 s.
+
+Run from apps/api:
+
+    uv run python -m benchmarks.load --fleet 1000 --clients 200 --duration 120
+    uv run python -m benchmarks.load --redis-url redis://localhost:6379 \\
+        --api-url http://localhost:8000/api --speedup 1
+
+Without --redis-url an in-process fakeredis server stands in for Redis.
+Without --api-url the API runs in-process through an ASGI transport, so
+latencies include contention with the clients for the same interpreter.
+--speedup divides every polling and refresh interval to compress time.
+
+With --replay, the refreshes publish the snapshots of an archive file (see
+scripts/export-archive.py) in a loop instead of fetching, restamped to the
+time they are published. Archives keep no per-vehicle details, so the
+detail requests of the clients get 404s.
+"""
+
+import os
+
+# The harness points the settings to its own endpoint before anything reads them
+os.environ["GRAPHQL_ENDPOINT"] = "http://127.0.0.1:0/graphql"
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import statistics
+import threading
+import time
+from collections import defaultdict
+from collections.abc import AsyncGenerator, Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import httpx
+import uvicorn
+from redis.asyncio import Redis
+
+from api.core import redis as core_redis
+from api.core.config import settings
+from api.main import create_app
+from api.services.train_service import TrainService
+from api.util.archive import read_archive_file
+from benchmarks.fixtures import DEFAULT_FIXTURE, load_fixture, scale_fleet
+from benchmarks.synthetic import generate_snapshot
+
+LIST_POLL_SECONDS = 60.0
+DETAIL_POLL_SECONDS = 5.0
+
+
+@dataclass
+class Stats:
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    refreshes: list[float] = field(default_factory=list)
+    refresh_errors: int = 0
+
+
+def make_graphql_app(payload: bytes, latency: float, jitter: float) -> Callable:
+    """
+    A bare ASGI app answering every request with the recorded payload.
+    """
+
+    async def app(scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            return
+
+        # Drain the request body
+        more_body = True
+        while more_body:
+            message = await receive()
+            more_body = message.get("more_body", False)
+
+        await asyncio.sleep(max(0.0, random.gauss(latency, jitter)))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": payload})
+
+    return app
+
+
+def start_graphql_server(payload: bytes, latency: float, jitter: float) -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    config = uvicorn.Config(
+        make_graphql_app(payload, latency, jitter),
+        host="127.0.0.1",
+        port=port,
+        log_level="warning",
+        lifespan="off",
+    )
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/graphql"
+
+
+def make_redis_factory(
+    redis_url: str | None,
+) -> Callable[[bool], Redis]:
+    """
+    Returns a factory for clients (text or bytes) of the same Redis, so every
+    thread can create clients bound to its own event loop.
+    """
+    if redis_url:
+        return lambda decode: Redis.from_url(redis_url, decode_responses=decode)
+
+    import fakeredis
+
+    server = fakeredis.FakeServer()
+    return lambda decode: fakeredis.FakeAsyncRedis(
+        server=server, decode_responses=decode
+    )
+
+
+def run_refreshes(
+    redis_factory: Callable[[bool], Redis],
+    interval: float,
+    stop: threading.Event,
+    stats: Stats,
+    first_done: threading.Event,
+    replay: list[dict[str, Any]] | None = None,
+) -> None:
+    """
+    Refreshes in a thread of its own, as the worker would in its own process.
+    With `replay`, publishes the given snapshots in turn instead.
+    """
+
+    async def loop() -> None:
+        service = TrainService(redis_factory(True))
+        runs = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                if replay:
+                    version = int(time.time() * 1000)
+                    snapshot = {**replay[runs % len(replay)], "timestamp": version}
+                    await service.publish_snapshot(version, [], snapshot, {}, {})
+                else:
+                    await service.refresh_data()
+                runs += 1
+                stats.refreshes.append(time.perf_counter() - start)
+            except Exception as e:
+                stats.refresh_errors += 1
+                print(f"Refresh failed: {e}")
+            first_done.set()
+
+            remaining = interval - (time.perf_counter() - start)
+            while remaining > 0 and not stop.is_set():
+                await asyncio.sleep(min(0.5, remaining))
+                remaining -= 0.5
+
+    asyncio.run(loop())
+
+
+async def timed_get(
+    client: httpx.AsyncClient, url: str, label: str, stats: Stats
+) -> httpx.Response | None:
+    start = time.perf_counter()
+    try:
+        response = await client.get(url)
+    except httpx.HTTPError:
+        stats.errors[label] += 1
+        return None
+
+    stats.latencies[label].append(time.perf_counter() - start)
+    if response.status_code >= 500:
+        stats.errors[label] += 1
+    return response
+
+
+async def virtual_client(
+    client: httpx.AsyncClient,
+    speedup: float,
+    detail_ratio: float,
+    deadline: float,
+    stats: Stats,
+) -> None:
+    """
+    Polls the train list, and for a share of clients keeps a detail panel
+    open on a random train, switching trains on every list refresh.
+    """
+    rng = random.Random()
+    # Spread clients over the polling period
+    await asyncio.sleep(rng.uniform(0, LIST_POLL_SECONDS / speedup))
+
+    while time.monotonic() < deadline:
+        list_due = time.monotonic() + LIST_POLL_SECONDS / speedup
+        response = await timed_get(client, "/v1/trains", "GET /v1/trains", stats)
+
+        vehicle_id = None
+        if response is not None and response.status_code == 200:
+            features = response.json().get("features", [])
+            if features and rng.random() < detail_ratio:
+                vehicle_id = rng.choice(features)["properties"]["vehicleId"]
+
+        while time.monotonic() < min(list_due, deadline):
+            if vehicle_id:
+                await timed_get(
+                    client,
+                    f"/v1/trains/{vehicle_id}",
+                    "GET /v1/trains/{vehicle_id}",
+                    stats,
+                )
+                await asyncio.sleep(DETAIL_POLL_SECONDS / speedup)
+            else:
+                await asyncio.sleep(max(0.0, list_due - time.monotonic()))
+
+
+def percentiles(values: list[float]) -> str:
+    ordered = sorted(values)
+
+    def pct(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return (
+        f"p50 {pct(0.5):8.1f} ms  p90 {pct(0.9):8.1f} ms  "
+        f"p99 {pct(0.99):8.1f} ms  max {ordered[-1] * 1000:8.1f} ms"
+    )
+
+
+def report(stats: Stats, elapsed: float) -> dict[str, Any]:
+    print(f"\nRan for {elapsed:.1f}s")
+
+    if stats.refreshes:
+        print(
+            f"refresh_data: {len(stats.refreshes)} runs, "
+            f"{stats.refresh_errors} errors, {percentiles(stats.refreshes)}"
+        )
+
+    endpoints = {}
+    for label, values in sorted(stats.latencies.items()):
+        throughput = len(values) / elapsed
+        print(
+            f"{label:<30} {len(values):>7} req  {throughput:8.1f} req/s  "
+            f"{stats.errors[label]:>4} errors  {percentiles(values)}"
+        )
+        endpoints[label] = {
+            "requests": len(values),
+            "errors": stats.errors[label],
+            "throughput": throughput,
+            "median": statistics.median(values),
+            "max": max(values),
+        }
+
+    return {
+        "elapsed": elapsed,
+        "refresh": {
+            "runs": len(stats.refreshes),
+            "errors": stats.refresh_errors,
+            "median": statistics.median(stats.refreshes) if stats.refreshes else None,
+            "max": max(stats.refreshes) if stats.refreshes else None,
+        },
+        "endpoints": endpoints,
+    }
+
+
+async def drive_clients(
+    args: argparse.Namespace,
+    redis_factory: Callable[[bool], Redis],
+    stats: Stats,
+) -> float:
+    if args.api_url:
+        client = httpx.AsyncClient(base_url=args.api_url, timeout=30)
+    else:
+        app = create_app()
+        text_client = redis_factory(True)
+        bytes_client = redis_factory(False)
+
+        async def get_redis() -> AsyncGenerator[Redis]:
+            yield text_client
+
+        async def get_redis_bytes() -> AsyncGenerator[Redis]:
+            yield bytes_client
+
+        app.dependency_overrides[core_redis.get_redis] = get_redis
+        app.dependency_overrides[core_redis.get_redis_bytes] = get_redis_bytes
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://harness"
+        )
+
+    start = time.monotonic()
+    deadline = start + args.duration
+    async with client:
+        await asyncio.gather(
+            *(
+                virtual_client(client, args.speedup, args.detail_ratio, deadline, stats)
+                for _ in range(args.clients)
+            )
+        )
+    return time.monotonic() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--fixture", type=Path, default=DEFAULT_FIXTURE)
+    parser.add_argument(
+        "--fleet",
+        type=int,
+        help="serve N synthetic vehicles instead of the (scaled) fixture",
+    )
+    parser.add_argument("--multiplier", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="seconds")
+    parser.add_argument("--refresh-interval", type=float, default=60.0)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--detail-ratio", type=float, default=0.3)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--speedup", type=float, default=10.0)
+    parser.add_argument("--redis-url")
+    parser.add_argument("--api-url")
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    parser.add_argument(
+        "--replay", type=Path, help="publish the snapshots of an archive file"
+    )
+    args = parser.parse_args()
+
+    replay = None
+    if args.replay:
+        replay = list(read_archive_file(args.replay))
+        print(f"Replaying {len(replay)} snapshots from {args.replay}")
+
+    if args.fleet:
+        locations = generate_snapshot(args.fleet)
+    else:
+        locations = scale_fleet(load_fixture(args.fixture), args.multiplier)
+
+    payload = json.dumps({"data": {"vehiclePositions": locations}}).encode()
+    settings.GRAPHQL_ENDPOINT = start_graphql_server(payload, args.latency, args.jitter)
+    print(
+        f"Serving {len(locations)} vehicles ({len(payload) / 1e6:.1f} MB) "
+        f"at {settings.GRAPHQL_ENDPOINT}"
+    )
+
+    redis_factory = make_redis_factory(args.redis_url)
+    stats = Stats()
+    stop = threading.Event()
+    first_done = threading.Event()
+    refresher = threading.Thread(
+        target=run_refreshes,
+        args=(
+            redis_factory,
+            args.refresh_interval / args.speedup,
+            stop,
+            stats,
+            first_done,
+            replay,
+        ),
+        daemon=True,
+    )
+    refresher.start()
+    first_done.wait()
+
+    try:
+        elapsed = asyncio.run(drive_clients(args, redis_factory, stats))
+    finally:
+        stop.set()
+        refresher.join()
+
+    result = report(stats, elapsed)
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
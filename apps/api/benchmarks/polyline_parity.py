@@ -0,0 +1,97 @@
+"""
+Checks the vectorized polyline codec against the polyline package.
+
+Covers the routes of a fixture, and edge cases the recorded routes rarely
+hit: empty and single point polylines, the largest deltas between valid
+coordinates, which take the longest varints, and coordinates halfway
+between two steps of the precision.
+
+Run from apps/api:
+
+    uv run python -m benchmarks.polyline_parity
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Any
+
+import polyline  # type: ignore[import-untyped]
+
+from api.util.polyline_codec import (
+    decode_lonlat,
+    decode_unique_lonlat,
+    encode_lonlat,
+)
+from api.util.preprocess import unique_lonlat_coords
+from benchmarks.fixtures import DEFAULT_FIXTURE, load_fixture
+
+# [lat, lon] coordinates, as the polyline package takes them
+EDGE_CASES: dict[str, list[tuple[float, float]]] = {
+    "empty": [],
+    "single point": [(47.49791, 19.04023)],
+    "repeated point": [(47.49791, 19.04023)] * 3,
+    "largest deltas": [(-90.0, -180.0), (90.0, 180.0), (-90.0, -180.0)],
+    "antimeridian": [(0.0, 179.99999), (0.0, -179.99999), (0.0, 179.99999)],
+    "halves": [(0.000005, -0.000005), (-0.000015, 0.000025), (0.0, 0.0)],
+}
+
+
+def mismatch(coords: list[tuple[float, float]], precision: int) -> str | None:
+    """
+    Returns which operation of the codec differs from the polyline package
+    on the coordinates, if any.
+    """
+    # The polyline package fails to encode no coordinates at all
+    points = polyline.encode(coords, precision) if coords else ""
+    if encode_lonlat([(lon, lat) for lat, lon in coords], precision) != points:
+        return "encode"
+
+    reference = polyline.decode(points, precision)
+    decoded = decode_lonlat(points, precision)
+    if decoded.tolist() != [[lon, lat] for lat, lon in reference]:
+        return "decode"
+    if decode_unique_lonlat(points, precision) != unique_lonlat_coords(reference):
+        return "decode unique"
+    if encode_lonlat(decoded, precision) != points:
+        return "re-encode"
+    return None
+
+
+def check_polyline_parity(locations: list[dict[str, Any]]) -> None:
+    """
+    Exits with an error unless the vectorized polyline codec decodes and
+    encodes the edge cases and every route of the fixture exactly as the
+    polyline package.
+    """
+    for name, coords in EDGE_CASES.items():
+        for precision in (5, 6):
+            failed = mismatch(coords, precision)
+            if failed:
+                sys.exit(
+                    f"Polyline codec differs from polyline ({failed}) on {name} "
+                    f"at precision {precision}"
+                )
+
+    routes = {loc["trip"]["tripGeometry"]["points"] for loc in locations}
+    for points in routes:
+        failed = mismatch(polyline.decode(points), 5)
+        if failed:
+            sys.exit(
+                f"Polyline codec differs from polyline ({failed}) on {points[:40]}..."
+            )
+    print(
+        f"Polyline codec matches polyline on {len(EDGE_CASES)} edge cases and "
+        f"{len(routes)} routes"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fixture", type=Path, default=DEFAULT_FIXTURE)
+    args = parser.parse_args()
+    check_polyline_parity(load_fixture(args.fixture))
+
+
+if __name__ == "__main__":
+    main()
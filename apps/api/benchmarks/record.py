@@ -0,0 +1,60 @@
+"""
+Records an anonymized vehiclePositions snapshot as a benchmark fixture.
+
+    uv run python -m benchmarks.record benchmarks/fixtures/vehicle_positions.json.gz
+    uv run python -m benchmarks.record --synthetic 300 out.json.gz
+"""
+
+import argparse
+import asyncio
+import secrets
+import time
+from pathlib import Path
+
+from benchmarks.fixtures import anonymize, save_fixture
+from benchmarks.synthetic import generate_snapshot
+
+
+async def record(path: Path) -> None:
+    # Imported here, so generating synthetic fixtures needs no configuration
+    from redis.asyncio import Redis
+
+    from api.services.train_service import TrainService
+
+    data = await TrainService(Redis()).fetch_graphql_data()
+    locations = data.get("data", {}).get("vehiclePositions", [])
+    save_fixture(
+        path,
+        anonymize(locations, secrets.token_hex(8)),
+        int(time.time()),
+        "recorded",
+    )
+    print(f"Recorded {len(locations)} vehicles to {path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output", type=Path)
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="N",
+        help="generate N synthetic vehicles instead of calling the upstream",
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        save_fixture(
+            args.output,
+            generate_snapshot(args.synthetic, args.seed),
+            int(time.time()),
+            "synthetic",
+        )
+        print(f"Generated {args.synthetic} vehicles to {args.output}")
+    else:
+        asyncio.run(record(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Microbenchmarks for the refresh pipeline.
+
+Run from apps/api:
+
+    uv run python -m benchmarks.run --multipliers 1,10,50 --output after.json
+    uv run python -m benchmarks.run --compare before.json --max-regression 0.2
+"""
+
+import os
+
+# The pipeline never talks to the upstream here, but settings require it
+os.environ.setdefault("GRAPHQL_ENDPOINT", "http://localhost/graphql")
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import polyline  # type: ignore[import-untyped]
+from redis.asyncio import Redis
+from shapely.geometry import Point
+
+from api.services import train_service
+from api.services.details import build_details
+from api.services.train_service import TrainService
+from api.util import county
+from api.util.catalog import Catalog
+from api.util.geometry import path_length_km
+from api.util.polyline_codec import (
+    decode_lonlat,
+    decode_unique_lonlat,
+    encode_lonlat,
+)
+from api.util.preprocess import (
+    CompiledRoute,
+    calculate_bearing,
+    get_delay_and_position,
+    project_with_heading,
+    unique_lonlat_coords,
+)
+from api.util.route_cache import route_cache
+from benchmarks.fixtures import DEFAULT_FIXTURE, load_fixture, scale_fleet
+from benchmarks.polyline_parity import check_polyline_parity
+
+RESULTS_VERSION = 1
+
+Case = Callable[[], object]
+
+
+def time_case(case: Case, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _heading_cases(
+    locations: list[dict[str, Any]],
+) -> list[tuple[CompiledRoute, Point, float, float]]:
+    """
+    Builds (route, point, heading, distance) tuples where the heading matches
+    the route direction at the projected point, which lies `distance` along
+    the route.
+    """
+    cases = []
+    for loc in locations:
+        coords = unique_lonlat_coords(
+            polyline.decode(loc["trip"]["tripGeometry"]["points"])
+        )
+        if len(coords) < 2:
+            continue
+
+        route = CompiledRoute(coords)
+        line = route.line
+        point = Point(loc["lon"], loc["lat"])
+        distance = line.project(point)
+        p1 = line.interpolate(max(0.0, distance - 1e-4))
+        p2 = line.interpolate(min(line.length, distance + 1e-4))
+        heading = calculate_bearing((p1.x, p1.y), (p2.x, p2.y))
+        cases.append((route, point, heading, distance))
+    return cases
+
+
+def build_cases(raw: list[dict[str, Any]], include_cold_load: bool) -> dict[str, Case]:
+    """
+    Prepares the inputs of every stage up front, so each case only times
+    its own stage.
+    """
+    service = TrainService(Redis())
+    deduped = service.dedupe_by_vehicle_id(raw)
+    with_counties = service.add_counties_to_locations(deduped)
+    processed = service.process_locations(with_counties)
+
+    polylines = [(loc, loc["trip"]["tripGeometry"]["points"]) for loc in with_counties]
+    decoded = [(loc, polyline.decode(points)) for loc, points in polylines]
+    heading_cases = _heading_cases(deduped)
+    decoded_arrays = [decode_lonlat(points) for _, points in polylines]
+    now = datetime.now(UTC)
+
+    def delay_and_position() -> None:
+        for loc, route_coords in decoded:
+            trip = loc["trip"]
+            get_delay_and_position(
+                now,
+                trip["serviceDate"],
+                trip["stoptimes"],
+                route_coords,
+                loc["lat"],
+                loc["lon"],
+                loc.get("heading"),
+            )
+
+    def projection(flip: bool, indexed: bool = False, hinted: bool = False) -> Case:
+        def run() -> None:
+            for route, point, heading, distance in heading_cases:
+                project_with_heading(
+                    route.line,
+                    point,
+                    (heading + 180) % 360 if flip else heading,
+                    route if indexed or hinted else None,
+                    distance if hinted else None,
+                )
+
+        return run
+
+    def polyline_decode(vectorized: bool) -> Case:
+        def run() -> None:
+            for _, points in polylines:
+                if vectorized:
+                    decode_unique_lonlat(points)
+                else:
+                    unique_lonlat_coords(polyline.decode(points))
+
+        return run
+
+    def polyline_encode(vectorized: bool) -> Case:
+        def run() -> None:
+            if vectorized:
+                for coords in decoded_arrays:
+                    encode_lonlat(coords)
+            else:
+                for _, route_coords in decoded:
+                    polyline.encode(route_coords)
+
+        return run
+
+    def route_lengths() -> None:
+        for coords in decoded_arrays:
+            path_length_km(coords)
+
+    def serialization() -> None:
+        for loc in processed:
+            json.dumps(loc)
+        json.dumps(service.build_feature_collection(processed, 0))
+
+    catalog = Catalog(0)
+    compacted = [catalog.compact(loc) for loc in processed]
+    catalog_document = catalog.document()
+    catalog_trips = {
+        digest: json.loads(trip) for digest, trip in catalog.unpublished_trips().items()
+    }
+
+    def vehicle_details() -> None:
+        for loc in compacted:
+            trip = catalog_trips[loc["trip"]["tripDigest"]]
+            build_details(loc, catalog_document, compact=False, trip=trip)
+
+    def process_locations_cold() -> None:
+        route_cache.clear()
+        train_service.position_hints.clear()
+        service.process_locations(with_counties)
+
+    def county_index_cold_load() -> None:
+        county.CountyIndex._instance = None
+        county.CountyIndex()._load()
+
+    cases: dict[str, Case] = {
+        "dedupe_by_vehicle_id": lambda: service.dedupe_by_vehicle_id(raw),
+        "add_counties_to_locations": lambda: service.add_counties_to_locations(deduped),
+        "process_locations": lambda: service.process_locations(with_counties),
+        "process_locations[cold]": process_locations_cold,
+        "get_delay_and_position": delay_and_position,
+        "project_with_heading[aligned]": projection(flip=False),
+        "project_with_heading[fallback]": projection(flip=True),
+        "project_with_heading[fallback,strtree]": projection(flip=True, indexed=True),
+        "project_with_heading[hinted]": projection(flip=False, hinted=True),
+        "polyline_decode[polyline]": polyline_decode(vectorized=False),
+        "polyline_decode[numpy]": polyline_decode(vectorized=True),
+        "polyline_encode[polyline]": polyline_encode(vectorized=False),
+        "polyline_encode[numpy]": polyline_encode(vectorized=True),
+        "route_length": route_lengths,
+        "snapshot_serialization": serialization,
+        "vehicle_details": vehicle_details,
+    }
+    if include_cold_load:
+        cases["county_index_cold_load"] = county_index_cold_load
+    return cases
+
+
+def run(
+    fixture: Path, multipliers: list[int], repeat: int, only: str | None
+) -> dict[str, Any]:
+    base = load_fixture(fixture)
+    check_polyline_parity(base)
+    results = []
+
+    for multiplier in multipliers:
+        raw = scale_fleet(base, multiplier)
+        cases = build_cases(raw, include_cold_load=multiplier == multipliers[0])
+
+        for name, case in cases.items():
+            if only and only not in name:
+                continue
+
+            timings = time_case(case, repeat)
+            median = statistics.median(timings)
+            results.append(
+                {
+                    "name": name,
+                    "multiplier": multiplier,
+                    "vehicles": len(raw),
+                    "repeat": repeat,
+                    "min": min(timings),
+                    "median": median,
+                    "mean": statistics.fmean(timings),
+                    "perVehicleUs": median / len(raw) * 1e6,
+                }
+            )
+            print(
+                f"{name:<34} x{multiplier:<3} {len(raw):>6} vehicles  "
+                f"median {median * 1000:9.2f} ms  "
+                f"({median / len(raw) * 1e6:8.1f} us/vehicle)"
+            )
+
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "timestamp": datetime.now(UTC).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "commit": _git_commit(),
+            "fixture": fixture.name,
+        },
+        "results": results,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any]) -> float:
+    """
+    Prints the median ratio of every case present in both runs and returns
+    the worst slowdown (0.25 means 25% slower).
+    """
+    previous = {(r["name"], r["multiplier"]): r for r in baseline["results"]}
+    worst = 0.0
+
+    print(f"\nCompared to {baseline['meta'].get('commit') or 'baseline'}:")
+    for result in current["results"]:
+        before = previous.get((result["name"], result["multiplier"]))
+        if not before:
+            continue
+
+        change = result["median"] / before["median"] - 1
+        worst = max(worst, change)
+        print(f"{result['name']:<34} x{result['multiplier']:<3} {change:+8.1%}")
+
+    return worst
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixture", type=Path, default=DEFAULT_FIXTURE)
+    parser.add_argument(
+        "--multipliers",
+        default="1,5",
+        help="comma separated synthetic fleet multipliers (1-50)",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="only run cases containing this string")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="results JSON to compare to")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        help="exit with an error if any case got slower by more than this",
+    )
+    args = parser.parse_args()
+
+    multipliers = [int(m) for m in args.multipliers.split(",")]
+    if any(not 1 <= m <= 50 for m in multipliers):
+        parser.error("multipliers must be between 1 and 50")
+
+    results = run(args.fixture, multipliers, args.repeat, args.only)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.compare:
+        worst = compare(results, json.loads(args.compare.read_text()))
+        if args.max_regression is not None and worst > args.max_regression:
+            sys.exit(f"Regression of {worst:.1%} exceeds {args.max_regression:.1%}")
+
+
+if __name__ == "__main__":
+    main()
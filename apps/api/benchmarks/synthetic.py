@@ -0,0 +1,215 @@
+"""
+Synthetic vehiclePositions snapshots, for when no recorded snapshot is at
+hand. Trains run on a handful of main lines between real station locations.
+"""
+
+import itertools
+import math
+import random
+from datetime import datetime
+from typing import Any
+
+import polyline  # type: ignore[import-untyped]
+
+from api.util.time import BUDAPEST_TZ
+
+LINES: dict[str, list[tuple[str, float, float]]] = {
+    "1": [
+        ("Budapest-Keleti", 47.5003, 19.0838),
+        ("Kelenföld", 47.4647, 19.0210),
+        ("Budaörs", 47.4614, 18.9581),
+        ("Bicske", 47.4903, 18.6389),
+        ("Tatabánya", 47.5850, 18.3950),
+        ("Tata", 47.6500, 18.3200),
+        ("Komárom", 47.7436, 18.1236),
+        ("Győr", 47.6810, 17.6360),
+        ("Mosonmagyaróvár", 47.8717, 17.2694),
+        ("Hegyeshalom", 47.9103, 17.1564),
+    ],
+    "100a": [
+        ("Budapest-Nyugati", 47.5106, 19.0567),
+        ("Kőbánya-Kispest", 47.4630, 19.1480),
+        ("Vecsés", 47.4072, 19.2653),
+        ("Üllő", 47.3869, 19.3411),
+        ("Monor", 47.3500, 19.4470),
+        ("Pilis", 47.2872, 19.5461),
+        ("Albertirsa", 47.2503, 19.6136),
+        ("Cegléd", 47.1737, 19.7980),
+        ("Abony", 47.1842, 20.0033),
+        ("Szolnok", 47.1720, 20.1890),
+    ],
+    "100": [
+        ("Szolnok", 47.1720, 20.1890),
+        ("Törökszentmiklós", 47.1830, 20.4110),
+        ("Fegyvernek", 47.2594, 20.5314),
+        ("Kisújszállás", 47.2170, 20.7540),
+        ("Karcag", 47.3130, 20.9190),
+        ("Püspökladány", 47.3160, 21.1150),
+        ("Kaba", 47.3564, 21.2744),
+        ("Hajdúszoboszló", 47.4442, 21.3919),
+        ("Debrecen", 47.5210, 21.6270),
+        ("Nyíregyháza", 47.9553, 21.7125),
+    ],
+    "140": [
+        ("Cegléd", 47.1737, 19.7980),
+        ("Nagykőrös", 47.0322, 19.7803),
+        ("Kecskemét", 46.9114, 19.6953),
+        ("Kiskunfélegyháza", 46.7131, 19.8467),
+        ("Kistelek", 46.4731, 19.9794),
+        ("Szeged", 46.2400, 20.1430),
+    ],
+    "80": [
+        ("Budapest-Keleti", 47.5003, 19.0838),
+        ("Rákos", 47.4894, 19.1806),
+        ("Gödöllő", 47.5972, 19.3589),
+        ("Aszód", 47.6553, 19.4814),
+        ("Hatvan", 47.6650, 19.6683),
+        ("Füzesabony", 47.7497, 20.4122),
+        ("Mezőkövesd", 47.8086, 20.5681),
+        ("Miskolc-Tiszai", 48.1053, 20.8028),
+    ],
+    "30": [
+        ("Budapest-Déli", 47.5000, 19.0240),
+        ("Kelenföld", 47.4647, 19.0210),
+        ("Érd alsó", 47.3856, 18.9281),
+        ("Martonvásár", 47.3158, 18.7900),
+        ("Székesfehérvár", 47.1817, 18.4150),
+        ("Siófok", 46.9092, 18.0494),
+        ("Balatonszárszó", 46.8261, 17.8275),
+        ("Fonyód", 46.7439, 17.5581),
+        ("Balatonszentgyörgy", 46.6831, 17.3022),
+        ("Nagykanizsa", 46.4486, 16.9942),
+    ],
+}
+
+ROUTES = {
+    "1": ("IC", "RAIL"),
+    "100a": ("S50", "SUBURBAN_RAILWAY"),
+    "100": ("IC", "RAIL"),
+    "140": ("G43", "RAIL"),
+    "80": ("Z20", "RAIL"),
+    "30": ("IC", "RAIL"),
+}
+
+# Distance between generated route vertices, in degrees (roughly 250 m)
+VERTEX_SPACING = 0.0025
+
+
+def _route_coords(
+    stations: list[tuple[str, float, float]],
+) -> list[tuple[float, float]]:
+    coords: list[tuple[float, float]] = []
+    for (_, lat1, lon1), (_, lat2, lon2) in itertools.pairwise(stations):
+        steps = max(2, int(math.hypot(lat2 - lat1, lon2 - lon1) / VERTEX_SPACING))
+        for i in range(steps):
+            t = i / steps
+            # Gentle curves between stations
+            wiggle = 0.004 * math.sin(t * math.pi * 3)
+            coords.append((lat1 + (lat2 - lat1) * t + wiggle, lon1 + (lon2 - lon1) * t))
+    coords.append((stations[-1][1], stations[-1][2]))
+    return coords
+
+
+def generate_snapshot(
+    vehicle_count: int, seed: int = 42, now: datetime | None = None
+) -> list[dict[str, Any]]:
+    """
+    Generates `vehicle_count` trains spread along the lines above, running
+    both directions with random delays.
+    """
+    rng = random.Random(seed)
+    now = (now or datetime.now(BUDAPEST_TZ)).astimezone(BUDAPEST_TZ)
+    service_date = now.strftime("%Y-%m-%d")
+    seconds_now = now.hour * 3600 + now.minute * 60 + now.second
+    line_ids = list(LINES)
+
+    locations = []
+    for idx in range(vehicle_count):
+        line_id = rng.choice(line_ids)
+        stations = LINES[line_id]
+        if rng.random() < 0.5:
+            stations = stations[::-1]
+
+        coords = _route_coords(stations)
+        route_short_name, mode = ROUTES[line_id]
+        delay = max(0, int(rng.gauss(120, 300)))
+
+        # Place the train somewhere along its route, with GPS noise
+        vertex = rng.randrange(len(coords) - 1)
+        progress = vertex / (len(coords) - 1)
+        lat, lon = coords[vertex]
+        lat += rng.uniform(-3e-4, 3e-4)
+        lon += rng.uniform(-3e-4, 3e-4)
+        next_lat, next_lon = coords[vertex + 1]
+        heading = math.degrees(math.atan2(next_lon - lon, next_lat - lat)) % 360
+
+        leg_seconds = 15 * 60
+        start = int(seconds_now - progress * leg_seconds * (len(stations) - 1))
+        stoptimes = []
+        for stop_idx, (name, stop_lat, stop_lon) in enumerate(stations):
+            arrival = start + stop_idx * leg_seconds
+            departure = arrival + (0 if stop_idx == 0 else 60)
+            stoptimes.append(
+                {
+                    "scheduledArrival": arrival,
+                    "realtimeArrival": arrival + delay,
+                    "scheduledDeparture": departure,
+                    "realtimeDeparture": departure + delay,
+                    "stop": {
+                        "name": name,
+                        "lat": stop_lat,
+                        "lon": stop_lon,
+                        "platformCode": str(rng.randint(1, 8)),
+                    },
+                }
+            )
+
+        locations.append(
+            {
+                "vehicleId": f"bench:{idx:05d}",
+                "lat": lat,
+                "lon": lon,
+                "heading": heading,
+                "speed": round(rng.uniform(10, 40), 1) if rng.random() > 0.1 else None,
+                "lastUpdated": int(now.timestamp()) - rng.randint(0, 90),
+                "trip": {
+                    "stoptimes": stoptimes,
+                    "serviceDate": service_date,
+                    "tripShortName": f"{rng.randint(1000, 9999)} "
+                    f"{stations[0][0].split('-')[0]}",
+                    "route": {
+                        "mode": mode,
+                        "textColor": "FFFFFF",
+                        "shortName": route_short_name,
+                        "longName": f"{stations[0][0]} - {stations[-1][0]}",
+                    },
+                    "tripGeometry": {"points": polyline.encode(coords)},
+                    "wheelchairAccessible": "POSSIBLE",
+                    "bikesAllowed": "ALLOWED",
+                    "infoServices": [
+                        {
+                            "name": route_short_name,
+                            "fromStopIndex": 0,
+                            "tillStopIndex": len(stations) - 1,
+                            "fontCharSet": "Mav",
+                            "fontCode": 1,
+                            "displayable": True,
+                        }
+                    ],
+                    "alerts": (
+                        [
+                            {
+                                "alertDescriptionText": "Pályafelújítás miatt "
+                                "a vonatok késve közlekednek.",
+                                "alertUrl": None,
+                                "effectiveStartDate": int(now.timestamp()) - 86400,
+                                "effectiveEndDate": int(now.timestamp()) + 86400,
+                            }
+                        ]
+                        if rng.random() < 0.15
+                        else []
+                    ),
+                },
+            }
+        )
+    return locations
@@ -0,0 +1,79 @@
+"""
+Exports the archived snapshots of a feed to a file, for offline analysis or
+to replay through the load harness (benchmarks/load.py --replay).
+
+    uv run python scripts/export-archive.py archive.mhar \\
+        --start 2026-10-18T06:00 --end 2026-10-18T09:00
+
+Whole segments are exported, so the file may start up to
+ARCHIVE_SEGMENT_SECONDS before --start and end after --end. Naive times are
+taken as UTC.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import UTC, datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("GRAPHQL_ENDPOINT", "http://localhost/graphql")
+
+from redis.asyncio import Redis
+
+from api.core.config import settings
+from api.services.archive import iter_archived_frames
+from api.util.archive import write_archive_file
+
+
+def timestamp_ms(value: str) -> int:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=UTC)
+    return int(moment.timestamp() * 1000)
+
+
+async def export(args: argparse.Namespace) -> None:
+    feeds = {feed.name: feed for feed in settings.FEEDS}
+    if args.feed not in feeds:
+        sys.exit(f"Unknown feed: {args.feed}")
+
+    if args.redis_url:
+        redis = Redis.from_url(args.redis_url)
+    else:
+        redis = Redis(host=settings.REDIS_HOST, port=6379, db=0)
+    try:
+        frames = [
+            frame
+            async for frame in iter_archived_frames(
+                redis,
+                feeds[args.feed].key_namespace,
+                timestamp_ms(args.start),
+                timestamp_ms(args.end),
+            )
+        ]
+    finally:
+        await redis.aclose()
+
+    written = write_archive_file(args.output, frames)
+    size = sum(len(frame) for frame in frames)
+    print(f"Exported {written} snapshots ({size / 1e6:.1f} MB) to {args.output}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--start", required=True, help="ISO 8601 time")
+    parser.add_argument("--end", required=True, help="ISO 8601 time")
+    parser.add_argument("--feed", default="default")
+    parser.add_argument("--redis-url", help="defaults to REDIS_HOST")
+    args = parser.parse_args()
+
+    asyncio.run(export(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Trains the zstd dictionary used to compress the per-vehicle values in Redis.
+
+Samples are the processed vehicle documents, compacted against the catalog
+and serialized exactly as the refresh stores them. Recorded fixtures (see
+benchmarks/record.py) give the most representative dictionary, synthetic
+fleets add variety on top.
+
+    uv run python scripts/train-zstd-dictionary.py \\
+        benchmarks/fixtures/vehicle_positions.json.gz --synthetic 400
+
+Values written with a previous dictionary can no longer be decoded, so the
+API and the worker must be deployed together after retraining. Every
+refresh rewrites the values anyway.
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import zstandard
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("GRAPHQL_ENDPOINT", "http://localhost/graphql")
+
+from redis.asyncio import Redis
+
+from api.core.redis import ZSTD_DICTIONARY_PATH
+from api.services.train_service import TrainService
+from api.util.catalog import Catalog
+from benchmarks.fixtures import DEFAULT_FIXTURE, load_fixture
+from benchmarks.synthetic import generate_snapshot
+
+# zstd's default dictionary size, larger ones stopped paying off
+DICTIONARY_SIZE = 110 * 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("fixtures", type=Path, nargs="*", default=[DEFAULT_FIXTURE])
+    parser.add_argument(
+        "--synthetic", type=int, default=400, help="synthetic vehicles to add"
+    )
+    parser.add_argument("--size", type=int, default=DICTIONARY_SIZE)
+    parser.add_argument("--output", type=Path, default=ZSTD_DICTIONARY_PATH)
+    args = parser.parse_args()
+
+    snapshots = [load_fixture(path) for path in args.fixtures]
+    if args.synthetic:
+        snapshots.append(generate_snapshot(args.synthetic, seed=7))
+
+    service = TrainService(Redis())
+    catalog = Catalog(0)
+    samples = [
+        json.dumps(catalog.compact(loc)).encode()
+        for locations in snapshots
+        for loc in service.process_locations(
+            service.add_counties_to_locations(locations)
+        )
+    ]
+
+    dictionary = zstandard.train_dictionary(args.size, samples)
+    args.output.write_bytes(dictionary.as_bytes())
+
+    compressor = zstandard.ZstdCompressor(dict_data=dictionary)
+    plain = sum(len(sample) for sample in samples)
+    compressed = sum(len(compressor.compress(sample)) for sample in samples)
+    print(
+        f"Trained {len(dictionary.as_bytes())} byte dictionary "
+        f"(id {dictionary.dict_id()}) on {len(samples)} documents, "
+        f"{plain / compressed:.1f}x on the training set"
+    )
+    print(f"Written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()